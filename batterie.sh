@@ -1,16 +1,26 @@
 #!/bin/bash
+
+. "$(dirname "$0")/gatt_cache.sh"
+
 if [ "$(id -u)" != "0" ]; then
    echo "Dieses Script muss vom Root-User oder per sudo gestartet werden!" 1>&2
    exit 1
 fi
 
+# Ist python-gatt installiert, übernimmt battery_survey.py. Es sucht
+# durchgehend weiter, fragt mehrere Geräte gleichzeitig ab und gibt am Ende
+# einen Bericht aus
+if python3 -c "import gatt" 2> /dev/null; then
+    exec python3 "$(dirname "$0")/battery_survey.py" "$@"
+fi
+
 # Sicherstellen, dass letztes Kommando der folgenden Pipe nicht in einer
 # Subshell läuft
 shopt -s lastpipe
 
-# Liste aller erkannten Geräte führen, damit das gleiche Gerät nicht mehrfach
+# Menge aller erkannten Geräte führen, damit das gleiche Gerät nicht mehrfach
 # abgefragt wird
-ALLMACS=()
+declare -A ALLMACS
 
 while true; do  
     echo "Suche nach Bluetooth-LE-Geräten ..."
@@ -30,12 +40,12 @@ while true; do
 		OID=`echo $MAC | cut -d':' -f 1-3`
 	    
 		# check, ob dieses Gerät schon einmal erkannt wurde
-		if ! [[ ${ALLMACS[*]} =~ $MAC ]]; then
+		if [ -z "${ALLMACS[$MAC]}" ]; then
 		    echo "Neues Gerät erkannt: $MAC"
 		
-		    # Neues Gerät an Liste der bisher erkannten Geräte
-		    # anhängen
-		    ALLMACS+=($MAC)
+		    # Neues Gerät in die Menge der bisher erkannten Geräte
+		    # aufnehmen
+		    ALLMACS[$MAC]=1
 		
 		    # Neues Gerät erkannt, beende Suche
 		    killall -s SIGINT hcitool
@@ -46,24 +56,14 @@ while true; do
 
     # Gerät(e) erkannt -> untersuche es
 
-    # Finde "Battery Service"
-    BATT_SRV=`gatttool -b $MAC --primary -u 0000180f-0000-1000-8000-00805f9b34fb`
-    if [ "$BATT_SRV" != "" ]; then
-	SH=`echo $BATT_SRV | cut -d' ' -f3`
-	EH=`echo $BATT_SRV | cut -d' ' -f6`
-	echo "Batterie-Service-Handles: $SH bis $EH"
-
-	# Hole alle Charakteristiken dieses Dienstes
-	BATT_LVL_CHAR=`gatttool -b $MAC --char-desc -s 0x$SH -e 0x$EH | grep 00002a19-0000-1000-8000-00805f9b34fb`
-	
-	# Die Charakteristik-Beschreibung ist Komma-separiert
-	BATT_LVL_VALUE_HDL=`echo $BATT_LVL_CHAR | cut -d',' -f1 | cut -d'=' -f2`
-	if [ "$BATT_LVL_VALUE_HDL" != "" ]; then
-	    echo "Batterie-Level-Charakteristik-Handle: $BATT_LVL_VALUE_HDL"
-	    BATT_LVL=`gatttool -b $MAC --char-read -a $BATT_LVL_VALUE_HDL | cut -d':' -f2- | tr -d '[:space:]'`
-	    if [ "$BATT_LVL" != "" ]; then
-		echo "Batterie-Level: $((16#$BATT_LVL))%"
-	    fi
+    # Handle der Batterie-Level-Charakteristik, aus dem Cache oder per
+    # gatttool, siehe gatt_cache.sh
+    BATT_LVL_VALUE_HDL=`gatt_value_handle $MAC 0000180f-0000-1000-8000-00805f9b34fb 00002a19-0000-1000-8000-00805f9b34fb`
+    if [ "$BATT_LVL_VALUE_HDL" != "" ]; then
+	echo "Batterie-Level-Charakteristik-Handle: $BATT_LVL_VALUE_HDL"
+	BATT_LVL=`gatttool -b $MAC --char-read -a $BATT_LVL_VALUE_HDL | cut -d':' -f2- | tr -d '[:space:]'`
+	if [ "$BATT_LVL" != "" ]; then
+	    echo "Batterie-Level: $((16#$BATT_LVL))%"
 	fi
     else
 	echo "Kein Batterie-Service vorhanden"
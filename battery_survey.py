@@ -0,0 +1,195 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Verwendet python-gatt
+# https://github.com/getsenic/gatt-python
+
+# Batteriestand aller Bluetooth-LE-Geräte in Reichweite erfassen, z.B. aller
+# Controller eines Klassensatzes.
+#
+# batterie.sh beendet die Suche bei jedem neuen Gerät, fragt es mit drei
+# gatttool-Aufrufen nacheinander ab und startet die Suche danach neu. Hier
+# läuft die Suche durchgehend weiter, gefundene Geräte kommen in eine
+# Warteschlange und bis zu --parallel Geräte werden gleichzeitig verbunden
+# und ihr Battery Level (0x2a19) gelesen. Bereits gefundene Geräte werden
+# über eine Menge der MAC-Adressen übergangen. Die Handles werden über
+# gatt_cache.py zwischengespeichert.
+#
+# Am Ende (nach --duration Sekunden, --count Geräten oder Ctrl-C) wird ein
+# Bericht als JSON oder CSV ausgegeben, ein Eintrag je Gerät.
+#
+# Aufruf z.B.: sudo python3 battery_survey.py --duration 60 --parallel 5 --toys
+
+import sys, time, json, argparse
+from collections import deque
+
+import discovery
+import gatt_cache
+import toy_profiles
+from multi_hub import MultiDeviceManager
+
+try:
+    import gatt
+    from gi.repository import GLib
+except ModuleNotFoundError as e:
+    print("Error loading gatt module:", e);
+    print("You may install it via 'pip3 install gatt' ...");
+    exit(-1);
+
+BATTERY_LEVEL = ("0000180f-0000-1000-8000-00805f9b34fb", "00002a19-0000-1000-8000-00805f9b34fb")
+
+# Fehler von BlueZ, nach denen ein späterer Versuch lohnt
+RETRY_ERRORS = ( "org.bluez.Error.InProgress", "org.bluez.Error.NotReady",
+                 "org.bluez.Error.Failed" )
+
+class BatteryDevice(gatt_cache.CachedLayout, gatt.Device):
+    CHARACTERISTICS = ( BATTERY_LEVEL, )
+    timer = None
+
+    def connect(self):
+        # python-gatt verbindet blockierend, damit wäre immer nur ein Gerät in
+        # Arbeit. Connect wird daher asynchron an BlueZ geschickt, Verbindung
+        # und aufgelöste Services meldet BlueZ über die üblichen Signale
+        self._connect_signals()
+        self._object.Connect(reply_handler=lambda: None,
+                             error_handler=self.connect_error)
+        self.timer = GLib.timeout_add_seconds(self.manager.timeout, self.timed_out)
+
+    def connect_error(self, error):
+        self.manager.failed(self, str(error.get_dbus_message()),
+                            retry=error.get_dbus_name() in RETRY_ERRORS)
+
+    def timed_out(self):
+        self.timer = None
+        self.manager.failed(self, "timeout", retry=False)
+        return False
+
+    def services_resolved(self):
+        super().services_resolved()
+        characteristic = self.layout.get(BATTERY_LEVEL)
+        if characteristic:
+            characteristic.read_value()
+        else:
+            self.manager.failed(self, "kein Battery Service", retry=False)
+
+    def characteristic_value_updated(self, characteristic, value):
+        super().characteristic_value_updated(characteristic, value)
+        if len(value) >= 1:
+            self.manager.level(self, value[0])
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        super().characteristic_read_value_failed(characteristic, error)
+        self.manager.failed(self, str(error), retry=False)
+
+    def finish(self):
+        # Verbindung trennen und Platz für das nächste Gerät freigeben
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+            self.timer = None
+        if self.is_connected():
+            self.disconnect()
+        else:
+            self._object.Disconnect(reply_handler=lambda: None, error_handler=lambda error: None)
+            self.manager.device_lost(self)
+
+class BatterySurvey(MultiDeviceManager):
+    def __init__(self, parallel=5, timeout=20, retries=2, toys_only=False,
+                 count=None, adapter_name='hci0'):
+        super().__init__(lambda device: None, adapter_name=adapter_name, max_devices=parallel)
+        self.timeout = timeout
+        self.retries = retries
+        self.toys_only = toys_only
+        self.count = count
+        self.seen = set()
+        self.waiting = deque()
+        self.report = { }
+
+    def device_discovered(self, device):
+        mac_address = device.mac_address
+        if mac_address in self.seen:
+            return
+        self.seen.add(mac_address)
+
+        name = device.alias()
+        profile = toy_profiles.identify_advertisement(mac_address, name)
+        if self.toys_only and profile is None:
+            return
+        self.report[mac_address] = { "mac": mac_address, "name": name,
+                                     "profile": profile.name if profile else None,
+                                     "level": None, "error": None, "attempts": 0,
+                                     "time": None }
+        self.waiting.append(mac_address)
+        self.start_next()
+
+    def start_next(self):
+        while self.waiting and len(self.hubs) < self.max_devices:
+            mac_address = self.waiting.popleft()
+            self.report[mac_address]["attempts"] += 1
+            self.add(BatteryDevice, mac_address)
+
+    def level(self, hub, level):
+        entry = self.report[hub.mac_address]
+        entry["level"] = level
+        entry["error"] = None
+        entry["time"] = round(time.monotonic() - self.started, 1)
+        print("{}  {:3d}%  {}".format(hub.mac_address, level, entry["name"]), file=sys.stderr)
+        if self.hubs.get(hub.mac_address) is hub:
+            hub.finish()
+        if self.count and sum(1 for e in self.report.values() if e["level"] is not None) >= self.count:
+            self.quit()
+
+    def failed(self, hub, error, retry):
+        # späte Fehler eines bereits abgeschlossenen Geräts übergehen
+        if self.hubs.get(hub.mac_address) is not hub:
+            return
+        entry = self.report[hub.mac_address]
+        entry["error"] = error
+        if retry and entry["attempts"] <= self.retries:
+            self.waiting.append(hub.mac_address)
+        hub.finish()
+
+    def device_lost(self, hub):
+        if self.hubs.get(hub.mac_address) is hub:
+            del self.hubs[hub.mac_address]
+        self.start_next()
+
+    def survey(self, duration=None):
+        self.started = time.monotonic()
+        if duration:
+            GLib.timeout_add_seconds(duration, lambda: self.quit() or False)
+        discovery.start_discovery(self)
+        self.run()
+        return sorted(self.report.values(), key=lambda entry: entry["mac"])
+
+def write_report(entries, format, file):
+    if format == "json":
+        json.dump(entries, file, indent=2)
+        file.write("\n")
+    else:
+        file.write("mac,name,profile,level,error\n")
+        for entry in entries:
+            file.write(",".join("" if entry[key] is None else str(entry[key]).replace(",", " ")
+                                for key in ("mac", "name", "profile", "level", "error")) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batteriestand aller BLE-Geräte in Reichweite")
+    parser.add_argument("--parallel", type=int, default=5, help="gleichzeitige Verbindungen")
+    parser.add_argument("--timeout", type=int, default=20, help="Sekunden je Gerät")
+    parser.add_argument("--duration", type=int, help="Suche nach Sekunden beenden")
+    parser.add_argument("--count", type=int, help="nach so vielen gelesenen Geräten beenden")
+    parser.add_argument("--toys", action="store_true", help="nur bekannte Spielzeug-Controller")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--output", help="Datei für den Bericht (Standard: stdout)")
+    parser.add_argument("--adapter", default="hci0")
+    args = parser.parse_args()
+
+    survey = BatterySurvey(parallel=args.parallel, timeout=args.timeout, toys_only=args.toys,
+                           count=args.count, adapter_name=args.adapter)
+    print("Suche nach Bluetooth-LE-Geräten, Beenden mit Ctrl-C ...", file=sys.stderr)
+    entries = survey.survey(args.duration)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            write_report(entries, args.format, f)
+    else:
+        write_report(entries, args.format, sys.stdout)
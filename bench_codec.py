@@ -0,0 +1,341 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark-Suite für das Kodieren und Dekodieren der Meldungen.
+#
+# Dekodiert werden die Meldungen des Korpus bench_corpus.cap (Format von
+# capture.py): LWP3-Meldungen über lwp3.Decoder, WeDo-2.0-Meldungen über
+# WeDoDevice.characteristic_value_updated, da es dafür keinen eigenen
+# Decoder gibt. Kodiert wird über die Kommando-Routinen von BoostDevice
+# (send_cmd, motor_run_angle, led_set_color, ...) und WeDoDevice bis zur
+# Übergabe an die Sendewarteschlange.
+#
+# Je Meldungstyp bzw. Kommando werden ermittelt:
+#   messages_per_second  Durchsatz ohne Einzelzeitmessung
+#   blocks_per_message   Speicherblöcke, die je Meldung neu belegt bleiben
+#                        (sys.getallocatedblocks, das Ergebnis wird bis zur
+#                        Messung festgehalten)
+#   p50_ns ... max_ns    Laufzeit je Aufruf, bereinigt um die Kosten der
+#                        Zeitmessung selbst
+#
+# Das Ergebnis als JSON (--json) lässt sich mit --compare gegen einen
+# früheren Lauf prüfen. Fällt ein Durchsatz um mehr als --tolerance Prozent,
+# endet das Programm mit Status 1.
+#
+# Aufruf z.B.: python3 bench_codec.py --json neu.json --compare alt.json
+#
+# Der Korpus wurde gegen hub_sim.py aufgezeichnet und lässt sich mit
+# --record neu erzeugen.
+
+import os, io, sys, gc, json, time, argparse, platform, contextlib
+
+import offline_gatt
+offline_gatt.install()
+
+import gatt_cache
+import capture
+import lwp3
+import hub_sim
+import toy_log
+import port_modes
+
+gatt_cache.CachedLayout.layout_cache = None
+# der Korpus soll alle Port-Anfragen und -Antworten enthalten
+port_modes.cache = None
+
+from lego_hub_monitor import BoostDevice
+from lego_wedo_dino import WeDoDevice
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_corpus.cap")
+
+# Aufrufe je Messgröße und Meldungstyp. Der Durchsatz ist der beste von
+# REPEAT Teilläufen, das dämpft Störungen durch andere Prozesse
+CALLS = 20000
+REPEAT = 5
+
+# Moduswahl der Sensor-Ports für die Aufzeichnung: Port -> Modus
+RECORD_MODES = { "technic": { 0x00: 2, 0x01: 1, 0x02: 3, 0x3b: 0, 0x3c: 0, 0x3d: 0,
+                              0x61: 0, 0x62: 0, 0x63: 0, 0x64: 0 },
+                 "boost": { 0x00: 2, 0x01: 2, 0x02: 8, 0x03: 2, 0x3a: 0 } }
+
+# -----------------------------------------------------------------------------
+# Korpus
+# -----------------------------------------------------------------------------
+
+def record(filename, seconds=2.0, rate=20):
+    # Korpus gegen simulierte Hubs aufzeichnen: Start mit Attach-Meldungen
+    # und Port-Informationen, dann Sensorwerte und Motor-Kommandos
+    recorder = capture.Capture(filename, "lego_hub_monitor.py")
+    capture.install(recorder)
+    manager = offline_gatt.DeviceManager()
+    devices = [ ]
+    for mac, peripheral in hub_sim.fleet("technic,boost,wedo", rate=rate):
+        offline_gatt.add_peripheral(mac, peripheral)
+        cls = WeDoDevice if isinstance(peripheral, hub_sim.WeDoHubSim) else BoostDevice
+        device = cls(mac_address=mac, manager=manager)
+        device.connect()
+        devices.append((device, peripheral))
+
+    def run(duration):
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            manager.run_pending()
+            time.sleep(0.001)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # die Port-Informationen aller Ports abwarten
+        run(6)
+        for device, peripheral in devices:
+            if isinstance(device, BoostDevice):
+                modes = RECORD_MODES["boost" if peripheral.name == "LEGO Move Hub" else "technic"]
+                for port, mode in modes.items():
+                    device.generic_set_mode(port, mode)
+                for angle in (90, -180, 360):
+                    device.motor_run_angle(0, 50, angle, queued=True)
+                device.motor_run_time(1, -30, 0.5, queued=True)
+                device.led_set_color("blue")
+        run(seconds)
+        toy_log.log.flush()
+    recorder.close()
+    return recorder.events
+
+def load_corpus(filename=CORPUS):
+    # liefert ({ Typ: [ LWP3-Meldung ] }, { Charakteristik: [ WeDo-Meldung ] })
+    _, events = capture.load(filename)
+    lwp3_messages = { }
+    wedo_messages = { }
+    for _, kind, mac, service, uuid, data in events:
+        if kind != capture.NOTIFICATION:
+            continue
+        if uuid == hub_sim.LWP3_CHARACTERISTIC:
+            lwp3_messages.setdefault("0x%02x" % data[2], [ ]).append(data)
+        else:
+            wedo_messages.setdefault(uuid, [ ]).append(data)
+    return lwp3_messages, wedo_messages
+
+# -----------------------------------------------------------------------------
+# Messung
+# -----------------------------------------------------------------------------
+
+def timer_overhead():
+    clock = time.perf_counter_ns
+    samples = sorted(clock() - clock() for _ in range(10000))
+    return -samples[len(samples) // 2]
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure(function, inputs, overhead, calls=CALLS):
+    # function(x) für alle x aus inputs, so oft wiederholt, dass etwa calls
+    # Aufrufe zusammenkommen
+    rounds = max(1, calls // len(inputs) // REPEAT)
+    clock = time.perf_counter_ns
+    gc.collect()
+    gc.disable()
+    try:
+        elapsed = None
+        for _ in range(REPEAT):
+            start = clock()
+            for _ in range(rounds):
+                for x in inputs:
+                    function(x)
+            duration = clock() - start
+            if elapsed is None or duration < elapsed:
+                elapsed = duration
+
+        results = [ None ] * len(inputs)
+        before = sys.getallocatedblocks()
+        for i, x in enumerate(inputs):
+            results[i] = function(x)
+        blocks = (sys.getallocatedblocks() - before) / len(inputs)
+        del results
+
+        timings = [ ]
+        for _ in range(rounds * REPEAT):
+            for x in inputs:
+                t0 = clock()
+                function(x)
+                timings.append(clock() - t0 - overhead)
+    finally:
+        gc.enable()
+
+    timings.sort()
+    return { "count": rounds * REPEAT * len(inputs),
+             "messages_per_second": round(rounds * len(inputs) * 1e9 / elapsed),
+             "blocks_per_message": round(blocks, 2),
+             "p50_ns": max(0, percentile(timings, 0.5)),
+             "p99_ns": max(0, percentile(timings, 0.99)),
+             "p999_ns": max(0, percentile(timings, 0.999)),
+             "max_ns": max(0, timings[-1]) }
+
+class _Characteristic:
+    def __init__(self, name=None):
+        self.name = name
+        self.last = None
+
+    def write_value(self, data):
+        self.last = data
+
+class _Transport:
+    # nimmt die Kommandos von BoostDevice.send_cmd entgegen
+    def __init__(self):
+        self.last = None
+
+    def send(self, cmd_seq, key=None, port=None):
+        self.last = cmd_seq
+
+    def reply_received(self, event):
+        pass
+
+def decode_cases(lwp3_messages, wedo_messages):
+    decoder = lwp3.Decoder()
+    # Gerätetypen aus den Attach-Meldungen übernehmen
+    for value in lwp3_messages.get("0x04", [ ]):
+        decoder.decode(value)
+
+    cases = { "lwp3 " + kind: (decoder.decode, messages)
+              for kind, messages in sorted(lwp3_messages.items()) }
+
+    wedo = WeDoDevice(mac_address="A0:E6:F8:00:00:00", manager=offline_gatt.DeviceManager())
+    wedo.char_mode_set = wedo.char_output = _Characteristic()
+    plug_event = _Characteristic("plug_event")
+    value_event = _Characteristic("value_event")
+    for value in wedo_messages.get(hub_sim.WEDO_PORT_TYPE, [ ]):
+        wedo.characteristic_value_updated(plug_event, value)
+
+    def wedo_decoder(characteristic):
+        def decode(value):
+            wedo.output_in_progress = False
+            wedo.characteristic_value_updated(characteristic, value)
+            return wedo.char_output.last
+        return decode
+
+    if hub_sim.WEDO_PORT_TYPE in wedo_messages:
+        cases["wedo plug event"] = (wedo_decoder(plug_event), wedo_messages[hub_sim.WEDO_PORT_TYPE])
+    if hub_sim.WEDO_SENSOR_VALUE in wedo_messages:
+        cases["wedo sensor value"] = (wedo_decoder(value_event), wedo_messages[hub_sim.WEDO_SENSOR_VALUE])
+    return cases
+
+def encode_cases():
+    hub = BoostDevice(mac_address="90:84:2B:00:00:00", manager=offline_gatt.DeviceManager())
+    hub.transport = transport = _Transport()
+    wedo = WeDoDevice(mac_address="A0:E6:F8:00:00:00", manager=offline_gatt.DeviceManager())
+    wedo.char_output = output = _Characteristic()
+    wedo.port = [ "motor", "motion" ]
+
+    # gemessen wird das Kodieren, gleiche Werte nacheinander sollen nicht
+    # als schon gesendet entfallen (output_state.py)
+    def boost(command):
+        def encode(args):
+            hub.outputs.invalidate()
+            command(*args)
+            return transport.last
+        return encode
+
+    def wedo_output(command):
+        def encode(args):
+            wedo.output_in_progress = False
+            wedo.outputs.invalidate()
+            command(*args)
+            return output.last
+        return encode
+
+    ports = range(4)
+    return {
+        "lwp3 send_cmd": (boost(hub.send_cmd), [ (0x01, bytes([ p, 0x05 ])) for p in ports ]),
+        "lwp3 set_hub_property": (boost(hub.set_hub_property), [ (p, 0x05) for p in ports ]),
+        "lwp3 generic_set_mode": (boost(hub.generic_set_mode), [ (p, p) for p in ports ]),
+        "lwp3 led_set_color": (boost(hub.led_set_color), [ (c,) for c in (3, "blue", 9, "red") ]),
+        "lwp3 motor_run": (boost(hub.motor_run), [ (p, 50 - p) for p in ports ]),
+        "lwp3 motor_run_time": (boost(hub.motor_run_time), [ (p, 50, 1.5) for p in ports ]),
+        "lwp3 motor_run_angle": (boost(hub.motor_run_angle), [ (p, 50, 90 * p) for p in ports ]),
+        "lwp3 motors_run_angle": (boost(hub.motors_run_angle), [ (50, 40, 90 * p) for p in ports ]),
+        "lwp3 request_port_mode_information": (boost(hub.request_port_mode_information),
+                                               [ (p, 0, 0x80) for p in ports ]),
+        "wedo set_color": (wedo_output(wedo.set_color), [ (c,) for c in range(10) ]),
+        "wedo set_motor": (wedo_output(wedo.set_motor), [ (s,) for s in (0, 50, 100, 25) ]),
+    }
+
+def run(corpus=CORPUS, calls=CALLS):
+    lwp3_messages, wedo_messages = load_corpus(corpus)
+    overhead = timer_overhead()
+    results = { "decode": { }, "encode": { } }
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for section, cases in (("decode", decode_cases(lwp3_messages, wedo_messages)),
+                               ("encode", encode_cases())):
+            for name, (function, inputs) in cases.items():
+                results[section][name] = measure(function, inputs, overhead, calls)
+        toy_log.log.flush()
+    return { "python": platform.python_version(),
+             "implementation": platform.python_implementation(),
+             "machine": platform.machine(),
+             "corpus": os.path.basename(corpus),
+             "timer_overhead_ns": overhead,
+             "results": results }
+
+def compare(report, baseline, tolerance):
+    # liefert die Liste der Einträge, deren Durchsatz um mehr als
+    # tolerance Prozent gefallen ist
+    regressions = [ ]
+    for section, entries in report["results"].items():
+        for name, entry in entries.items():
+            old = baseline["results"].get(section, { }).get(name)
+            if old is None:
+                continue
+            ratio = entry["messages_per_second"] / old["messages_per_second"]
+            print("{:8s} {:38s} {:10d} {:10d} {:+6.1f}%".format(
+                section, name, old["messages_per_second"], entry["messages_per_second"],
+                (ratio - 1) * 100))
+            if ratio < 1 - tolerance / 100:
+                regressions.append((section, name, ratio))
+    return regressions
+
+def print_report(report):
+    print("Python {} ({}), {}, Korpus {}".format(report["python"], report["implementation"],
+                                                 report["machine"], report["corpus"]))
+    for section, entries in report["results"].items():
+        print()
+        print("{:8s} {:38s} {:>10s} {:>7s} {:>7s} {:>7s} {:>8s}".format(
+            section, "", "Meldung/s", "Blöcke", "p50 ns", "p99 ns", "p99.9 ns"))
+        for name, entry in entries.items():
+            print("{:8s} {:38s} {:10d} {:7.2f} {:7d} {:7d} {:8d}".format(
+                "", name, entry["messages_per_second"], entry["blocks_per_message"],
+                entry["p50_ns"], entry["p99_ns"], entry["p999_ns"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark für Kodieren und Dekodieren der Meldungen")
+    parser.add_argument("--corpus", default=CORPUS, help="Korpus im Format von capture.py")
+    parser.add_argument("--calls", type=int, default=CALLS, help="Aufrufe je Meldungstyp")
+    parser.add_argument("--json", help="Ergebnis als JSON in diese Datei (- für stdout)")
+    parser.add_argument("--compare", help="früheres JSON-Ergebnis zum Vergleich")
+    parser.add_argument("--tolerance", type=float, default=10, help="erlaubter Rückgang in Prozent")
+    parser.add_argument("--record", action="store_true", help="Korpus gegen hub_sim.py neu aufzeichnen")
+    args = parser.parse_args()
+
+    if args.record:
+        print(record(args.corpus), "Meldungen aufgezeichnet in", args.corpus)
+        return 0
+
+    report = run(args.corpus, args.calls)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(report, baseline, args.tolerance)
+        for section, name, ratio in regressions:
+            print("Rückgang:", section, name, "{:.1f}%".format((1 - ratio) * 100))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
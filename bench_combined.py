@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der kombinierten Port-Values (0x46) gegenüber einzelnen
+# Port-Values (0x45) je Modus.
+#
+# Gemessen wird für dieselben Messwerte je Zeitpunkt, hier die drei
+# 3-Achsen-Werte des Technic-Hub-IMU (Beschleunigung, Drehrate, Lage, je
+# 3 x 16 Bit):
+#
+#   getrennt     drei 0x45-Meldungen wie nach drei generic_set_mode()
+#   kombiniert   eine 0x46-Meldung mit allen neun Werten
+#
+# 1. Dekodieren: Rechenzeit je Zeitpunkt in lwp3.Decoder und in
+#    BoostDevice.characteristic_value_updated (inkl. Ausgabe nach
+#    /dev/null).
+# 2. Funkstrecke: Zeitpunkte pro Sekunde und Alter beim Empfang über das
+#    Modell aus offline_gatt.py (15 ms Verbindungsintervall, 4 Pakete je
+#    Verbindungsereignis), der Hub liefert mit --rate Hz.
+#
+# Hinweis: LWP3 kombiniert nur Modi desselben Ports. Beim Technic Hub sind
+# Beschleunigung, Drehrate und Lage drei Ports, dort lassen sich z.B. Lage
+# und Stöße (0x3b, POS + IMP) kombinieren, bei den Motoren SPEED, POS und
+# APOS. Der Benchmark legt die drei IMU-Werte daher auf einen Port mit drei
+# 3 x 16-Bit-Modi, um gleiche Nutzdaten zu vergleichen.
+#
+# Aufruf: python3 bench_combined.py [--samples N] [--rate HZ] [--seconds S]
+
+import os, time, struct, argparse, contextlib
+
+import offline_gatt
+offline_gatt.install()
+
+import gatt_cache
+import port_modes
+import lwp3
+import hub_sim
+import toy_log
+
+gatt_cache.CachedLayout.layout_cache = None
+port_modes.cache = None
+
+from lego_hub_monitor import BoostDevice
+
+# Port -> Gerätetyp der IMU-Sensoren des Technic Hub
+IMU_PORTS = { 0x61: 0x39, 0x62: 0x3a, 0x63: 0x3b }
+COMBINED_PORT = 0x63
+COMBINED_MODES = ( 0, 1, 2 )
+# für den Vergleich: drei 3 x 16-Bit-Modi auf dem Lage-Port
+COMBINED_FORMATS = { (0x3b, mode): (3, 1) for mode in COMBINED_MODES }
+
+_S_3S16 = struct.Struct('<hhh')
+
+def message(type, payload):
+    return bytes([ len(payload) + 3, 0, type ]) + payload
+
+def attach_messages():
+    return [ message(lwp3.HUB_ATTACHED_IO, struct.pack('<BBHII', port, 1, dev, 0x10000000, 0x10000000))
+             for port, dev in IMU_PORTS.items() ]
+
+def sample_messages(seq, combined):
+    # Meldungen eines Zeitpunkts, seq steht im ersten Wert
+    values = [ (seq, 10 * i, -10 * i) for i in range(3) ]
+    if combined:
+        return [ message(lwp3.PORT_VALUE_COMBINED, struct.pack('<BH', COMBINED_PORT, 0x01ff) +
+                         b"".join(_S_3S16.pack(*v) for v in values)) ]
+    return [ message(lwp3.PORT_VALUE, bytes([ port ]) + _S_3S16.pack(*v))
+             for port, v in zip(IMU_PORTS, values) ]
+
+def setup_decoder(decoder):
+    for value in attach_messages():
+        decoder.decode(value)
+    decoder.value_formats.update(COMBINED_FORMATS)
+    decoder.set_combination(COMBINED_PORT, lwp3.combination_entries(
+        decoder.value_formats, IMU_PORTS[COMBINED_PORT], COMBINED_MODES))
+
+# --- 1. Dekodieren -----------------------------------------------------------
+
+def decode_cost(handler, samples, combined):
+    # Nanosekunden Rechenzeit je Zeitpunkt (bester von drei Durchläufen)
+    messages = [ m for seq in range(samples) for m in sample_messages(seq % 30000, combined) ]
+    best = None
+    for _ in range(3):
+        start = time.process_time_ns()
+        for value in messages:
+            handler(value)
+        elapsed = time.process_time_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / samples
+
+def decoder_handler():
+    decoder = lwp3.Decoder()
+    setup_decoder(decoder)
+    return decoder.decode
+
+class _Transport:
+    # nimmt die Port-Anfragen nach den Attach-Meldungen an, ohne zu senden
+    def send(self, cmd_seq, key=None, port=None):
+        pass
+
+    def reply_received(self, event):
+        pass
+
+class _Characteristic:
+    def write_value(self, data):
+        pass
+
+def device_handler():
+    device = BoostDevice(mac_address="00:00:00:00:00:00", manager=offline_gatt.DeviceManager())
+    device.transport = _Transport()
+    setup_decoder(device.decoder)
+    characteristic = _Characteristic()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for value in attach_messages():
+            device.characteristic_value_updated(characteristic, value)
+    return lambda value: device.characteristic_value_updated(characteristic, value)
+
+# --- 2. Funkstrecke ----------------------------------------------------------
+
+class ImuPeripheral(offline_gatt.Peripheral):
+    connection_interval = hub_sim.SimulatedPeripheral.connection_interval
+
+    def __init__(self, combined, rate):
+        super().__init__("Technic Hub", [ (hub_sim.LWP3_SERVICE, [ hub_sim.LWP3_CHARACTERISTIC ]) ])
+        self.combined = combined
+        self.rate = rate
+        self.device = None
+        self.seq = 0
+        self.sent = { }         # seq -> Zeitpunkt der Messung
+        self.running = False
+
+    def notifications(self, device, characteristic, enabled):
+        self.device = device
+        for value in attach_messages():
+            characteristic.notify(value)
+        self.running = enabled
+        if enabled:
+            device.manager.call_later(1 / self.rate, self.tick)
+
+    def tick(self):
+        if not self.running:
+            return
+        self.seq = (self.seq + 1) % 30000
+        self.sent[self.seq] = time.monotonic()
+        characteristic = self.device.characteristic(hub_sim.LWP3_CHARACTERISTIC)
+        for value in sample_messages(self.seq, self.combined):
+            characteristic.notify(value)
+        self.device.manager.call_later(1 / self.rate, self.tick)
+
+class ImuReceiver(offline_gatt.Device):
+    def __init__(self, mac_address, manager, peripheral):
+        super().__init__(mac_address, manager)
+        self.peripheral = peripheral
+        self.decoder = lwp3.Decoder()
+        self.decoder.value_formats.update(COMBINED_FORMATS)
+        self.notifications = 0
+        self.samples = 0
+        self.ages = [ ]
+        self.measuring = False
+
+    def services_resolved(self):
+        super().services_resolved()
+        self.characteristic(hub_sim.LWP3_CHARACTERISTIC).enable_notifications()
+
+    def characteristic_value_updated(self, characteristic, value):
+        event = self.decoder.decode(value)
+        if isinstance(event, lwp3.AttachedIOEvent) and event.port == COMBINED_PORT:
+            self.decoder.set_combination(COMBINED_PORT, lwp3.combination_entries(
+                self.decoder.value_formats, event.device, COMBINED_MODES))
+        if not self.measuring:
+            return
+        self.notifications += 1
+        if isinstance(event, lwp3.PortCombinedValueEvent):
+            seq = event.values[0][0]
+        elif isinstance(event, lwp3.PortValueEvent) and event.port == 0x63:
+            # letzte Meldung des Zeitpunkts
+            seq = event.values[0]
+        else:
+            return
+        self.samples += 1
+        sent = self.peripheral.sent.pop(seq, None)
+        if sent is not None:
+            self.ages.append(time.monotonic() - sent)
+
+def link(combined, rate, seconds):
+    manager = offline_gatt.DeviceManager()
+    peripheral = ImuPeripheral(combined, rate)
+    manager.add_peripheral("90:84:2B:00:00:01", peripheral)
+    device = ImuReceiver("90:84:2B:00:00:01", manager, peripheral)
+    device.connect()
+
+    def run(duration):
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            manager.run_pending()
+            time.sleep(0.0005)
+
+    run(0.2)
+    device.measuring = True
+    run(seconds)
+    device.measuring = False
+    peripheral.running = False
+    ages = sorted(device.ages) or [ 0 ]
+    return { "samples_per_second": device.samples / seconds,
+             "notifications_per_second": device.notifications / seconds,
+             "age_p50_ms": ages[len(ages) // 2] * 1000,
+             "age_max_ms": ages[-1] * 1000 }
+
+def main():
+    parser = argparse.ArgumentParser(description="Kombinierte (0x46) gegen einzelne (0x45) Port-Values")
+    parser.add_argument("--samples", type=int, default=20000, help="Zeitpunkte für die Rechenzeit")
+    parser.add_argument("--rate", type=float, default=200, help="Zeitpunkte pro Sekunde des Hubs")
+    parser.add_argument("--seconds", type=float, default=2, help="Messdauer Funkstrecke")
+    args = parser.parse_args()
+
+    print("Rechenzeit je Zeitpunkt (3 Modi x 3 Werte):")
+    for name, factory in (("lwp3.Decoder", decoder_handler), ("BoostDevice", device_handler)):
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            separate = decode_cost(factory(), args.samples, False)
+            combined = decode_cost(factory(), args.samples, True)
+            toy_log.log.flush()
+        print("  {:14s} getrennt {:8.0f} ns   kombiniert {:8.0f} ns   ({:.1f}x)".format(
+            name, separate, combined, separate / combined))
+
+    print()
+    print("Funkstrecke, Hub liefert {:.0f} Zeitpunkte/s, {:.0f} ms Verbindungsintervall, {} Pakete je Ereignis:".format(
+        args.rate, ImuPeripheral.connection_interval * 1000, ImuPeripheral.packets_per_event))
+    for name, combined in (("getrennt", False), ("kombiniert", True)):
+        result = link(combined, args.rate, args.seconds)
+        print("  {:10s} {:6.1f} Zeitpunkte/s  {:6.1f} Notifikationen/s  Alter p50 {:7.1f} ms  max {:7.1f} ms".format(
+            name, result["samples_per_second"], result["notifications_per_second"],
+            result["age_p50_ms"], result["age_max_ms"]))
+
+if __name__ == "__main__":
+    main()
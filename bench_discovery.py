@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der Controller-Suche bei einer Flut von Advertisements, wie sie
+# z.B. in einem Klassenraum voller Telefone, Uhren und Beacons auftritt.
+#
+# Verglichen wird die Rechenzeit im GLib-Thread:
+# - bisher: jedes Advertisement erreicht device_discovered(), die OID wird
+#   per split/join gebildet und bei Lego-OID der Name per blockierender
+#   D-Bus-Abfrage (alias()) gelesen
+# - mit Discovery-Filter: BlueZ lässt nur Advertisements mit Lego-Service
+#   durch, die OID wird per Slicing gebildet
+#
+# Die D-Bus-Abfrage wird durch eine Wartezeit nachgebildet, das Auspacken
+# des D-Bus-Signals, das jedes gemeldete Advertisement in Python kostet,
+# durch aktives Warten.
+#
+# Aufruf: python3 bench_discovery.py [Anzahl Advertisements]
+
+import sys, time, random
+
+import discovery
+
+DBUS_ROUNDTRIP = 0.0005      # Sekunden für eine blockierende D-Bus-Abfrage
+DBUS_SIGNAL = 0.00005        # Sekunden für das Auspacken eines D-Bus-Signals
+FOREIGN_DEVICES = 300        # fremde Geräte in Reichweite
+LEGO_OTHER = 6               # Lego-Geräte mit anderem Namen, z.B. Fernbedienungen
+HUBS = 2                     # gesuchte Hubs
+
+class FakeDevice:
+    __slots__ = ( "mac_address", "name", "uuids" )
+
+    def __init__(self, mac_address, name, uuids):
+        self.mac_address = mac_address
+        self.name = name
+        self.uuids = uuids
+
+    def alias(self):
+        time.sleep(DBUS_ROUNDTRIP)
+        return self.name
+
+OIDS = [ "00:16:53", "90:84:2b" ]
+NAMES = [ "LEGO Move Hub", "HUB NO.4", "Technic Hub", "Smart Hub" ]
+
+def legacy_match(device):
+    # bisherige Prüfung aus BoostDeviceManager.device_discovered
+    return ((":".join(device.mac_address.split(':')[0:3]).lower() in OIDS) and
+            (device.alias() in NAMES))
+
+def filtered_match(device):
+    return discovery.oid(device.mac_address) in OIDS and device.alias() in NAMES
+
+def bluez_filter(device):
+    # Discovery-Filter von BlueZ: nur Geräte mit Lego-Service
+    return discovery.LWP3_SERVICE_UUID in device.uuids
+
+def mac(oid, rnd):
+    return oid + "".join(":%02x" % rnd.randrange(256) for _ in range(3))
+
+def population(rnd):
+    devices = [ ]
+    for _ in range(FOREIGN_DEVICES):
+        oid = "%02x:%02x:%02x" % (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+        devices.append(FakeDevice(mac(oid, rnd), "Phone", ( )))
+    for i in range(LEGO_OTHER):
+        # Lego-OID, aber nicht gesucht. Die Hälfte gibt den Lego-Service an
+        uuids = ( discovery.LWP3_SERVICE_UUID, ) if i % 2 else ( )
+        devices.append(FakeDevice(mac("00:16:53", rnd), "Handset", uuids))
+    for _ in range(HUBS):
+        devices.append(FakeDevice(mac("90:84:2b", rnd), "Technic Hub",
+                                  ( discovery.LWP3_SERVICE_UUID, )))
+    return devices
+
+def signal():
+    end = time.perf_counter() + DBUS_SIGNAL
+    while time.perf_counter() < end:
+        pass
+
+def measure(adverts, match):
+    found = 0
+    start = time.perf_counter()
+    for device in adverts:
+        signal()
+        if match(device):
+            found += 1
+    return time.perf_counter() - start, len(adverts), found
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rnd = random.Random(1)
+    devices = population(rnd)
+    adverts = [ rnd.choice(devices) for _ in range(count) ]
+
+    # der Filter läuft in bluetoothd, nicht im Python-Prozess
+    legacy = measure(adverts, legacy_match)
+    filtered = measure([ d for d in adverts if bluez_filter(d) ], filtered_match)
+
+    print("Advertisements:", count, "von", len(devices), "Geräten,",
+          "D-Bus-Abfrage: {:.1f} ms".format(DBUS_ROUNDTRIP * 1000))
+    for name, (elapsed, callbacks, found) in (("ohne Filter", legacy),
+                                              ("mit Discovery-Filter", filtered)):
+        print("{:22s} {:6d} Aufrufe, {:4d} Treffer, {:8.1f} ms, {:6.1f} µs/Advertisement".format(
+            name, callbacks, found, elapsed * 1000, elapsed / count * 1e6))
+    print("Faktor: {:.1f}".format(legacy[0] / filtered[0]))
+
+if __name__ == "__main__":
+    main()
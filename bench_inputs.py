@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der Eingangs-Latenz des BT Smart Controllers.
+#
+# An allen vier Eingängen I1 bis I4 hängt ein Taster (ft_inputs.digital()),
+# alle vier sind gleichzeitig abonniert. Der simulierte Controller
+# (hub_sim.py, 15 ms Verbindungsintervall) drückt und löst die Taster zu
+# zufälligen Zeitpunkten und sendet die Eingangswerte mit --rate Hz.
+# Gemessen wird je Eingang die Zeit vom Drücken bzw. Lösen bis die Flanke
+# in FtBtSmartDevice.input_changed() ankommt (p50, p99, max).
+#
+# "verpasst" sind Flanken, die nie gemeldet wurden, z.B. weil der Taster
+# kürzer gedrückt war als der Abstand zweier Notifikationen. Zusätzliche
+# Lesezugriffe gibt es nach dem ersten Wert keine, "gelesen" zählt sie.
+#
+# Vier Eingänge mit je 100/s wären 400 Notifikationen pro Sekunde, mehr als
+# die etwa 266 Pakete, die bei 15 ms Intervall und 4 Paketen je
+# Verbindungsereignis durchgehen. Die Latenz wächst dann mit der Messdauer.
+#
+# Aufruf: python3 bench_inputs.py [--seconds S] [--rate HZ ...] [--seed N]
+
+import os, time, random, argparse, contextlib
+
+import offline_gatt
+offline_gatt.install()
+
+import gatt_cache
+import latency
+import hub_sim
+import ft_inputs
+import toy_timer
+
+gatt_cache.CachedLayout.layout_cache = None
+
+import ft_karussell
+from ft_karussell import FtBtSmartDevice
+
+MAC = "10:45:F8:00:00:01"
+
+# gedrückt bzw. gelöst für so viele Sekunden
+HOLD = (0.15, 0.4)
+
+class Controller(hub_sim.FtSmartSim):
+    def __init__(self, rate, seed):
+        super().__init__(rate=rate, button_period=0)
+        self.random = random.Random(seed)
+        self.pressed = { name: False for name in ft_inputs.NAMES }
+        self.flips = { name: [ ] for name in ft_inputs.NAMES }   # (Zeit, gedrückt)
+        self.reads = 0
+
+    def connected(self, device):
+        super().connected(device)
+        for name in ft_inputs.NAMES:
+            self.call_later(self.random.uniform(*HOLD), self.flip, name)
+
+    def flip(self, name):
+        if self.device is None:
+            return
+        self.pressed[name] = not self.pressed[name]
+        self.flips[name].append((time.monotonic(), self.pressed[name]))
+        self.call_later(self.random.uniform(*HOLD), self.flip, name)
+
+    def value(self, name):
+        return 50 if self.pressed[name] else 15000
+
+    def read(self, device, characteristic):
+        self.reads += 1
+        return super().read(device, characteristic)
+
+class Device(FtBtSmartDevice):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.edges = { name: [ ] for name in ft_inputs.NAMES }   # (Zeit, aktiv)
+
+    def input_changed(self, input, value, edge):
+        if edge is not None:
+            self.edges[input.name].append((time.monotonic(), edge))
+
+def measure(seconds, rate, seed):
+    ft_karussell.INPUTS = { name: ft_inputs.digital() for name in ft_inputs.NAMES }
+    manager = offline_gatt.DeviceManager()
+    controller = Controller(rate, seed)
+    manager.add_peripheral(MAC, controller)
+    device = Device(mac_address=MAC, manager=manager)
+    # Flanken nach der Entprellzeit, siehe ft_inputs.py
+    device.scheduler = toy_timer.Scheduler(manager)
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        device.connect()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            manager.run_pending()
+            time.sleep(0.0002)
+        # letzte Flanken noch zustellen
+        controller.device = None
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            manager.run_pending()
+            time.sleep(0.0002)
+
+    results = { }
+    for name in ft_inputs.NAMES:
+        histogram = latency.Histogram()
+        edges = device.edges[name]
+        missed = 0
+        flips = controller.flips[name]
+        for n, (changed, pressed) in enumerate(flips):
+            until = flips[n + 1][0] if n + 1 < len(flips) else float("inf")
+            for t, active in edges:
+                if changed <= t < until and active == pressed:
+                    histogram.record((t - changed) * 1000000)
+                    break
+            else:
+                missed += 1
+        results[name] = (histogram, missed, len(flips))
+    return results, controller.reads
+
+def main():
+    parser = argparse.ArgumentParser(description="Latenz der Eingänge I1 bis I4 des BT Smart Controllers")
+    parser.add_argument("--seconds", type=float, default=5, help="Messdauer")
+    parser.add_argument("--rate", type=float, nargs="+", default=[ 10, 25, 50 ],
+                        help="Notifikationen pro Sekunde und Eingang")
+    parser.add_argument("--seed", type=int, default=1, help="Startwert der Zufallszeiten")
+    args = parser.parse_args()
+
+    print("{:>6s} {:7s} {:>7s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s}".format(
+        "Rate", "Eingang", "Flanken", "p50 ms", "p99 ms", "max ms", "verpasst", "gelesen"))
+    for rate in args.rate:
+        results, reads = measure(args.seconds, rate, args.seed)
+        for name, (histogram, missed, total) in results.items():
+            if histogram.count:
+                p50, p99, worst = (histogram.percentile(50) / 1000, histogram.percentile(99) / 1000,
+                                   histogram.max / 1000)
+            else:
+                p50 = p99 = worst = float("nan")
+            print("{:4.0f}/s {:7s} {:7d} {:8.1f} {:8.1f} {:8.1f} {:8d} {:8d}".format(
+                rate, name, total, p50, p99, worst, missed, reads))
+
+if __name__ == "__main__":
+    main()
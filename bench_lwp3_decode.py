@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Mikro-Benchmark für das Dekodieren von LWP3-Meldungen. Verglichen wird
+# der tabellengesteuerte Decoder aus lwp3.py mit der bisherigen
+# if/elif-Kette aus lego_hub_monitor.py (ohne deren Bildschirmausgaben).
+#
+# Aufruf: python3 bench_lwp3_decode.py [Anzahl Durchläufe]
+
+import sys, struct, time
+
+import lwp3
+
+# Der Durchsatz ist der beste von REPEAT Teilläufen, das dämpft Störungen
+# durch andere Prozesse (wie in bench_codec.py)
+REPEAT = 5
+
+# typischer Meldungsmix eines Technic Hubs mit Motoren und internen
+# Sensoren: überwiegend Port-Values (0x45), dazu Feedback (0x82)
+CORPUS = [ bytes.fromhex(m) for m in (
+    "0a004561feff1000e803",      # Beschleunigung
+    "0a004562020001000000",      # Gyroskop
+    "0a004563ffff0300fe00",      # Neigung
+    "08004500a0050000",          # summierter Motorwinkel
+    "08004501a1050000",          # summierter Motorwinkel
+    "0800450209050000",          # Farbe + Distanz
+    "060045640000",              # Temperatur
+    "050045650a",                # Motorwinkel seit letztem Report
+    "050082000a",                # Kommando beendet
+    "0600013201ab",              # Hub-Property
+    "0500473600",                # Sensor-Bestätigung
+) ]
+
+# Gerätetypen je Port, passend zum Meldungsmix
+DEVICES = { 0x00: 0x2e, 0x01: 0x2e, 0x02: 0x25, 0x61: 0x39, 0x62: 0x3a,
+            0x63: 0x3b, 0x64: 0x3c, 0x65: 0x27 }
+
+def legacy_decode(device_on_port, value):
+    # bisherige Dekodierung aus BoostDevice.characteristic_value_updated,
+    # nur die Auswertung ohne print()
+    if struct.unpack('b', value[0:1])[0] != len(value):
+        return
+
+    type = struct.unpack('>H', value[1:3])[0]
+
+    if type == 0x01:
+        subtype = struct.unpack('b', value[3:4])[0]
+        if subtype == 1:
+            return value[5:].decode("utf-8")
+        elif subtype == 2:
+            return struct.unpack('x?', value[4:6])[0]
+
+    elif type == 0x45:
+        port = struct.unpack('B', value[3:4])[0]
+        if device_on_port[port] == 0x14:
+            return struct.unpack('<H', value[4:])[0]
+        elif device_on_port[port] == 0x15:
+            return struct.unpack('<H', value[4:])[0]
+        elif device_on_port[port] == 0x22:
+            if len(value[4:]) == 1:
+                return struct.unpack('B', value[4:])[0]
+            elif len(value[4:]) == 2:
+                return struct.unpack('bb', value[4:6])
+            elif len(value[4:]) == 3:
+                return struct.unpack('bbb', value[4:])
+        elif device_on_port[port] == 0x23:
+            if len(value[4:]) == 1:
+                return struct.unpack('B', value[4:])[0]
+            elif len(value[4:]) == 4:
+                return struct.unpack('<L', value[4:])[0]
+        elif device_on_port[port] == 0x25:
+            if len(value[4:]) == 4:
+                return struct.unpack('BBxx', value[4:])
+            elif len(value[4:]) == 6:
+                return struct.unpack('<HHH', value[4:])
+        elif (device_on_port[port] == 0x26 or device_on_port[port] == 0x27 or
+              device_on_port[port] == 0x2e or device_on_port[port] == 0x2f):
+            if len(value[4:]) == 1:
+                return struct.unpack('<b', value[4:])[0]
+            elif len(value[4:]) == 4:
+                return struct.unpack('<l', value[4:])[0]
+        elif device_on_port[port] == 0x28:
+            if len(value[4:]) == 1:
+                return struct.unpack('B', value[4:])[0]
+            elif len(value[4:]) == 2:
+                return struct.unpack('bb', value[4:6])
+        elif device_on_port[port] == 0x36:
+            if len(value[4:]) == 1:
+                return struct.unpack('<B', value[4:])[0]
+        elif device_on_port[port] == 0x39:
+            if len(value[4:]) == 6:
+                return struct.unpack('<hhh', value[4:])
+        elif device_on_port[port] == 0x3a:
+            if len(value[4:]) == 6:
+                return struct.unpack('<hhh', value[4:])
+        elif device_on_port[port] == 0x3b:
+            if len(value[4:]) == 6:
+                return struct.unpack('<hhh', value[4:])
+        elif device_on_port[port] == 0x3c:
+            if len(value[4:]) == 2:
+                return struct.unpack('<h', value[4:])[0] * 0.1
+        elif device_on_port[port] == 0x42:
+            if len(value[4:]) == 1:
+                return struct.unpack('<B', value[4:])[0]
+
+    elif type == 0x47:
+        return struct.unpack('b', value[3:4])[0]
+
+    elif type == 0x82:
+        return struct.unpack('BB', value[3:5])
+
+def measure(decode, rounds):
+    corpus = CORPUS
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for value in corpus:
+            decode(value)
+    return time.perf_counter() - start
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    decoder = lwp3.Decoder()
+    decoder.device_on_port.update(DEVICES)
+    devices = dict(DEVICES)
+
+    # abwechselnd messen, damit beide dieselben Störungen abbekommen
+    legacy = table = None
+    for _ in range(REPEAT):
+        elapsed = measure(lambda value: legacy_decode(devices, value), rounds)
+        legacy = elapsed if legacy is None else min(legacy, elapsed)
+        elapsed = measure(decoder.decode, rounds)
+        table = elapsed if table is None else min(table, elapsed)
+    legacy = rounds * len(CORPUS) / legacy
+    table = rounds * len(CORPUS) / table
+
+    print("Meldungen je Durchlauf:", len(CORPUS), ", Durchläufe:", rounds, ", bester von", REPEAT)
+    print("if/elif-Kette:      {:10.0f} Meldungen/s".format(legacy))
+    print("lwp3.Decoder:       {:10.0f} Meldungen/s".format(table))
+    print("Faktor:             {:10.2f}".format(table / legacy))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der Sendeverfahren aus lwp3_transport.py gegen eine simulierte
+# LWP3-Charakteristik. Verglichen werden Kommandos pro Sekunde beim bisherigen
+# Write Request (ein Kommando pro ATT-Bestätigung) und bei Write Without
+# Response mit verschiedenen Fenstergrößen.
+#
+# Die Simulation bildet die Bluetooth-Verbindung über Verbindungsintervalle
+# ab: pro Intervall können mehrere Pakete übertragen werden, ein Write Request
+# wird aber erst im folgenden Intervall bestätigt. Der Hub meldet jedes
+# Kommando ein Intervall nach Empfang per 0x82 als beendet.
+#
+# Aufruf: python3 bench_lwp3_transport.py [Anzahl Kommandos]
+
+import sys, struct, heapq, itertools
+
+import lwp3
+import lwp3_transport
+
+CONNECTION_INTERVAL = 0.015    # Sekunden
+PACKETS_PER_INTERVAL = 4
+
+class Simulation:
+    def __init__(self):
+        self.now = 0.0
+        self.events = [ ]
+        self.seq = itertools.count()
+
+    def at(self, time, callback, *args):
+        heapq.heappush(self.events, (time, next(self.seq), callback, args))
+
+    def run(self):
+        while self.events:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+class FakeCharacteristic:
+    def __init__(self, sim, hub):
+        self.sim = sim
+        self.hub = hub
+        self.transport = None
+        self.slot_time = 0.0       # nächstes Verbindungsintervall mit Platz
+        self.slot_used = 0
+        self.delivered = 0
+        self.last_delivery = 0.0
+
+    def next_slot(self):
+        # Platz im nächsten Verbindungsintervall belegen
+        interval = (int(self.sim.now / CONNECTION_INTERVAL) + 1) * CONNECTION_INTERVAL
+        if interval > self.slot_time:
+            self.slot_time, self.slot_used = interval, 0
+        if self.slot_used == PACKETS_PER_INTERVAL:
+            self.slot_time += CONNECTION_INTERVAL
+            self.slot_used = 0
+        self.slot_used += 1
+        return self.slot_time
+
+    def write_value(self, data):
+        # Write Request: Bestätigung erst im folgenden Intervall
+        time = self.next_slot()
+        self.sim.at(time, self.deliver, data)
+        self.sim.at(time + CONNECTION_INTERVAL, self.transport.write_succeeded)
+
+    def write_command(self, data):
+        self.sim.at(self.next_slot(), self.deliver, data)
+
+    def deliver(self, data):
+        self.delivered += 1
+        self.last_delivery = self.sim.now
+        port = data[3]
+        feedback = bytes([ 5, 0, lwp3.PORT_FEEDBACK, port, 0x0a ])
+        self.sim.at(self.sim.now + CONNECTION_INTERVAL, self.hub, feedback)
+
+def run(window, count):
+    sim = Simulation()
+    decoder = lwp3.Decoder()
+    def hub(value):
+        transport.reply_received(decoder.decode(value))
+    ch = FakeCharacteristic(sim, hub)
+    transport = lwp3_transport.make_transport(ch, window)
+    ch.transport = transport
+
+    # Motor-Kommandos (Winkel fahren) auf vier Ports, die nicht
+    # zusammengefasst werden können
+    for i in range(count):
+        data = struct.pack("<BbblbBBB", i % 4, 0x11, 11, 90, 50, 100, 0x7f, 0x03)
+        cmd_seq = struct.pack(">bH", len(data)+3, 0x81) + data
+        transport.send(cmd_seq, lwp3.coalesce_key(0x81, data), lwp3.command_port(0x81, data))
+    sim.run()
+
+    assert ch.delivered == count
+    return count / ch.last_delivery
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    print("Verbindungsintervall: {:.1f} ms, Pakete pro Intervall: {}".format(
+        CONNECTION_INTERVAL*1000, PACKETS_PER_INTERVAL))
+    request = run(0, count)
+    print("Write Request:                      {:7.1f} Kommandos/s".format(request))
+    for window in (1, 2, 4, 8):
+        rate = run(window, count)
+        print("Write Without Response, Fenster {}:  {:7.1f} Kommandos/s ({:.1f}x)".format(
+            window, rate, rate / request))
+
+if __name__ == "__main__":
+    main()
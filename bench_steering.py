@@ -0,0 +1,148 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der Lenk-Latenz des BT Control Receivers bei Vollgas-Verkehr.
+#
+# Die Fahrt wird ständig nachgeregelt (run() mit --throttle Hz, jeder Wert
+# neu), dazu wird alle --steer-period Sekunden gelenkt. Gemessen wird die
+# Zeit vom Aufruf von steer() bis der simulierte Receiver (hub_sim.py, 15 ms
+# Verbindungsintervall) den Wert an M4 erhält.
+#
+#   bisher    ein gemeinsamer Merker für M1 und M4, nach jeder Bestätigung
+#             wird zuerst ein wartender Fahrwert gesendet
+#   reihum    FtBtCtrlRcvDevice mit einem Platz je Ausgang
+#             (output_queue.CoalescingQueue)
+#
+# "verloren" sind Lenkwerte, die nie beim Receiver ankamen, weil sie von
+# einem späteren Lenkwert ersetzt wurden, bevor sie an der Reihe waren. Zum
+# Schluss wird die Fahrt mit run(0) beendet, während noch ein Wert
+# unterwegs ist. "Stopp" zeigt, ob der Receiver danach 0 an M1 hat.
+#
+# Aufruf: python3 bench_steering.py [--seconds S] [--throttle HZ] [--steer-period S]
+
+import os, time, argparse, contextlib
+
+import offline_gatt
+offline_gatt.install()
+
+import gatt_cache
+import latency
+import hub_sim
+
+gatt_cache.CachedLayout.layout_cache = None
+
+from ft_rc_racer import FtBtCtrlRcvDevice
+
+MAC = "10:45:F8:00:00:01"
+
+class LegacyRcvDevice(FtBtCtrlRcvDevice):
+    # bisherige Schreiblogik aus ft_rc_racer.py
+    outstanding_run = None
+    outstanding_steer = None
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        super(FtBtCtrlRcvDevice, self).characteristic_write_value_succeeded(characteristic)
+        if not self.outstanding_run and not self.outstanding_steer:
+            self.write_in_progress = False
+        elif self.outstanding_run:
+            self.m1.write_value(bytes([self.outstanding_run]))
+            self.outstanding_run = None
+        else:
+            self.servo.write_value(bytes([self.outstanding_steer]))
+            self.outstanding_steer = None
+
+    def run(self, value):
+        if self.write_in_progress:
+            self.outstanding_run = value
+        else:
+            self.m1.write_value(bytes([value]))
+            self.write_in_progress = True
+
+    def steer(self, value):
+        if self.write_in_progress:
+            self.outstanding_steer = value
+        else:
+            self.servo.write_value(bytes([value]))
+            self.write_in_progress = True
+
+class Receiver(hub_sim.FtReceiverSim):
+    def __init__(self):
+        super().__init__()
+        self.steered = { }      # Lenkwert -> Ankunft
+
+    def received(self, uuid, data):
+        super().received(uuid, data)
+        if uuid == hub_sim.FT_RECEIVER_M4[1]:
+            self.steered.setdefault(data[0], time.monotonic())
+
+def drive(cls, seconds, throttle, steer_period):
+    manager = offline_gatt.DeviceManager()
+    receiver = Receiver()
+    manager.add_peripheral(MAC, receiver)
+    device = cls(mac_address=MAC, manager=manager)
+
+    def run(duration):
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            manager.run_pending()
+            time.sleep(0.0002)
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        device.connect()
+        run(0.2)
+    steered = { }               # Lenkwert -> Aufruf von steer()
+    end = time.monotonic() + seconds
+    speed = 1
+    next_throttle = next_steer = time.monotonic()
+    value = 0
+    while time.monotonic() < end:
+        now = time.monotonic()
+        if now >= next_throttle:
+            # Vollgas mit leichter Regelung, jeder Wert neu, nie 0
+            speed = speed % 99 + 1
+            device.run(speed)
+            next_throttle += 1 / throttle
+        if now >= next_steer:
+            # jeder Lenkwert nur einmal, damit er eindeutig zuzuordnen ist
+            value = value % 250 + 1
+            steered[value] = now
+            device.steer(value)
+            next_steer += steer_period
+        manager.run_pending()
+        time.sleep(0.0002)
+    # anhalten, während noch geschrieben wird
+    device.run(0)
+    run(0.5)
+
+    histogram = latency.Histogram()
+    lost = 0
+    for value, sent in steered.items():
+        arrived = receiver.steered.get(value)
+        if arrived is None:
+            lost += 1
+        else:
+            histogram.record((arrived - sent) * 1000000)
+    stopped = receiver.outputs.get(hub_sim.FT_RECEIVER_M1[1]) == bytes([0])
+    return histogram, lost, len(steered), stopped
+
+def main():
+    parser = argparse.ArgumentParser(description="Lenk-Latenz des BT Control Receivers bei Vollgas-Verkehr")
+    parser.add_argument("--seconds", type=float, default=5, help="Messdauer")
+    parser.add_argument("--throttle", type=float, default=200, help="Fahrwerte pro Sekunde")
+    parser.add_argument("--steer-period", type=float, default=0.1, help="Sekunden zwischen zwei Lenkwerten")
+    args = parser.parse_args()
+
+    print("{:9s} {:>9s} {:>8s} {:>8s} {:>8s} {:>12s} {:>6s}".format(
+        "Verfahren", "Lenkwerte", "p50 ms", "p99 ms", "max ms", "verloren", "Stopp"))
+    for name, cls in (("bisher", LegacyRcvDevice), ("reihum", FtBtCtrlRcvDevice)):
+        histogram, lost, total, stopped = drive(cls, args.seconds, args.throttle, args.steer_period)
+        if histogram.count:
+            p50, p99, worst = (histogram.percentile(50) / 1000, histogram.percentile(99) / 1000,
+                               histogram.max / 1000)
+        else:
+            p50 = p99 = worst = float("nan")
+        print("{:9s} {:9d} {:8.1f} {:8.1f} {:8.1f} {:5d} ({:3.0f}%) {:>6s}".format(
+            name, total, p50, p99, worst, lost, 100 * lost / total, "ja" if stopped else "nein"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark der Taktung der Fahrschritte: bisherige Hauptschleife mit
+# thread.join(period) gegen toy_timer.Scheduler.
+#
+#   poll        Schritt in der Hauptschleife, danach thread.join(period),
+#               wie bisher in ft_karussell.py und ft_rc_racer.py
+#   scheduler   Scheduler.every(period, step) im Thread des Managers
+#
+# Der Manager aus offline_gatt.py läuft wie gatt.DeviceManager in einem
+# eigenen Thread. Als Last ruft er mit --rate Hz einen Handler auf, der je
+# Aufruf --work µs rechnet, so wie characteristic_value_updated bei vielen
+# Notifikationen.
+#
+# Gemessen wird je Schritt die Verspätung gegenüber dem idealen Zeitpunkt
+# start + n * period (p50, p99, max) und der Abstand zum vorigen Schritt
+# (p99 der Abweichung von period). "Drift" ist die Verspätung des letzten
+# Schritts, also um wie viel die ganze Fahrt länger gedauert hat.
+#
+# Aufruf: python3 bench_timer.py [--steps N] [--rate HZ] [--work US]
+
+import time, argparse, threading
+
+import offline_gatt
+import latency
+import toy_timer
+
+class Load:
+    # Notifikationen mit rate Hz, jede kostet work µs im Thread des Managers
+    def __init__(self, manager, rate, work):
+        self.manager = manager
+        self.period = 1 / rate if rate else None
+        self.work = work / 1000000
+        self.running = False
+        self.deadline = None
+
+    def start(self):
+        if self.period is None:
+            return
+        self.running = True
+        self.deadline = time.monotonic()
+        self.manager.call_at(self.deadline, self.notification)
+
+    def notification(self):
+        if not self.running:
+            return
+        end = time.perf_counter() + self.work
+        while time.perf_counter() < end:
+            pass
+        self.deadline += self.period
+        self.manager.call_at(self.deadline, self.notification)
+
+class Steps:
+    def __init__(self, period, count):
+        self.period = period
+        self.count = count
+        self.times = [ ]
+        self.done = threading.Event()
+
+    def step(self):
+        self.times.append(time.monotonic())
+        if len(self.times) >= self.count:
+            self.done.set()
+            return False
+
+    def result(self, start):
+        late = latency.Histogram()
+        interval = latency.Histogram()
+        for n, t in enumerate(self.times):
+            late.record((t - start - (n + 1) * self.period) * 1000000)
+            if n:
+                interval.record(abs(t - self.times[n - 1] - self.period) * 1000000)
+        return { "late_p50_ms": late.percentile(50) / 1000, "late_p99_ms": late.percentile(99) / 1000,
+                 "late_max_ms": late.max / 1000, "interval_p99_ms": (interval.percentile(99) or 0) / 1000,
+                 "drift_ms": (self.times[-1] - start - len(self.times) * self.period) * 1000 }
+
+def measure(mode, period, steps, rate, work):
+    manager = offline_gatt.DeviceManager()
+    thread = threading.Thread(target=manager.run, daemon=True)
+    thread.start()
+    load = Load(manager, rate, work)
+    load.start()
+    time.sleep(0.1)
+
+    run = Steps(period, steps)
+    start = time.monotonic()
+    if mode == "poll":
+        # wie bisher: Schritt, dann period warten
+        while not run.done.is_set():
+            run.step()
+            thread.join(period)
+    else:
+        scheduler = toy_timer.Scheduler(manager)
+        scheduler.every(period, run.step, start=start + period)
+        run.done.wait()
+    load.running = False
+    manager.stop()
+    thread.join()
+    if mode == "poll":
+        # der erste Schritt kommt sofort, nicht nach einer Periode
+        start -= period
+    return run.result(start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Taktung per thread.join() gegen toy_timer.Scheduler")
+    parser.add_argument("--steps", type=int, default=100, help="Schritte je Messung")
+    parser.add_argument("--rate", type=float, default=200, help="Notifikationen pro Sekunde als Last")
+    parser.add_argument("--work", type=float, default=2000, help="Rechenzeit je Notifikation in µs")
+    args = parser.parse_args()
+
+    print("{:10s} {:>7s} {:>9s} {:>8s} {:>8s} {:>8s} {:>11s} {:>9s}".format(
+        "Verfahren", "Periode", "Last", "p50 ms", "p99 ms", "max ms", "Abstand p99", "Drift ms"))
+    for period in (0.1, 0.005):
+        for rate in (0, args.rate):
+            for mode in ("poll", "scheduler"):
+                result = measure(mode, period, args.steps, rate, args.work)
+                print("{:10s} {:5.0f}ms {:>9s} {:8.2f} {:8.2f} {:8.2f} {:9.2f}ms {:9.1f}".format(
+                    mode, period * 1000, "%.0f/s" % rate if rate else "keine",
+                    result["late_p50_ms"], result["late_p99_ms"], result["late_max_ms"],
+                    result["interval_p99_ms"], result["drift_ms"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Mitschnitt aller Notifikationen und Schreibzugriffe eines Programms.
+#
+# capture.py startet eines der Beispielprogramme und protokolliert dabei
+# jede eingehende Notifikation (bzw. jedes Leseergebnis) und jeden
+# Schreibzugriff auf eine Charakteristik mit monotonem Zeitstempel. Die
+# Geräteklassen bleiben unverändert, es werden nur die Methoden von
+# gatt.Characteristic und lwp3_transport.write_without_response umgeleitet.
+# Mit replay.py lässt sich der Mitschnitt ohne Controller wieder in die
+# Geräteklassen einspeisen.
+#
+# Aufruf z.B.: python3 capture.py boost.cap lego_hub_monitor.py 00:16:53:A4:DB:62
+#
+# Format, eine Zeile je Ereignis:
+#
+#   # toy-capture 1
+#   D <MAC> <modul.Klasse>
+#   <t in ns> <N|W|C> <MAC> <Service-UUID> <Charakteristik-UUID> <Daten hex>
+#
+# N = Notifikation oder Leseergebnis, W = Write Request,
+# C = Write Without Response (Command). Die D-Zeile nennt die Geräteklasse
+# und steht vor dem ersten Ereignis eines Controllers.
+
+import os, sys, time, atexit, runpy
+
+import lwp3_transport
+
+MAGIC = "# toy-capture 1"
+
+NOTIFICATION = "N"
+WRITE = "W"
+COMMAND = "C"
+
+class Capture:
+    def __init__(self, filename, script=None):
+        self.file = open(filename, "w", buffering=1 << 16)
+        self.file.write(MAGIC + "\n")
+        # Name, unter dem das Hauptprogramm als Modul importiert werden kann
+        self.main_module = os.path.splitext(os.path.basename(script))[0] if script else "__main__"
+        self.devices = set()
+        self.events = 0
+
+    def device_class(self, device):
+        cls = type(device)
+        module = self.main_module if cls.__module__ == "__main__" else cls.__module__
+        return module + "." + cls.__qualname__
+
+    def log(self, kind, characteristic, data):
+        timestamp = time.monotonic_ns()
+        device = characteristic.service.device
+        if device.mac_address not in self.devices:
+            self.devices.add(device.mac_address)
+            self.file.write("D %s %s\n" % (device.mac_address, self.device_class(device)))
+        self.file.write("%d %s %s %s %s %s\n" % (timestamp, kind, device.mac_address,
+                                                  characteristic.service.uuid,
+                                                  characteristic.uuid, bytes(data).hex()))
+        self.events += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def install(capture):
+    # gatt.Characteristic und lwp3_transport umleiten. Die Notifikationen
+    # und Leseergebnisse kommen bei python-gatt über properties_changed an
+    import gatt
+    properties_changed = gatt.Characteristic.properties_changed
+    write_value = gatt.Characteristic.write_value
+    write_without_response = lwp3_transport.write_without_response
+
+    def captured_properties_changed(self, properties, changed_properties, invalidated_properties):
+        value = changed_properties.get('Value')
+        if value is not None:
+            capture.log(NOTIFICATION, self, value)
+        return properties_changed(self, properties, changed_properties, invalidated_properties)
+
+    def captured_write_value(self, value, offset=0):
+        capture.log(WRITE, self, value)
+        return write_value(self, value, offset)
+
+    def captured_write_without_response(characteristic, data, error_handler=None):
+        capture.log(COMMAND, characteristic, data)
+        return write_without_response(characteristic, data, error_handler)
+
+    gatt.Characteristic.properties_changed = captured_properties_changed
+    gatt.Characteristic.write_value = captured_write_value
+    lwp3_transport.write_without_response = captured_write_without_response
+
+def load(filename):
+    # liefert ({ MAC: "modul.Klasse" }, [ (t, Art, MAC, Service, Charakteristik, Daten) ])
+    classes = { }
+    events = [ ]
+    with open(filename) as f:
+        if f.readline().rstrip("\n") != MAGIC:
+            raise ValueError("%s ist kein Mitschnitt von capture.py" % filename)
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if fields[0] == "D":
+                classes[fields[1]] = fields[2]
+            else:
+                timestamp, kind, mac, service, uuid = fields[:5]
+                data = bytes.fromhex(fields[5]) if len(fields) > 5 else b""
+                events.append((int(timestamp), kind, mac, service, uuid, data))
+    return classes, events
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Aufruf:", sys.argv[0], "MITSCHNITT PROGRAMM [PARAMETER ...]")
+        exit(1)
+
+    filename, script = sys.argv[1], sys.argv[2]
+    capture = Capture(filename, script)
+    try:
+        install(capture)
+    except ModuleNotFoundError as e:
+        print("Error loading gatt module:", e);
+        print("You may install it via 'pip3 install gatt' ...");
+        exit(-1);
+
+    def finish():
+        capture.close()
+        print("%d Ereignisse aufgezeichnet in %s" % (capture.events, filename), file=sys.stderr)
+    atexit.register(finish)
+
+    # das Programm sieht seine eigenen Parameter wie bei direktem Aufruf
+    sys.argv = sys.argv[2:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
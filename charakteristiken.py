@@ -14,6 +14,9 @@ except ModuleNotFoundError as e:
 import sys, struct
 import threading
 
+import discovery
+import toy_profiles
+
 # GATT Device-Manager, um selektiv nach Spielzeug-Controllern zu suchen
 class ToyDeviceManager(gatt.DeviceManager):
     def __init__(self, adapter_name='hci0'):
@@ -21,17 +24,9 @@ class ToyDeviceManager(gatt.DeviceManager):
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf TI-OID und passenden Gerätenamen für WeDo-Hub,
-        # auf LNT-OID für fischertechnik und auf Lego-OID für Boost-
-        # Controller
-        if(((":".join(device.mac_address.split(':')[0:3]) == "a0:e6:f8") and
-            (device.alias() == "LPF2 Smart Hub 2 I/O")) or
-           ((":".join(device.mac_address.split(':')[0:3]) == "10:45:f8") and
-            (device.alias() == "BT Smart Controller")) or
-           ((":".join(device.mac_address.split(':')[0:3]) == "10:45:f8") and
-            (device.alias() == "BT Control Receiver")) or
-           ((":".join(device.mac_address.split(':')[0:3]) == "00:16:53") and
-            (device.alias() == "LEGO Move Hub"))):
+        # teste auf OID und Gerätenamen aller bekannten Lego- und
+        # fischertechnik-Controller, siehe toy_profiles.py
+        if toy_profiles.identify(device):
 
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
@@ -119,7 +114,8 @@ if len(sys.argv) > 1:
 else:
     print("Suche nach Spielzeug-Controller ...")
     print("Bitte Taster am Controller drücken.")
-    manager.start_discovery()
+    # nur Bluetooth-LE-Geräte melden lassen
+    discovery.start_discovery(manager)
 
 print("Beenden mit Ctrl-C")
 
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+# Suche nach Controllern mit Filter im Bluetooth-Adapter bzw. in BlueZ.
+#
+# Ohne Filter meldet BlueZ jedes Advertisement in Reichweite an Python und
+# device_discovered() muss jedes Gerät selbst prüfen, inkl. einer
+# blockierenden D-Bus-Abfrage des Gerätenamens. Mit Service-UUIDs, RSSI-
+# Schwelle und Transport "le" im Discovery-Filter von BlueZ erreichen nur
+# noch passende Controller das Programm.
+#
+# Die Lego-Hubs geben ihren Service im Advertisement an und lassen sich
+# über die UUID filtern. Für die fischertechnik-Controller ist das nicht
+# sicher, hier wird nur nach Transport und ggf. RSSI gefiltert und der
+# Gerätename weiter in Python geprüft.
+
+# Services, die die Lego-Hubs im Advertisement angeben
+LWP3_SERVICE_UUID = "00001623-1212-efde-1623-785feabcd123"    # Boost, Technic, City, ...
+WEDO_SERVICE_UUID = "00001523-1212-efde-1523-785feabcd123"    # WeDo 2.0
+
+def discovery_filter(service_uuids=None, rssi=None, duplicate_data=False):
+    # Discovery-Filter im Format von org.bluez.Adapter1.SetDiscoveryFilter
+    import dbus
+    filter = { 'Transport': dbus.String('le') }
+    if service_uuids:
+        filter['UUIDs'] = dbus.Array(service_uuids, signature='s')
+    if rssi is not None:
+        # Achtung: mit RSSI-Schwelle meldet BlueZ jede RSSI-Änderung
+        filter['RSSI'] = dbus.Int16(rssi)
+    filter['DuplicateData'] = dbus.Boolean(duplicate_data)
+    return filter
+
+def start_discovery(manager, service_uuids=None, rssi=None):
+    # Suche auf einem gatt.DeviceManager mit Filter starten
+    if getattr(manager, "_adapter", None) is None:
+        # offline_gatt.DeviceManager (z.B. hub_sim.py) filtert selbst
+        manager.start_discovery(service_uuids)
+        return
+
+    import dbus
+    filter = discovery_filter(service_uuids, rssi)
+    try:
+        manager._adapter.SetDiscoveryFilter(filter)
+    except dbus.exceptions.DBusException as e:
+        # BlueZ vor 5.45 kennt DuplicateData noch nicht und lehnt den Filter
+        # mit InvalidArguments ab. Andere Fehler (z.B. NotReady, kein
+        # Adapter) würde der zweite Versuch nur verdecken
+        if e.get_dbus_name() != 'org.bluez.Error.InvalidArguments':
+            raise
+        del filter['DuplicateData']
+        manager._adapter.SetDiscoveryFilter(filter)
+    manager._adapter.StartDiscovery()
+
+def oid(mac_address):
+    # Herstellerkennung (die ersten drei Bytes) einer MAC-Adresse
+    return mac_address[0:8].lower()
@@ -1,5 +1,8 @@
 #!/bin/bash
 
+. "$(dirname "$0")/gatt_cache.sh"
+. "$(dirname "$0")/hub_daemon.sh"
+
 # Teste ob eine MAC-Adresse als Parameter gegeben wurde
 # Versuche andernfalls den Controller automatisch zu finden
 if [ "$1" != "" ]; then
@@ -57,33 +60,37 @@ else
     }
 fi
 
-# ein ft-Controller wurde erkannt, starte gatttool
+# ein ft-Controller wurde erkannt
 if [ "$FTC" == "" ]; then
     echo "Kein passender Controller gefunden!"
     exit 1
 fi
 
-# suche nach Kanal-Service
-CH_SRV=`gatttool -b $FTC --primary -u 2e582b3a-c5c5-11e6-9d9d-cec0c932ce01`
-if [ "$CH_SRV" != "" ]; then
-    SH=`echo $CH_SRV | cut -d' ' -f3`
-    EH=`echo $CH_SRV | cut -d' ' -f6`
-    echo "Kanal-Service-Handles: $SH bis $EH"
-
-    # erfrage Kanal-Charakteristik
-    CH_CHAR=`gatttool -b $FTC --char-desc -s 0x$SH -e 0x$EH | grep 2e582de2-c5c5-11e6-9d9d-cec0c932ce01`
-    
-    CH_VALUE_HDL=`echo $CH_CHAR | cut -d',' -f1 | cut -d'=' -f2`
-    if [ "$CH_VALUE_HDL" != "" ]; then
-        echo "Kanel-Charakteristik-Handle: $CH_VALUE_HDL"
-
-	# blinken ...
-	while true; do
-	    gatttool -b $FTC --char-write-req -a $CH_VALUE_HDL -n 01
-	    sleep 1
-	    gatttool -b $FTC --char-write-req -a $CH_VALUE_HDL -n 00
-	    sleep 1
-	done    
+# Läuft hub_daemon.py, wird dessen bestehende Verbindung genutzt, sonst baut
+# gatttool für jeden Schreibzugriff eine eigene Verbindung auf
+if hubd_open; then
+    echo "Verbinde über hub_daemon.py ..."
+    hubd connect $FTC > /dev/null || exit 1
+    write_value() {
+	hubd write $FTC 2e582de2-c5c5-11e6-9d9d-cec0c932ce01 $1 > /dev/null
+    }
+else
+    # Handle der Kanal-Charakteristik, aus dem Cache oder per gatttool, siehe gatt_cache.sh
+    CH_VALUE_HDL=`gatt_value_handle $FTC 2e582b3a-c5c5-11e6-9d9d-cec0c932ce01 2e582de2-c5c5-11e6-9d9d-cec0c932ce01`
+    if [ "$CH_VALUE_HDL" == "" ]; then
+	echo "Keine Kanal-Charakteristik gefunden!"
+	exit 1
     fi
+    echo "Kanal-Charakteristik-Handle: $CH_VALUE_HDL"
+    write_value() {
+	gatttool -b $FTC --char-write-req -a $CH_VALUE_HDL -n $1
+    }
 fi
- 
+
+# blinken ...
+while true; do
+    write_value 01
+    sleep 1
+    write_value 00
+    sleep 1
+done
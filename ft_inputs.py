@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Eingänge I1 bis I4 des fischertechnik BT Smart Controllers.
+#
+# Jeder Eingang hat im Eingangs-Service eine Charakteristik für den Wert
+# (16 Bit, Lesen und Notifikation) und eine für den Modus. Der Modus legt
+# fest, was der Controller misst:
+#
+#   DIGITAL      Widerstand, ausgewertet als Taster (geschlossen < Schwelle)
+#   RESISTANCE   Widerstand in Ohm (z.B. Fotowiderstand, NTC)
+#   VOLTAGE      Spannung in mV, umgerechnet in Volt
+#   ULTRASONIC   Entfernung des Ultraschallsensors in cm
+#
+# Die Rohwerte werden über Kalibriertabellen umgerechnet. Eine Tabelle
+# entsteht einmal aus Stützpunkten (Rohwert, Messwert) und enthält je
+# Abschnitt Steigung und Achsabschnitt, eine Umrechnung ist damit eine
+# Suche und eine Multiplikation.
+#
+# Mit einer Schwelle meldet ein Eingang Flanken (aktiv/inaktiv). Eine
+# Hysterese verhindert Flattern um die Schwelle, nach einer Flanke werden
+# für debounce Sekunden keine weiteren gemeldet (Tasterprellen). Die Flanke
+# selbst kommt ohne Verzögerung mit der Notifikation, es wird nichts
+# nachgelesen.
+#
+# Der Controller meldet nur Änderungen. Ändert sich der Zustand während der
+# Sperrzeit (z.B. kurzer Tastendruck), steht in Input.pending, wann der
+# letzte Wert mit settle() erneut zu prüfen ist. Die Flanke kommt dann
+# verspätet, geht aber nicht verloren.
+#
+# Geprüft ist bisher nur I1. Die Charakteristiken von I2 bis I4 und der
+# Modi sowie die Modus-Codes sind nicht an jeder Firmware nachgesehen, mit
+# charakteristiken.py lässt sich der Aufbau am eigenen Controller prüfen.
+# Fehlt eine Charakteristik, bleibt der Eingang bzw. sein Modus ungenutzt.
+
+import bisect
+
+SERVICE = "8ae8952a-ad7d-11e6-80f5-76304dec7eb7"
+
+NAMES = ( "I1", "I2", "I3", "I4" )
+# (Service-UUID, Charakteristik-UUID) wie in ft_karussell.py
+VALUE = { "I1": (SERVICE, "8ae89a2a-ad7d-11e6-80f5-76304dec7eb7"),
+          "I2": (SERVICE, "8ae89bec-ad7d-11e6-80f5-76304dec7eb7"),
+          "I3": (SERVICE, "8ae89dc2-ad7d-11e6-80f5-76304dec7eb7"),
+          "I4": (SERVICE, "8ae89f66-ad7d-11e6-80f5-76304dec7eb7") }
+MODE = { "I1": (SERVICE, "8ae89084-ad7d-11e6-80f5-76304dec7eb7"),
+         "I2": (SERVICE, "8ae89200-ad7d-11e6-80f5-76304dec7eb7"),
+         "I3": (SERVICE, "8ae89386-ad7d-11e6-80f5-76304dec7eb7"),
+         "I4": (SERVICE, "8ae894fc-ad7d-11e6-80f5-76304dec7eb7") }
+
+DIGITAL = "digital"
+RESISTANCE = "resistance"
+VOLTAGE = "voltage"
+ULTRASONIC = "ultrasonic"
+
+# Byte für die Modus-Charakteristik. Ein Taster wird als Widerstand gemessen
+MODE_CODES = { DIGITAL: 0x0b, RESISTANCE: 0x0b, VOLTAGE: 0x0a, ULTRASONIC: 0x0c }
+
+# Stützpunkte (Rohwert, Messwert) je Modus
+CALIBRATION = { DIGITAL: [ (0, 0), (0xffff, 0xffff) ],          # Ohm
+                RESISTANCE: [ (0, 0), (0xffff, 0xffff) ],       # Ohm
+                VOLTAGE: [ (0, 0.0), (0xffff, 65.535) ],        # Volt
+                ULTRASONIC: [ (0, 0), (1023, 1023) ] }          # cm
+
+class Calibration:
+    def __init__(self, points):
+        points = sorted(points)
+        if len(points) < 2:
+            raise ValueError("Kalibrierung braucht mindestens zwei Stützpunkte")
+        # je Abschnitt: Rohwert am Anfang, Steigung, Achsabschnitt
+        self.bounds = [ raw for raw, _ in points[1:-1] ]
+        self.segments = [ ]
+        for (r0, v0), (r1, v1) in zip(points, points[1:]):
+            slope = (v1 - v0) / (r1 - r0)
+            self.segments.append((slope, v0 - slope * r0))
+
+    def __call__(self, raw):
+        # außerhalb der Stützpunkte wird der erste bzw. letzte Abschnitt
+        # verlängert
+        slope, offset = self.segments[bisect.bisect_right(self.bounds, raw)]
+        return slope * raw + offset
+
+class InputConfig:
+    # threshold im kalibrierten Wert, active_below: aktiv unterhalb der
+    # Schwelle (Taster, Entfernung) statt oberhalb (Spannung)
+    def __init__(self, mode=RESISTANCE, calibration=None, threshold=None,
+                 hysteresis=0, debounce=0.0, active_below=True):
+        self.mode = mode
+        self.code = MODE_CODES[mode]
+        self.calibration = Calibration(calibration or CALIBRATION[mode])
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.active_below = active_below
+
+def digital(threshold=100, hysteresis=50, debounce=0.02):
+    # Taster: geschlossen unter threshold Ohm, offen über threshold + hysteresis
+    return InputConfig(DIGITAL, threshold=threshold, hysteresis=hysteresis, debounce=debounce)
+
+class Input:
+    __slots__ = ( "name", "config", "convert", "value", "active", "edge_time", "pending" )
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.convert = config.calibration
+        self.value = None
+        self.active = None          # None: noch kein Wert
+        self.edge_time = None
+        self.pending = None         # Ende der Sperrzeit mit ungemeldetem Wechsel
+
+    def update(self, raw, now):
+        # liefert (Messwert, Flanke), Flanke ist True/False bei Wechsel in
+        # den aktiven bzw. inaktiven Zustand, sonst None
+        value = self.value = self.convert(raw)
+        return value, self.evaluate(now)
+
+    def settle(self, now):
+        # letzten Wert nach Ablauf der Sperrzeit erneut prüfen, liefert die
+        # Flanke oder None
+        if self.pending is None:
+            return None
+        return self.evaluate(now)
+
+    def evaluate(self, now):
+        value = self.value
+        config = self.config
+        self.pending = None
+        if config.threshold is None:
+            return None
+
+        if self.active is None:
+            active = value < config.threshold if config.active_below else value > config.threshold
+        elif config.active_below:
+            active = value < config.threshold if not self.active else \
+                     value <= config.threshold + config.hysteresis
+        else:
+            active = value > config.threshold if not self.active else \
+                     value >= config.threshold - config.hysteresis
+
+        if active == self.active:
+            return None
+        if self.edge_time is not None and now - self.edge_time < config.debounce:
+            # prellt noch, Zustand bleibt bis zum Ende der Sperrzeit
+            self.pending = self.edge_time + config.debounce
+            return None
+        first = self.active is None
+        self.active = active
+        self.edge_time = now
+        # der erste Wert legt nur den Zustand fest
+        return None if first else active
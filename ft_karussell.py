@@ -14,19 +14,43 @@ except ModuleNotFoundError as e:
     print("You may install it via 'pip3 install gatt' ...");
     exit(-1);
     
-import sys, struct
+import sys, time, struct
 import threading
 
+import discovery
+import gatt_cache
+import toy_profiles
+import toy_timer
+import motion_profile
+import ft_inputs
+import output_state
+
+# Fahrt des Karussells: in RAMP_TIME Sekunden auf volle Geschwindigkeit,
+# CRUISE_TIME Sekunden fahren, in RAMP_TIME Sekunden bremsen. Die Rampen
+# sind linear oder S-Kurven (motion_profile.S_CURVE)
+RAMP_TIME = 10
+CRUISE_TIME = 30
+SHAPE = motion_profile.LINEAR
+
+# Benutzte Eingänge und ihr Modus, siehe ft_inputs.py. Der Taster an I1
+# startet das Karussell, weitere Eingänge werden nur ausgegeben, z.B.
+#   "I2": ft_inputs.InputConfig(ft_inputs.VOLTAGE),
+#   "I3": ft_inputs.InputConfig(ft_inputs.ULTRASONIC, threshold=10),
+INPUTS = {
+    "I1": ft_inputs.digital(threshold=100, debounce=0.02),
+}
+
 # GATT Device-Manager, um selektiv nach ft-Controllern zu suchen
 class FtBtSmartDeviceManager(gatt.DeviceManager):
+    PROFILES = [ toy_profiles.FT_BT_SMART ]
+
     def __init__(self, adapter_name='hci0'):
         super().__init__(adapter_name=adapter_name)
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf LNT-OID und passenden Gerätenamen
-        if((":".join(device.mac_address.split(':')[0:3]) == "10:45:f8") and
-           (device.alias() == "BT Smart Controller")):
+        # teste auf passende OID und Gerätenamen, siehe toy_profiles.py
+        if toy_profiles.identify(device, self.PROFILES):
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
             if not self.connected_device:
@@ -47,13 +71,31 @@ class FtBtSmartDeviceManager(gatt.DeviceManager):
     def quit(self):
         super().stop()
 
-class FtBtSmartDevice(gatt.Device):
+# benötigte Services und Charakteristiken
+CHANNEL = ("8ae87702-ad7d-11e6-80f5-76304dec7eb7", "8ae87e32-ad7d-11e6-80f5-76304dec7eb7")
+I1 = ft_inputs.VALUE["I1"]
+M1 = ("8ae883b4-ad7d-11e6-80f5-76304dec7eb7", "8ae8860c-ad7d-11e6-80f5-76304dec7eb7")
+
+class FtBtSmartDevice(gatt_cache.CachedLayout, gatt.Device):
+    # nach dem ersten Verbinden aus dem Cache, siehe gatt_cache.py
+    CHARACTERISTICS = ( CHANNEL, M1 ) + tuple(ft_inputs.VALUE.values()) + tuple(ft_inputs.MODE.values())
+    # gemeinsamer toy_timer.Scheduler, ohne ihn startet das Karussell nicht
+    # von selbst (z.B. mit toy_asyncio.py)
+    scheduler = None
+
     def __init__(self, mac_address, manager):
         super().__init__(mac_address, manager)
         self.m1 = None
         self.state = None
         self.write_in_progress = False
         self.outstanding_m1_value = None
+        # zuletzt gesendete Geschwindigkeit, siehe output_state.py
+        self.outputs = output_state.OutputShadow()
+        self.m1_in_flight = None
+        # Charakteristik-UUID -> ft_inputs.Input
+        self.inputs = { }
+        # Eingänge, deren Wert nach der Entprellzeit erneut geprüft wird
+        self.settling = set()
     
     def connect(self):
         super().connect()
@@ -81,29 +123,34 @@ class FtBtSmartDevice(gatt.Device):
     def services_resolved(self):
         super().services_resolved()
 
-        for service in self.services:
-            # Lese alle Charakteristiken aus, die wir benötigen
-            for characteristic in service.characteristics:
-                # Kanal-Service, setze LED auf orange, um anzuzeigen, dass wir
-                # verbunden sind
-                if (service.uuid == "8ae87702-ad7d-11e6-80f5-76304dec7eb7" and
-                    characteristic.uuid == "8ae87e32-ad7d-11e6-80f5-76304dec7eb7"):
-                    characteristic.name = "Channel"
-                    characteristic.write_value( bytes([1]) )
-                    self.write_in_progress = True
-
-                # Eingang I1 permanent abfragen
-                if (service.uuid == "8ae8952a-ad7d-11e6-80f5-76304dec7eb7" and
-                    characteristic.uuid == "8ae89a2a-ad7d-11e6-80f5-76304dec7eb7"):
-                    characteristic.name = "I1"
-                    characteristic.read_value()
-                    characteristic.enable_notifications()
-
-                # Charaketeristik von Ausgang M1 erfragen
-                if (service.uuid == "8ae883b4-ad7d-11e6-80f5-76304dec7eb7" and
-                    characteristic.uuid == "8ae8860c-ad7d-11e6-80f5-76304dec7eb7"):
-                    characteristic.name = "M1"
-                    self.m1 = characteristic
+        # Kanal-Service, setze LED auf orange, um anzuzeigen, dass wir
+        # verbunden sind
+        characteristic = self.layout.get(CHANNEL)
+        if characteristic:
+            characteristic.name = "Channel"
+            characteristic.write_value( bytes([1]) )
+            self.write_in_progress = True
+
+        # Eingänge im gewünschten Modus einmal lesen, danach melden sie sich
+        # per Notifikation
+        for name, config in INPUTS.items():
+            characteristic = self.layout.get(ft_inputs.VALUE[name])
+            if not characteristic:
+                continue
+            mode = self.layout.get(ft_inputs.MODE[name])
+            if mode:
+                mode.name = name + " mode"
+                mode.write_value(bytes([config.code]))
+            characteristic.name = name
+            self.inputs[characteristic.uuid] = ft_inputs.Input(name, config)
+            characteristic.read_value()
+            characteristic.enable_notifications()
+
+        # Charaketeristik von Ausgang M1 erfragen
+        characteristic = self.layout.get(M1)
+        if characteristic:
+            characteristic.name = "M1"
+            self.m1 = characteristic
                 
     def characteristic_enable_notification_succeeded(self, characteristic):
         super().characteristic_enable_notification_succeeded(characteristic)
@@ -115,106 +162,146 @@ class FtBtSmartDevice(gatt.Device):
 
     def characteristic_write_value_succeeded(self, characteristic):
         super().characteristic_write_value_succeeded(characteristic)
-        if not self.outstanding_m1_value:
-            self.write_in_progress = False
-        else:
-            self.m1.write_value(bytes([self.outstanding_m1_value]))
-            self.outstanding_m1_value = None
-        
+        if characteristic.name.endswith(" mode"):
+            # Modus eines Eingangs, hat mit M1 nichts zu tun
+            return
+        if characteristic.name == "M1":
+            self.outputs.acknowledged("M1", self.m1_in_flight)
+        self.write_next()
         
     def characteristic_write_value_failed(self, characteristic, error):
         super().characteristic_write_value_failed(characteristic, error)
         print("Schreiben fehlgeschlagen", error)
+        if characteristic.name == "M1":
+            # welche Geschwindigkeit anliegt, ist unbekannt
+            self.outputs.failed("M1")
+            self.write_next()
+
+    def write_next(self):
+        # eine wartende Geschwindigkeit 0 muss auch gesendet werden
+        if self.outstanding_m1_value is None:
+            self.write_in_progress = False
+        else:
+            self.write_m1(self.outstanding_m1_value)
+            self.outstanding_m1_value = None
+
+    def write_m1(self, value):
+        self.m1_in_flight = value
+        self.m1.write_value(bytes([value]))
     
     def characteristic_value_updated(self, characteristic, value):
+        input = self.inputs.get(characteristic.uuid)
+        if input is None:
+            return
         # Wert wird in zwei Bytes als 16-Bit-Wert geliefert
-        value_int = struct.unpack('<H', value)[0]
+        value, edge = input.update(struct.unpack('<H', value)[0], time.monotonic())
+        self.input_changed(input, value, edge)
+        # Wechsel während der Entprellzeit: der Controller meldet ihn nicht
+        # noch einmal, also nach der Sperrzeit selbst nachsehen. Ohne
+        # Scheduler geschieht das erst mit dem nächsten Wert
+        if input.pending is not None and self.scheduler is not None and input.name not in self.settling:
+            self.settling.add(input.name)
+            self.scheduler.call_at(input.pending, self.input_settled, input)
+
+    def input_settled(self, input):
+        self.settling.discard(input.name)
+        edge = input.settle(time.monotonic())
+        if edge is not None:
+            self.input_changed(input, input.value, edge)
+        elif input.pending is not None:
+            # Sperrzeit wegen Rundung noch nicht ganz abgelaufen
+            self.settling.add(input.name)
+            self.scheduler.call_at(input.pending, self.input_settled, input)
 
+    def input_changed(self, input, value, edge):
         # Starten des Karussel wenn Taster gedrückt. Es wird der Widerstand des Tasters
         # gemessen und unter 100 Ohm wird der Taster als geschlossen anerkannt
-        if value_int < 100 and not self.state:
+        if input.name != "I1":
+            print("Eingang", input.name + ":", value, "aktiv" if input.active else "")
+        elif edge and not self.state and self.scheduler is not None:
             print("Taster wurde gedrückt, Karussell startet ...")
             self.state = "starten"
-            self.counter = 0
+            profile = motion_profile.trapezoid(100, CRUISE_TIME, ramp_time=RAMP_TIME, shape=SHAPE)
+            # neuer Wert nur, wenn der letzte bestätigt ist, läuft im
+            # GLib-Thread wie die Rückrufe oben
+            motion_profile.Player(self.scheduler, profile, self.run,
+                                  ready=lambda: not self.write_in_progress,
+                                  segment=self.segment, done=self.finished).start()
+
+    def segment(self, index):
+        # Abschnitte des Profils: 0 anfahren, 1 fahren, 2 bremsen
+        if index == 1:
+            print("Karussell fährt ...")
+            self.state = "fahren"
+        elif index == 2:
+            print("Karussell bremst ...")
+            self.state = "bremsen"
+
+    def finished(self):
+        print("Fahrt beendet ...")
+        self.state = None
 
     def run(self, value):
         # das Karussell soll drehen. Wenn das letzte Motorkommando noch nicht
         # bestätigt wurde, dann wird der Wert gespeichert und gesendet, sobald
         # das letzte Kommando bestätigt wurde
         
+        # dreht das Karussell schon so (z.B. beim Fahren mit voller
+        # Geschwindigkeit), wird nichts gesendet
+        if not self.outputs.changes("M1", value):
+            return False
+
         # letzter Wert wurde noch nicht gesendet?
         if self.write_in_progress:
             self.outstanding_m1_value = value
         else:
-            self.m1.write_value(bytes([value]))
+            self.write_m1(value)
             self.write_in_progress = True
+        return True
+
+    def refresh_outputs(self):
+        # zuletzt gewünschte Geschwindigkeit erneut senden
+        for key, value in self.outputs.refresh():
+            self.run(value)
         
-# Hintergrund-Prozess starten, der den GATT-DBus bedient
-manager = FtBtSmartDeviceManager(adapter_name='hci0')
-thread = threading.Thread(target = manager.run)
-thread.start()
-
-if len(sys.argv) > 1:
-    # teste, ob der Parameter einer MAC-Adresse entspricht
-    if len(sys.argv[1].split(':')) != 6:
-        print("Bitte eine gültige MAC-Adresse angeben.")
-        print("z.B.:", sys.argv[0], "10:45:f8:7b:86:ed");
-        exit(1)
-
-    # Parameter auf der Kommandozeile gegeben
-    manager.connected_device = FtBtSmartDevice(mac_address=sys.argv[1], manager=manager)
-    manager.connected_device.connect()
-
-else:
-    print("Suche nach fischertechnik BT-Smart-Controller ...")
-    print("Bitte Taster am Controller mehrere Sekunden drücken.")
-    manager.start_discovery()
-
-print("Beenden mit Ctrl-C")
-
-# führe eigentliches Programm aus, solange im Hintergrund
-# der Manager noch läuft
-while True:
-    karussell = manager.connected_device
-    
-    # karussel läuft
-    if karussell and karussell.state:
-        if karussell.state == "starten":
-            karussell.run(karussell.counter)
-            if karussell.counter < 100:
-                # schneller werden bis 100
-                karussell.counter += 1
-            else:
-                # volle Geschwindigkeit erreicht
-                print("Karussell fährt ...")
-                karussell.state = "fahren"
-                karussell.counter = 0
-                
-        elif karussell.state == "fahren":
-            # 30 Sekunden fahren
-            if karussell.counter < 300:
-                karussell.counter += 1
-            else:
-                print("Karussell bremst ...")
-                karussell.state = "bremsen"
-                karussell.counter = 100
-                
-        elif karussell.state == "bremsen":
-            # bremsen bis zu Stillstand
-            karussell.run(karussell.counter)
-            if karussell.counter > 0:
-                karussell.counter -= 1
-            else:
-                print("Fahrt beendet ...")
-                karussell.state = None
-    
-    # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
-    # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
-    # die Hauptschleife 10 mal pro Sekunde durchlaufen wird
-    thread.join(.1)
-    if not thread.isAlive():
-        break
-
-# versuche Geräteverbindung zum Abschluss zu trennen
-if manager.connected_device:
-    manager.connected_device.disconnect()
+if __name__ == "__main__":
+    # Hintergrund-Prozess starten, der den GATT-DBus bedient
+    manager = FtBtSmartDeviceManager(adapter_name='hci0')
+    # die Fahrt wird im GLib-Thread getaktet
+    FtBtSmartDevice.scheduler = toy_timer.Scheduler(manager)
+    thread = threading.Thread(target = manager.run)
+    thread.start()
+
+    if len(sys.argv) > 1:
+        # teste, ob der Parameter einer MAC-Adresse entspricht
+        if len(sys.argv[1].split(':')) != 6:
+            print("Bitte eine gültige MAC-Adresse angeben.")
+            print("z.B.:", sys.argv[0], "10:45:f8:7b:86:ed");
+            exit(1)
+
+        # Parameter auf der Kommandozeile gegeben
+        manager.connected_device = FtBtSmartDevice(mac_address=sys.argv[1], manager=manager)
+        manager.connected_device.connect()
+
+    else:
+        print("Suche nach fischertechnik BT-Smart-Controller ...")
+        print("Bitte Taster am Controller mehrere Sekunden drücken.")
+        # nur Bluetooth-LE-Geräte melden lassen
+        discovery.start_discovery(manager)
+
+    print("Beenden mit Ctrl-C")
+
+    # führe eigentliches Programm aus, solange im Hintergrund
+    # der Manager noch läuft
+    while True:
+        # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
+        # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
+        # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
+        thread.join(1)
+        if not thread.is_alive():
+            break
+
+    # versuche Geräteverbindung zum Abschluss zu trennen
+    if manager.connected_device:
+        manager.connected_device.disconnect()
+        print("Ausgaben:", manager.connected_device.outputs.statistics())
@@ -17,16 +17,33 @@ except ModuleNotFoundError as e:
 import sys, struct
 import threading
 
+import discovery
+import gatt_cache
+import toy_profiles
+import output_queue
+import output_state
+import toy_timer
+import motion_profile
+
+# Fahrt des Rennwagens: in RAMP_TIME Sekunden auf volle Geschwindigkeit,
+# STRAIGHT_TIME Sekunden geradeaus, CURVE_TIME Sekunden um die Kurve, in
+# RAMP_TIME Sekunden bremsen
+RAMP_TIME = 2
+STRAIGHT_TIME = 2
+CURVE_TIME = 2
+SHAPE = motion_profile.S_CURVE
+
 # GATT Device-Manager, um selektiv nach ft-Controllern zu suchen
 class FtBtCtrlRcvDeviceManager(gatt.DeviceManager):
+    PROFILES = [ toy_profiles.FT_BT_CONTROL_RECEIVER ]
+
     def __init__(self, adapter_name='hci0'):
         super().__init__(adapter_name=adapter_name)
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf LNT-OID und passenden Gerätenamen
-        if((":".join(device.mac_address.split(':')[0:3]) == "10:45:f8") and
-           (device.alias() == "BT Control Receiver")):
+        # teste auf passende OID und Gerätenamen, siehe toy_profiles.py
+        if toy_profiles.identify(device, self.PROFILES):
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
             if not self.connected_device:
@@ -47,15 +64,29 @@ class FtBtCtrlRcvDeviceManager(gatt.DeviceManager):
     def quit(self):
         super().stop()
 
-class FtBtCtrlRcvDevice(gatt.Device):
+# benötigte Services und Charakteristiken
+CHANNEL = ("2e582b3a-c5c5-11e6-9d9d-cec0c932ce01", "2e582de2-c5c5-11e6-9d9d-cec0c932ce01")
+M1 = ("2e58327e-c5c5-11e6-9d9d-cec0c932ce01", "2e583378-c5c5-11e6-9d9d-cec0c932ce01")
+M4 = ("2e58327e-c5c5-11e6-9d9d-cec0c932ce01", "2e5837b0-c5c5-11e6-9d9d-cec0c932ce01")
+
+class FtBtCtrlRcvDevice(gatt_cache.CachedLayout, gatt.Device):
+    # nach dem ersten Verbinden aus dem Cache, siehe gatt_cache.py
+    CHARACTERISTICS = ( CHANNEL, M1, M4 )
+    # gemeinsamer toy_timer.Scheduler, ohne ihn fährt der Rennwagen nicht
+    # von selbst los (z.B. mit toy_asyncio.py)
+    scheduler = None
+
     def __init__(self, mac_address, manager):
         super().__init__(mac_address, manager)
         self.m1 = None
         self.state = None
         self.write_in_progress = False
-        self.outstanding_run = None
-        self.outstanding_steer = None
-        self.m1 = None
+        # je Ausgang nur der neueste noch nicht gesendete Wert, die Ausgänge
+        # kommen reihum dran, siehe output_queue.py
+        self.writes = output_queue.CoalescingQueue()
+        # zuletzt gesendeter Wert je Ausgang, siehe output_state.py
+        self.outputs = output_state.OutputShadow()
+        self.in_flight = None
         self.servo = None
     
     def connect(self):
@@ -83,32 +114,38 @@ class FtBtCtrlRcvDevice(gatt.Device):
     def services_resolved(self):
         super().services_resolved()
 
-        for service in self.services:
-            # Lese alle Charakteristiken aus, die wir benötigen
-            for characteristic in service.characteristics:
-                # Kanal-Service, setze LED auf orange, um anzuzeigen, dass wir
-                # verbunden sind
-                if (service.uuid == "2e582b3a-c5c5-11e6-9d9d-cec0c932ce01" and
-                    characteristic.uuid == "2e582de2-c5c5-11e6-9d9d-cec0c932ce01"):
-                    characteristic.name = "Channel"
-                    characteristic.write_value( bytes([1]) )
-                    self.write_in_progress = True
-
-                # Charaketeristik von Ausgang M1 erfragen
-                if (service.uuid == "2e58327e-c5c5-11e6-9d9d-cec0c932ce01" and
-                    characteristic.uuid == "2e583378-c5c5-11e6-9d9d-cec0c932ce01"):
-                    characteristic.name = "M1"
-                    self.m1 = characteristic
-                
-                # Charaketeristik von Ausgang M4 (Servo) erfragen
-                if (service.uuid == "2e58327e-c5c5-11e6-9d9d-cec0c932ce01" and
-                    characteristic.uuid == "2e5837b0-c5c5-11e6-9d9d-cec0c932ce01"):
-                    characteristic.name = "M4"
-                    self.servo = characteristic
+        # Kanal-Service, setze LED auf orange, um anzuzeigen, dass wir
+        # verbunden sind
+        characteristic = self.layout.get(CHANNEL)
+        if characteristic:
+            characteristic.name = "Channel"
+            characteristic.write_value( bytes([1]) )
+            self.write_in_progress = True
+
+        # Charaketeristik von Ausgang M1 erfragen
+        characteristic = self.layout.get(M1)
+        if characteristic:
+            characteristic.name = "M1"
+            self.m1 = characteristic
+
+        # Charaketeristik von Ausgang M4 (Servo) erfragen
+        characteristic = self.layout.get(M4)
+        if characteristic:
+            characteristic.name = "M4"
+            self.servo = characteristic
 
         # und nun fahre ...
         self.state = "starten"
-        self.counter = 0
+        if self.scheduler is not None:
+            profile = motion_profile.Profile([
+                motion_profile.ramp(0, 100, RAMP_TIME, shape=SHAPE),
+                motion_profile.hold(100, STRAIGHT_TIME),
+                motion_profile.hold(100, CURVE_TIME),
+                motion_profile.ramp(100, 0, RAMP_TIME, shape=SHAPE) ])
+            # neuer Wert nur, wenn der letzte bestätigt ist
+            motion_profile.Player(self.scheduler, profile, self.run,
+                                  ready=lambda: not self.write_in_progress,
+                                  segment=self.segment, done=self.finished).start()
         
     def characteristic_enable_notification_succeeded(self, characteristic):
         super().characteristic_enable_notification_succeeded(characteristic)
@@ -120,130 +157,115 @@ class FtBtCtrlRcvDevice(gatt.Device):
 
     def characteristic_write_value_succeeded(self, characteristic):
         super().characteristic_write_value_succeeded(characteristic)
-        if not self.outstanding_run and not self.outstanding_steer:
-            self.write_in_progress = False
-        elif self.outstanding_run:
-            self.m1.write_value(bytes([self.outstanding_run]))
-            self.outstanding_run = None
-        else:
-            self.servo.write_value(bytes([self.outstanding_steer]))
-            self.outstanding_steer = None
-        
+        if self.in_flight is not None:
+            self.outputs.acknowledged(characteristic.name, self.in_flight[1][0])
+        self.write_next()
         
     def characteristic_write_value_failed(self, characteristic, error):
         super().characteristic_write_value_failed(characteristic, error)
         print("Schreiben fehlgeschlagen", error)
+        # welcher Wert anliegt, ist unbekannt
+        self.outputs.failed(characteristic.name)
+        # die übrigen Ausgänge nicht blockieren
+        self.write_next()
+
+    def write(self, characteristic, value):
+        # Wert für einen Ausgang einreihen. Ein noch nicht gesendeter Wert
+        # desselben Ausgangs wird ersetzt, ohne seinen Platz in der Reihe zu
+        # verlieren. Lenken muss so höchstens auf einen Fahrwert warten,
+        # egal wie oft run() aufgerufen wird. Liegt der Wert schon an oder
+        # ist unterwegs, wird nichts gesendet
+        if not self.outputs.changes(characteristic.name, value):
+            return False
+        self.writes.put((characteristic, bytes([value])), key=characteristic.name,
+                        port=characteristic.name)
+        if not self.write_in_progress:
+            self.write_next()
+        return True
+
+    def write_next(self):
+        self.in_flight = None
+        if not self.writes:
+            self.write_in_progress = False
+            return
+        characteristic, data = self.in_flight = self.writes.get()
+        characteristic.write_value(data)
+        self.write_in_progress = True
+
+    def refresh_outputs(self):
+        # zuletzt gewünschte Werte aller Ausgänge erneut senden
+        outputs = { "M1": self.m1, "M4": self.servo }
+        for name, value in self.outputs.refresh():
+            self.write(outputs[name], value)
     
     def run(self, value):
-        # der Rennwagen soll dahren. Wenn das letzte Kommando noch nicht
-        # bestätigt wurde, dann wird das Kommando gespeichert und gesendet, sobald
-        # das letzte Kommando bestätigt wurde
-        
-        # letzter Wert wurde noch nicht gesendet?
-        if self.write_in_progress:
-            self.outstanding_run = value
-        else:
-            self.m1.write_value(bytes([value]))
-            self.write_in_progress = True
+        # der Rennwagen soll fahren. Wenn das letzte Kommando noch nicht
+        # bestätigt wurde, wird der Wert gesendet, sobald er an der Reihe ist
+        self.write(self.m1, value)
+
+    def segment(self, index):
+        # Abschnitte des Profils, läuft im GLib-Thread wie die Rückrufe oben
+        if index == 1:
+            print("Rennwagen fährt ...")
+            self.state = "fahren"
+        elif index == 2:
+            # lenken
+            self.steer(80)
+            print("Rennwagen lenkt ...")
+            self.state = "kurve"
+        elif index == 3:
+            # nicht mehr lenken
+            self.steer(0)
+            print("Rennwagen bremst ...")
+            self.state = "bremsen"
+
+    def finished(self):
+        print("Fahrt beendet ...")
+        self.state = None
+        self.disconnect()
 
     def steer(self, value):
-        # der Rennwagen soll lenken. Wenn das letzte Kommando noch nicht
-        # bestätigt wurde, dann wird das Kommando gespeichert und gesendet, sobald
-        # das letzte Kommando bestätigt wurde
-        
-        # letzter Wert wurde noch nicht gesendet?
-        if self.write_in_progress:
-            self.outstanding_steer = value
-        else:
-            self.servo.write_value(bytes([value]))
-            self.write_in_progress = True
+        # der Rennwagen soll lenken
+        self.write(self.servo, value)
 
-# Hintergrund-Prozess starten, der den GATT-DBus bedient
-manager = FtBtCtrlRcvDeviceManager(adapter_name='hci0')
-thread = threading.Thread(target = manager.run)
-thread.start()
-
-if len(sys.argv) > 1:
-    # teste, ob der Parameter einer MAC-Adresse entspricht
-    if len(sys.argv[1].split(':')) != 6:
-        print("Bitte eine gültige MAC-Adresse angeben.")
-        print("z.B.:", sys.argv[0], "10:45:f8:7b:86:ed");
-        exit(1)
-
-    # Parameter auf der Kommandozeile gegeben
-    manager.connected_device = FtBtCtrlRcvDevice(mac_address=sys.argv[1], manager=manager)
-    manager.connected_device.connect()
-
-else:
-    print("Suche nach fischertechnik BT-Control-Receiver ...")
-    print("Bitte Taster am Controller mehrere Sekunden drücken.")
-    manager.start_discovery()
-
-print("Beenden mit Ctrl-C")
-
-# führe eigentliches Programm aus, solange im Hintergrund
-# der Manager noch läuft
-while True:
-    rennwagen = manager.connected_device
-    
-    # Rennwagen fährt
-    # - er beschleunigt sanft
-    # - fährt 2 Sekunden gerade
-    # - fährt 2 Sekunden um die Kurve
-    # - er bremst sanft
-    if rennwagen and rennwagen.state:
-        if rennwagen.state == "starten":
-            rennwagen.run(rennwagen.counter)
-            if rennwagen.counter < 100:
-                # schneller werden bis 100
-                rennwagen.counter += 5
-            else:
-                # volle Geschwindigkeit erreicht
-                print("Rennwagen fährt ...")
-                rennwagen.state = "fahren"
-                rennwagen.counter = 0
-                
-        elif rennwagen.state == "fahren":
-            # 2 Sekunden fahren
-            if rennwagen.counter < 20:
-                rennwagen.counter += 1
-            else:
-                # lenken
-                rennwagen.steer(80);
-                
-                print("Rennwagen lenkt ...")
-                rennwagen.state = "kurve"
-                rennwagen.counter = 0
-                
-        elif rennwagen.state == "kurve":
-            # weitere 2 Sekunden fahren
-            if rennwagen.counter < 20:
-                rennwagen.counter += 1
-            else:
-                # nicht mehr lenken
-                rennwagen.steer(0);
-                
-                print("Rennwagen bremst ...")
-                rennwagen.state = "bremsen"
-                rennwagen.counter = 100
-                
-        elif rennwagen.state == "bremsen":
-            # bremsen bis zu Stillstand
-            rennwagen.run(rennwagen.counter)
-            if rennwagen.counter > 0:
-                rennwagen.counter -= 5
-            else:
-                print("Fahrt beendet ...")
-                rennwagen.state = None
-                rennwagen.disconnect()
-    
-    # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
-    # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
-    # die Hauptschleife 10 mal pro Sekunde durchlaufen wird
-    thread.join(.1)
-    if not thread.isAlive():
-        break
-
-# versuche Geräteverbindung zum Abschluss zu trennen
-if manager.connected_device:
-    manager.connected_device.disconnect()
+if __name__ == "__main__":
+    # Hintergrund-Prozess starten, der den GATT-DBus bedient
+    manager = FtBtCtrlRcvDeviceManager(adapter_name='hci0')
+    # die Fahrt wird im GLib-Thread getaktet
+    FtBtCtrlRcvDevice.scheduler = toy_timer.Scheduler(manager)
+    thread = threading.Thread(target = manager.run)
+    thread.start()
+
+    if len(sys.argv) > 1:
+        # teste, ob der Parameter einer MAC-Adresse entspricht
+        if len(sys.argv[1].split(':')) != 6:
+            print("Bitte eine gültige MAC-Adresse angeben.")
+            print("z.B.:", sys.argv[0], "10:45:f8:7b:86:ed");
+            exit(1)
+
+        # Parameter auf der Kommandozeile gegeben
+        manager.connected_device = FtBtCtrlRcvDevice(mac_address=sys.argv[1], manager=manager)
+        manager.connected_device.connect()
+
+    else:
+        print("Suche nach fischertechnik BT-Control-Receiver ...")
+        print("Bitte Taster am Controller mehrere Sekunden drücken.")
+        # nur Bluetooth-LE-Geräte melden lassen
+        discovery.start_discovery(manager)
+
+    print("Beenden mit Ctrl-C")
+
+    # führe eigentliches Programm aus, solange im Hintergrund
+    # der Manager noch läuft
+    while True:
+        # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
+        # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
+        # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
+        thread.join(1)
+        if not thread.is_alive():
+            break
+
+    # versuche Geräteverbindung zum Abschluss zu trennen
+    if manager.connected_device:
+        manager.connected_device.disconnect()
+        print("Ausgaben:", manager.connected_device.outputs.statistics())
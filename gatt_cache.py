@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# Dauerhafter Zwischenspeicher für den GATT-Aufbau der Controller.
+#
+# python-gatt baut nach jedem Verbindungsaufbau die komplette Liste aller
+# Services und Charakteristiken auf. Dafür wird je Service erneut der
+# gesamte Objektbaum von BlueZ (inkl. aller Geräte in Reichweite) per
+# GetManagedObjects über D-Bus geholt. Die Geräteklassen durchsuchen danach
+# alle Charakteristiken per UUID-Vergleich nach den wenigen, die sie
+# tatsächlich benutzen.
+#
+# Hier werden die ATT-Handles der benutzten Charakteristiken je Controller
+# (MAC-Adresse und Firmware) in einer Textdatei abgelegt. Beim nächsten
+# Verbinden werden nur diese Charakteristiken direkt über ihren D-Bus-Pfad
+# angelegt, der bei BlueZ aus den Handles gebildet wird. Jede wird per UUID
+# geprüft. Passt eine nicht (z.B. nach einem Firmware-Update), wird der
+# Eintrag verworfen und wie bisher der komplette Aufbau gelesen.
+#
+# Die Datei wird auch von den Shell-Scripts genutzt (siehe gatt_cache.sh),
+# eine Zeile je Charakteristik:
+#
+#   MAC FIRMWARE SERVICE-UUID CHARAKTERISTIK-UUID SERVICE-HANDLE CHAR-HANDLE VALUE-HANDLE
+#
+# Ist die Firmware nicht bekannt, steht dort "-".
+
+import os
+
+CACHE_FILE = os.environ.get("TOY_GATT_CACHE",
+                            os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                                        os.path.expanduser("~/.cache")),
+                                         "toy-gatt-layout"))
+UNKNOWN_FIRMWARE = "-"
+
+class LayoutCache:
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+        # (MAC, Firmware) -> { (Service-UUID, Charakteristik-UUID) ->
+        #                      (Service-Handle, Char-Handle, Value-Handle) }
+        self.entries = None
+
+    def load(self):
+        if self.entries is not None:
+            return self.entries
+        self.entries = { }
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) != 7 or line.startswith("#"):
+                        continue
+                    mac, firmware, service, characteristic = fields[0:4]
+                    try:
+                        handles = tuple(int(h, 16) for h in fields[4:7])
+                    except ValueError:
+                        continue
+                    self.entries.setdefault((mac.upper(), firmware), { })[
+                        (service.lower(), characteristic.lower())] = handles
+        except FileNotFoundError:
+            pass
+        return self.entries
+
+    def save(self):
+        # erst in eine temporäre Datei schreiben, damit ein gleichzeitig
+        # startendes Script nie eine halbe Datei liest
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        tmp = "%s.%d" % (self.filename, os.getpid())
+        with open(tmp, "w") as f:
+            for (mac, firmware), layout in sorted(self.load().items()):
+                for (service, characteristic), handles in sorted(layout.items()):
+                    f.write("%s %s %s %s 0x%04x 0x%04x 0x%04x\n" %
+                            ((mac, firmware, service, characteristic) + handles))
+        os.replace(tmp, self.filename)
+
+    def lookup(self, mac, firmware, wanted):
+        # Handles aller gewünschten Charakteristiken oder None. Ein Eintrag zur
+        # gleichen Firmware wird bevorzugt, sonst wird jeder Eintrag der MAC-
+        # Adresse genommen, die Prüfung beim Verbinden deckt veraltete auf
+        mac = mac.upper()
+        found = None
+        for (entry_mac, entry_firmware), layout in self.load().items():
+            if entry_mac == mac and all(key in layout for key in wanted):
+                if entry_firmware == firmware:
+                    return layout
+                found = layout
+        return found
+
+    def store(self, mac, firmware, layout):
+        self.load().setdefault((mac.upper(), firmware), { }).update(layout)
+        self.save()
+
+    def invalidate(self, mac):
+        mac = mac.upper()
+        entries = self.load()
+        stale = [ key for key in entries if key[0] == mac ]
+        for key in stale:
+            del entries[key]
+        if stale:
+            self.save()
+
+    def firmware_reported(self, mac, firmware):
+        # Der Controller hat seine Firmware selbst gemeldet (z.B. Lego-Hubs per
+        # Hub-Property 3). Der gerade benutzte und geprüfte Aufbau gehört zu
+        # dieser Firmware
+        mac = mac.upper()
+        entries = self.load()
+        stale = [ key for key in entries if key[0] == mac and key[1] != firmware ]
+        for key in stale:
+            entries.setdefault((mac, firmware), { }).update(entries.pop(key))
+        if stale:
+            self.save()
+
+cache = LayoutCache()
+
+def handle(path):
+    # BlueZ bildet die Pfade aus den Handles, z.B. .../service000c/char000d
+    return int(path[-4:], 16)
+
+class _CachedService:
+    # Ersatz für gatt.Service, der nur die benutzten Charakteristiken hält und
+    # nicht selbst per GetManagedObjects nach ihnen sucht
+    def __init__(self, device, path, uuid):
+        self.device = device
+        self._path = path
+        self.uuid = uuid
+        self._bus = device._bus
+        self._object_manager = device._object_manager
+        self.characteristics = [ ]
+
+    def _connect_signals(self):
+        for characteristic in self.characteristics:
+            characteristic._connect_signals()
+
+    def _disconnect_signals(self):
+        for characteristic in self.characteristics:
+            characteristic._disconnect_signals()
+
+class CachedLayout:
+    # Wird in der Geräteklasse vor gatt.Device gesetzt. CHARACTERISTICS nennt
+    # die benötigten (Service-UUID, Charakteristik-UUID), nach services_resolved()
+    # enthält self.layout die zugehörigen gatt.Characteristic-Objekte.
+    # layout_cache = None schaltet den Cache ab (z.B. mit offline_gatt.py)
+    CHARACTERISTICS = ( )
+    layout_cache = cache
+
+    def services_resolved(self):
+        self.layout = None
+        if self.layout_cache is None:
+            super().services_resolved()
+            self.layout = self.resolved_layout()
+            return
+
+        firmware = self.firmware()
+        handles = self.layout_cache.lookup(self.mac_address, firmware, self.CHARACTERISTICS)
+        if handles is not None:
+            self.layout = self.cached_layout(handles)
+            if self.layout is None:
+                print("GATT-Aufbau im Cache veraltet, lese neu ...")
+                self.layout_cache.invalidate(self.mac_address)
+
+        if self.layout is None:
+            super().services_resolved()
+            self.layout = self.resolved_layout()
+            if len(self.layout) == len(self.CHARACTERISTICS):
+                self.layout_cache.store(self.mac_address, firmware, {
+                    key: (handle(ch.path.rsplit("/", 1)[0]), handle(ch.path), handle(ch.path) + 1)
+                    for key, ch in self.layout.items() })
+
+    def resolved_layout(self):
+        return { (service.uuid, characteristic.uuid): characteristic
+                 for service in self.services
+                 for characteristic in service.characteristics
+                 if (service.uuid, characteristic.uuid) in self.CHARACTERISTICS }
+
+    def firmware(self):
+        # Modalias enthält u.a. die Versionsnummer aus dem Device-Information-
+        # Service, sofern der Controller einen anbietet
+        import dbus
+        try:
+            return str(self._properties.Get('org.bluez.Device1', 'Modalias')).replace(" ", "_")
+        except dbus.exceptions.DBusException:
+            return UNKNOWN_FIRMWARE
+
+    def cached_layout(self, handles):
+        # Charakteristiken direkt über ihre Pfade anlegen und per UUID prüfen
+        import dbus, gatt
+        self._disconnect_service_signals()
+        services = { }
+        layout = { }
+        try:
+            for (service_uuid, uuid), (service_handle, char_handle, _) in handles.items():
+                if (service_uuid, uuid) not in self.CHARACTERISTICS:
+                    continue
+                path = "%s/service%04x" % (self._device_path, service_handle)
+                service = services.get(path)
+                if service is None:
+                    service = services[path] = _CachedService(self, path, service_uuid)
+                characteristic = gatt.Characteristic(service, "%s/char%04x" % (path, char_handle), uuid)
+                if str(characteristic._properties.Get('org.bluez.GattCharacteristic1', 'UUID')).lower() != uuid:
+                    return None
+                service.characteristics.append(characteristic)
+                layout[(service_uuid, uuid)] = characteristic
+        except dbus.exceptions.DBusException:
+            return None
+
+        self.services = list(services.values())
+        self._connect_service_signals()
+        return layout
@@ -0,0 +1,72 @@
+# Zwischenspeicher für die ATT-Handles der Controller, wird von den
+# Shell-Scripts per "source" eingebunden. Gleiche Datei und gleiches
+# Format wie gatt_cache.py:
+#
+#   MAC FIRMWARE SERVICE-UUID CHARAKTERISTIK-UUID SERVICE-HANDLE CHAR-HANDLE VALUE-HANDLE
+#
+# Ohne Cache fragt jedes Script bei jedem Start per "gatttool --primary" und
+# "gatttool --char-desc" den Aufbau des Controllers ab, jedes Mal mit eigenem
+# Verbindungsaufbau. Mit Cache wird nur die Deklaration der Charakteristik
+# gelesen und geprüft, ob sie noch zur erwarteten UUID gehört.
+
+GATT_CACHE=${TOY_GATT_CACHE:-${XDG_CACHE_HOME:-$HOME/.cache}/toy-gatt-layout}
+
+# UUID in der Byte-Reihenfolge von ATT (little endian), ohne Trennzeichen
+gatt_uuid_le() {
+    local HEX=${1//-/}
+    local LE=""
+    for (( i=30; i>=0; i-=2 )); do
+	LE+=${HEX:$i:2}
+    done
+    echo $LE
+}
+
+# alle Einträge eines Controllers verwerfen
+gatt_cache_invalidate() {
+    if [ -f "$GATT_CACHE" ]; then
+	grep -v -i "^$1 " "$GATT_CACHE" > "$GATT_CACHE.$$"
+	mv "$GATT_CACHE.$$" "$GATT_CACHE"
+    fi
+}
+
+# Aufruf: gatt_value_handle MAC SERVICE-UUID CHARAKTERISTIK-UUID
+# Gibt das Value-Handle der Charakteristik aus, z.B. 0x000e, oder nichts,
+# wenn der Controller sie nicht hat
+gatt_value_handle() {
+    local MAC=${1^^}
+    local SRV=${2,,}
+    local CHR=${3,,}
+
+    # Eintrag im Cache? Dann die Deklaration (Eigenschaften, Value-Handle,
+    # UUID) lesen und mit dem Eintrag vergleichen
+    local ENTRY=`grep -i "^$MAC [^ ]* $SRV $CHR " "$GATT_CACHE" 2>/dev/null | head -n 1`
+    if [ "$ENTRY" != "" ]; then
+	local CH_HDL=`echo $ENTRY | cut -d' ' -f6`
+	local VALUE_HDL=`echo $ENTRY | cut -d' ' -f7`
+	local DECL=`gatttool -b $MAC --char-read -a $CH_HDL | cut -d':' -f2- | tr -d '[:space:]'`
+	if [ "${DECL:2}" == "$(printf "%02x%02x" $((VALUE_HDL & 255)) $((VALUE_HDL >> 8)))$(gatt_uuid_le $CHR)" ]; then
+	    echo $VALUE_HDL
+	    return
+	fi
+	echo "GATT-Aufbau im Cache veraltet, lese neu ..." 1>&2
+	gatt_cache_invalidate $MAC
+    fi
+
+    # vollständige Abfrage wie bisher
+    local SRV_RANGE=`gatttool -b $MAC --primary -u $SRV`
+    if [ "$SRV_RANGE" == "" ]; then
+	return
+    fi
+    local SH=`echo $SRV_RANGE | cut -d' ' -f3`
+    local EH=`echo $SRV_RANGE | cut -d' ' -f6`
+    local CHAR=`gatttool -b $MAC --char-desc -s 0x$SH -e 0x$EH | grep $CHR`
+    local VALUE_HDL=`echo $CHAR | cut -d',' -f1 | cut -d'=' -f2`
+    if [ "$VALUE_HDL" == "" ]; then
+	return
+    fi
+
+    # die Deklaration liegt direkt vor dem Wert
+    mkdir -p "$(dirname "$GATT_CACHE")"
+    printf "%s - %s %s 0x%04x 0x%04x 0x%04x\n" $MAC $SRV $CHR 0x$SH $((VALUE_HDL - 1)) $VALUE_HDL >> "$GATT_CACHE"
+    echo $VALUE_HDL
+}
@@ -0,0 +1,431 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Verwendet python-gatt
+# https://github.com/getsenic/gatt-python
+
+# Hintergrund-Dienst, der die Verbindungen zu den Controllern offen hält.
+#
+# Die Shell-Scripts starten für jeden einzelnen Schreibzugriff ein neues
+# gatttool, das jedes Mal eine eigene Bluetooth-Verbindung aufbaut. Ein
+# LED-Wechsel kostet so mehrere hundert Millisekunden. Dieser Dienst hält
+# je Controller eine Verbindung und nimmt Kommandos über einen Unix-Socket
+# entgegen. Mehrere Programme können gleichzeitig den gleichen Controller
+# nutzen, sie teilen sich dessen Verbindung.
+#
+# Protokoll: eine Zeile je Kommando, Antwort "ok ..." oder "error ...".
+# Charakteristiken werden über ihre UUID angegeben, Werte als Hex-String.
+#
+#   connect MAC                  Verbindung aufbauen (sofern nicht schon offen)
+#   write MAC UUID HEX           Write Request, Antwort nach Bestätigung
+#   write-cmd MAC UUID HEX       Write Without Response, sofortige Antwort
+#   read MAC UUID                Antwort "ok HEX"
+#   notify MAC UUID              Notifikationen als "value MAC UUID HEX" erhalten
+#   disconnect MAC               Verbindung trennen
+#   list                         verbundene Controller
+#
+# Beispiel mit socat:
+#
+#   echo "write 10:45:F8:7B:86:ED 8ae87e32-ad7d-11e6-80f5-76304dec7eb7 01" | \
+#       socat - UNIX-CONNECT:/run/toy-hubs.sock
+#
+# Die Shell-Scripts nutzen den Dienst über hub_daemon.sh, sofern er läuft.
+
+import os, sys, socket, inspect, traceback
+from collections import deque
+
+import discovery
+import lwp3_transport
+from multi_hub import MultiDeviceManager
+
+try:
+    import gatt
+    from gi.repository import GLib
+except ModuleNotFoundError as e:
+    print("Error loading gatt module:", e);
+    print("You may install it via 'pip3 install gatt' ...");
+    exit(-1);
+
+SOCKET_PATH = os.environ.get("TOY_HUB_SOCKET", "/run/toy-hubs.sock")
+
+# Obergrenze für noch nicht abgeholte Ausgaben je Client. Ein Client, der
+# Notifikationen nicht schnell genug liest, wird getrennt, statt den
+# Speicher des Dienstes zu füllen
+MAX_CLIENT_OUTPUT = 256 * 1024
+
+# Sekunden, die Suche und Verbindungsaufbau eines Controllers höchstens
+# dauern dürfen. Danach bekommen die wartenden Clients "error ...", wie
+# bisher, wenn gatttool den Controller nicht erreicht hat
+CONNECT_TIMEOUT = 20
+
+class HubDevice(gatt.Device):
+    # Controller ohne eigene Logik, alle Charakteristiken stehen den Clients
+    # über ihre UUID zur Verfügung
+    def __init__(self, mac_address, manager):
+        super().__init__(mac_address, manager)
+        self.characteristics = { }
+        self.waiting = [ ]     # (Client, Kommando) bis die Services bekannt sind
+        self.writes = { }      # Charakteristik -> deque (Client, Daten), erstes läuft
+        self.reads = { }       # Charakteristik -> [ Client ]
+        self.listeners = { }   # Charakteristik -> set(Client)
+
+    def connect_failed(self, error):
+        super().connect_failed(error)
+        self.fail_all("Verbindung fehlgeschlagen: %s" % error)
+
+    def disconnect_succeeded(self):
+        super().disconnect_succeeded()
+        print("getrennt", self.mac_address)
+        self.fail_all("Verbindung getrennt")
+
+    def services_resolved(self):
+        super().services_resolved()
+        for service in self.services:
+            for characteristic in service.characteristics:
+                self.characteristics.setdefault(characteristic.uuid, characteristic)
+        print("Verbunden mit", self.mac_address, len(self.characteristics), "Charakteristiken")
+
+        waiting, self.waiting = self.waiting, [ ]
+        for client, command in waiting:
+            self.manager.execute(client, command)
+
+    def ready(self):
+        return bool(self.characteristics)
+
+    def characteristic(self, uuid):
+        return self.characteristics.get(uuid.lower())
+
+    # --- Kommandos der Clients ---------------------------------------------------
+
+    def write(self, client, characteristic, data):
+        # je Charakteristik ist immer nur ein Write Request unterwegs, die
+        # Bestätigung gehört damit eindeutig zum ältesten Eintrag
+        queue = self.writes.setdefault(characteristic, deque())
+        queue.append((client, data))
+        if len(queue) == 1:
+            characteristic.write_value(data)
+
+    def read(self, client, characteristic):
+        readers = self.reads.setdefault(characteristic, [ ])
+        readers.append(client)
+        if len(readers) == 1:
+            characteristic.read_value()
+
+    def listen(self, client, characteristic):
+        listeners = self.listeners.setdefault(characteristic, set())
+        if not listeners:
+            characteristic.enable_notifications()
+        listeners.add(client)
+
+    def client_closed(self, client):
+        for listeners in self.listeners.values():
+            listeners.discard(client)
+        self.waiting = [ entry for entry in self.waiting if entry[0] is not client ]
+
+    def fail_all(self, message):
+        for client, _ in self.waiting:
+            client.reply("error " + message)
+        for queue in self.writes.values():
+            for client, _ in queue:
+                client.reply("error " + message)
+        for readers in self.reads.values():
+            for client in readers:
+                client.reply("error " + message)
+        self.waiting = [ ]
+        self.writes = { }
+        self.reads = { }
+        self.listeners = { }
+        self.characteristics = { }
+
+    # --- Rückrufe von python-gatt --------------------------------------------------
+
+    def written(self, characteristic, result):
+        queue = self.writes.get(characteristic)
+        if not queue:
+            return
+        client, _ = queue.popleft()
+        client.reply(result)
+        if queue:
+            characteristic.write_value(queue[0][1])
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        super().characteristic_write_value_succeeded(characteristic)
+        self.written(characteristic, "ok")
+
+    def characteristic_write_value_failed(self, characteristic, error):
+        super().characteristic_write_value_failed(characteristic, error)
+        self.written(characteristic, "error %s" % error)
+
+    def characteristic_value_updated(self, characteristic, value):
+        # python-gatt meldet Leseergebnisse und Notifikationen gleich. Wartet
+        # ein Client auf einen Lesevorgang, bekommt er den nächsten Wert
+        hex_value = bytes(value).hex()
+        readers = self.reads.pop(characteristic, None)
+        if readers:
+            for client in readers:
+                client.reply("ok " + hex_value)
+        listeners = self.listeners.get(characteristic)
+        if listeners:
+            line = "value %s %s %s" % (self.mac_address, characteristic.uuid, hex_value)
+            for client in list(listeners):
+                client.reply(line)
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        super().characteristic_read_value_failed(characteristic, error)
+        for client in self.reads.pop(characteristic, [ ]):
+            client.reply("error %s" % error)
+
+class Client:
+    def __init__(self, manager, connection):
+        self.manager = manager
+        self.connection = connection
+        self.connection.setblocking(False)
+        self.input = b""
+        self.output = bytearray()
+        self.out_watch = None
+        self.watch = GLib.io_add_watch(connection.fileno(), GLib.PRIORITY_DEFAULT,
+                                       GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.readable)
+
+    def readable(self, fd, condition):
+        try:
+            data = self.connection.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            # die Quelle endet mit return False
+            self.watch = None
+            self.close()
+            return False
+
+        self.input += data
+        while b"\n" in self.input:
+            line, self.input = self.input.split(b"\n", 1)
+            command = line.decode("utf-8", "replace").split()
+            if command:
+                self.manager.execute(self, command)
+        return True
+
+    def reply(self, line):
+        if self.connection is None:
+            return
+        self.output += line.encode("utf-8") + b"\n"
+        if len(self.output) > MAX_CLIENT_OUTPUT:
+            print("Client liest nicht, trenne")
+            self.close()
+            return
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.connection.send(self.output)
+            del self.output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.close()
+            return
+
+        # Rest senden, sobald der Socket wieder aufnahmebereit ist
+        if self.output and self.out_watch is None:
+            self.out_watch = GLib.io_add_watch(self.connection.fileno(), GLib.PRIORITY_DEFAULT,
+                                               GLib.IO_OUT, self.writable)
+
+    def writable(self, fd, condition):
+        # die Quelle endet mit return False, flush() legt bei verbleibendem
+        # Rest eine neue an
+        self.out_watch = None
+        if self.connection is not None:
+            self.flush()
+        return False
+
+    def close(self):
+        if self.connection is None:
+            return
+        for source in (self.watch, self.out_watch):
+            if source is not None:
+                GLib.source_remove(source)
+        self.watch = self.out_watch = None
+        self.connection.close()
+        self.connection = None
+        self.manager.client_closed(self)
+
+class HubDaemon(MultiDeviceManager):
+    def __init__(self, socket_path=SOCKET_PATH, adapter_name='hci0'):
+        super().__init__(lambda device: None, adapter_name=adapter_name)
+        self.socket_path = socket_path
+        self.clients = set()
+        # MAC-Adressen, die BlueZ noch nicht kennt und per Suche gefunden
+        # werden müssen
+        self.searching = set()
+        self.commands = {
+            "connect": self.cmd_connect,
+            "write": self.cmd_write,
+            "write-cmd": self.cmd_write_command,
+            "read": self.cmd_read,
+            "notify": self.cmd_notify,
+            "disconnect": self.cmd_disconnect,
+            "list": self.cmd_list,
+        }
+        # Parameter je Kommando, um die Anzahl vor dem Aufruf zu prüfen
+        self.signatures = { name: inspect.signature(handler) for name, handler in self.commands.items() }
+
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(16)
+        self.server.setblocking(False)
+        GLib.io_add_watch(self.server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.accept)
+        print("Warte auf Kommandos an", self.socket_path)
+
+    def accept(self, fd, condition):
+        try:
+            connection, _ = self.server.accept()
+        except BlockingIOError:
+            return True
+        self.clients.add(Client(self, connection))
+        return True
+
+    def client_closed(self, client):
+        self.clients.discard(client)
+        for hub in self.hubs.values():
+            hub.client_closed(client)
+
+    # --- Verbindungen ----------------------------------------------------------------
+
+    def hub(self, mac_address):
+        # bestehende Verbindung oder neuen Verbindungsaufbau liefern
+        mac_address = mac_address.upper()
+        hub = self.hubs.get(mac_address)
+        if hub is None:
+            known = any(device.mac_address.upper() == mac_address for device in self.devices())
+            hub = self.add(HubDevice, mac_address, connect=known)
+            if known:
+                print("Verbinde", mac_address, "...")
+            else:
+                # BlueZ kennt den Controller noch nicht, erst suchen
+                print("Suche", mac_address, "...")
+                if not self.searching:
+                    discovery.start_discovery(self)
+                self.searching.add(mac_address)
+            GLib.timeout_add_seconds(CONNECT_TIMEOUT, self.connect_timed_out, mac_address, hub)
+        return hub
+
+    def connect_timed_out(self, mac_address, hub):
+        # Controller nicht gefunden oder Verbindung nicht zustande gekommen.
+        # Die Quelle endet mit return False
+        if hub.ready() or self.hubs.get(mac_address) is not hub:
+            return False
+        print("Zeitüberschreitung beim Verbinden", mac_address)
+        del self.hubs[mac_address]
+        if mac_address in self.searching:
+            self.searching.discard(mac_address)
+            if not self.searching:
+                self.stop_discovery()
+        else:
+            # laufenden Verbindungsaufbau abbrechen
+            hub.disconnect()
+        hub.fail_all("Controller %s nach %d s nicht verbunden" % (mac_address, CONNECT_TIMEOUT))
+        return False
+
+    def device_discovered(self, device):
+        mac_address = device.mac_address.upper()
+        if mac_address in self.searching:
+            self.searching.discard(mac_address)
+            if not self.searching:
+                self.stop_discovery()
+            print("Gefunden, verbinde", mac_address, "...")
+            self.hubs[mac_address].connect()
+
+    # --- Kommandos ---------------------------------------------------------------------
+
+    def execute(self, client, command):
+        handler = self.commands.get(command[0])
+        if handler is None:
+            client.reply("error unbekanntes Kommando " + command[0])
+            return
+        try:
+            self.signatures[command[0]].bind(client, *command[1:])
+        except TypeError:
+            client.reply("error falsche Parameter für " + command[0])
+            return
+        try:
+            handler(client, *command[1:])
+        except ValueError as e:
+            # z.B. kein gültiger Hex-String
+            client.reply("error %s" % e)
+        except Exception:
+            # Fehler im Dienst selbst. Nicht verschlucken, aber auch nicht
+            # aus dem GLib-Rückruf werfen, das würde den Client abhängen
+            traceback.print_exc()
+            client.reply("error interner Fehler bei " + command[0])
+
+    def connected_hub(self, client, command, mac_address):
+        # Controller, dessen Services bekannt sind, oder None. Das Kommando
+        # wird dann nach dem Verbindungsaufbau ausgeführt
+        hub = self.hub(mac_address)
+        if hub.ready():
+            return hub
+        hub.waiting.append((client, command))
+        return None
+
+    def characteristic(self, client, hub, uuid):
+        characteristic = hub.characteristic(uuid)
+        if characteristic is None:
+            client.reply("error unbekannte Charakteristik " + uuid)
+        return characteristic
+
+    def cmd_connect(self, client, mac_address):
+        if self.connected_hub(client, [ "connect", mac_address ], mac_address):
+            client.reply("ok")
+
+    def cmd_write(self, client, mac_address, uuid, value):
+        hub = self.connected_hub(client, [ "write", mac_address, uuid, value ], mac_address)
+        characteristic = hub and self.characteristic(client, hub, uuid)
+        if characteristic:
+            hub.write(client, characteristic, bytes.fromhex(value))
+
+    def cmd_write_command(self, client, mac_address, uuid, value):
+        hub = self.connected_hub(client, [ "write-cmd", mac_address, uuid, value ], mac_address)
+        characteristic = hub and self.characteristic(client, hub, uuid)
+        if characteristic:
+            lwp3_transport.write_without_response(characteristic, bytes.fromhex(value),
+                lambda error: print("Schreiben fehlgeschlagen", error))
+            client.reply("ok")
+
+    def cmd_read(self, client, mac_address, uuid):
+        hub = self.connected_hub(client, [ "read", mac_address, uuid ], mac_address)
+        characteristic = hub and self.characteristic(client, hub, uuid)
+        if characteristic:
+            hub.read(client, characteristic)
+
+    def cmd_notify(self, client, mac_address, uuid):
+        hub = self.connected_hub(client, [ "notify", mac_address, uuid ], mac_address)
+        characteristic = hub and self.characteristic(client, hub, uuid)
+        if characteristic:
+            hub.listen(client, characteristic)
+            client.reply("ok")
+
+    def cmd_disconnect(self, client, mac_address):
+        hub = self.hubs.get(mac_address.upper())
+        if hub and hub.is_connected():
+            hub.disconnect()
+        client.reply("ok")
+
+    def cmd_list(self, client):
+        client.reply(" ".join([ "ok" ] + [ mac for mac, hub in self.hubs.items() if hub.ready() ]))
+
+    def quit(self):
+        for client in list(self.clients):
+            client.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        super().quit()
+
+if __name__ == "__main__":
+    daemon = HubDaemon(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
+    daemon.listen()
+    daemon.run()
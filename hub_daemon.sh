@@ -0,0 +1,57 @@
+# Anbindung der Shell-Scripts an hub_daemon.py, wird per "source"
+# eingebunden. Benötigt socat.
+#
+# hubd_open öffnet eine Verbindung zum Dienst, die bis zum Ende des Scripts
+# bestehen bleibt. Danach schickt hubd ein Kommando und gibt die Antwort aus,
+# z.B.
+#
+#   if hubd_open; then
+#       hubd write $MAC 8ae87e32-ad7d-11e6-80f5-76304dec7eb7 01
+#   fi
+
+HUB_SOCKET=${TOY_HUB_SOCKET:-/run/toy-hubs.sock}
+# Sekunden ohne Antwort, nach denen hubd aufgibt. Der Dienst selbst meldet
+# nach 20 Sekunden einen Fehler, wenn der Controller nicht zu erreichen ist
+HUB_TIMEOUT=${TOY_HUB_TIMEOUT:-30}
+
+# liefert 1, wenn der Dienst nicht läuft
+hubd_open() {
+    if [ ! -S "$HUB_SOCKET" ] || ! which socat > /dev/null; then
+	return 1
+    fi
+    coproc HUBD { socat - UNIX-CONNECT:"$HUB_SOCKET" 2> /dev/null; }
+}
+
+# Verbindung schließen und neu öffnen. Nach einer Zeitüberschreitung käme
+# die verspätete Antwort des Dienstes sonst beim nächsten hubd an und alle
+# weiteren Antworten wären um eins verschoben
+hubd_reopen() {
+    if [ -n "$HUBD_PID" ]; then
+	kill $HUBD_PID 2> /dev/null
+	wait $HUBD_PID 2> /dev/null
+    fi
+    hubd_open
+}
+
+# Kommando senden und auf die Antwort warten. Zwischendurch eintreffende
+# Notifikationen ("value ...") werden übergangen. Nicht per $(...) aufrufen,
+# die Verbindung steht in Subshells nicht zur Verfügung
+hubd() {
+    local LINE
+    echo "$*" >&${HUBD[1]}
+    while read -r -t $HUB_TIMEOUT -u ${HUBD[0]} LINE; do
+	case "$LINE" in
+	    ok*)
+		echo "${LINE:3}"
+		return 0
+		;;
+	    error*)
+		echo "${LINE:6}" 1>&2
+		return 1
+		;;
+	esac
+    done
+    echo "Keine Antwort von hub_daemon.py" 1>&2
+    hubd_reopen
+    return 1
+}
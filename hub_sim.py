@@ -0,0 +1,693 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Simulierte Controller für offline_gatt.py.
+#
+# Die Klassen bilden die Geräteseite der GATT-Protokolle nach:
+#
+#   LWP3HubSim       Boost Move Hub, Technic Hub usw. (Lego Wireless Protocol 3):
+#                    Attach-Meldungen (0x04), Hub-Properties, Port- und
+#                    Modus-Informationen, Port-Values (0x45) nach 0x41,
+#                    kombinierte Modi (0x42, 0x46, 0x48) und
+#                    Rückmeldungen (0x82) auf Port-Kommandos inkl. Puffer
+#   WeDoHubSim       WeDo 2.0 Hub: Attach-Meldungen, Sensorwerte nach
+#                    Moduswahl, Ausgabe-Kommandos
+#   FtSmartSim       fischertechnik BT Smart Controller: Eingänge I1 bis
+#                    I4 mit Moduswahl per Lesen und Notifikation, Ausgang M1
+#   FtReceiverSim    fischertechnik BT Control Receiver: Ausgänge M1 und M4
+#
+# Alle Notifikationen und Schreibzugriffe laufen über das Modell der
+# Funkstrecke in offline_gatt.Peripheral (Verbindungsintervall, Pakete je
+# Verbindungsereignis). Sensorwerte werden mit rate Hz erzeugt.
+#
+# Ein Beispielprogramm lässt sich direkt gegen simulierte Controller starten:
+#
+#   python3 hub_sim.py --fleet technic,wedo --rate 50 lego_hub_monitor.py
+#
+# In eigenen Programmen und Benchmarks:
+#
+#   import offline_gatt, hub_sim
+#   offline_gatt.install()
+#   for mac, peripheral in hub_sim.fleet("technic,technic", rate=100):
+#       offline_gatt.add_peripheral(mac, peripheral)
+
+import os, sys, math, time, struct, atexit, runpy, argparse
+
+import offline_gatt
+
+LWP3_SERVICE = "00001623-1212-efde-1623-785feabcd123"
+LWP3_CHARACTERISTIC = "00001624-1212-efde-1623-785feabcd123"
+
+WEDO_SERVICE = "00001523-1212-efde-1523-785feabcd123"
+WEDO_NAME = "00001524-1212-efde-1523-785feabcd123"
+WEDO_BUTTON = "00001526-1212-efde-1523-785feabcd123"
+WEDO_PORT_TYPE = "00001527-1212-efde-1523-785feabcd123"
+WEDO_IO_SERVICE = "00004f0e-1212-efde-1523-785feabcd123"
+WEDO_SENSOR_VALUE = "00001560-1212-efde-1523-785feabcd123"
+WEDO_INPUT_COMMAND = "00001563-1212-efde-1523-785feabcd123"
+WEDO_OUTPUT_COMMAND = "00001565-1212-efde-1523-785feabcd123"
+
+FT_SMART_CHANNEL = ("8ae87702-ad7d-11e6-80f5-76304dec7eb7", "8ae87e32-ad7d-11e6-80f5-76304dec7eb7")
+FT_SMART_I1 = ("8ae8952a-ad7d-11e6-80f5-76304dec7eb7", "8ae89a2a-ad7d-11e6-80f5-76304dec7eb7")
+FT_SMART_INPUTS = { "I1": FT_SMART_I1[1],
+                    "I2": "8ae89bec-ad7d-11e6-80f5-76304dec7eb7",
+                    "I3": "8ae89dc2-ad7d-11e6-80f5-76304dec7eb7",
+                    "I4": "8ae89f66-ad7d-11e6-80f5-76304dec7eb7" }
+FT_SMART_MODES = { "I1": "8ae89084-ad7d-11e6-80f5-76304dec7eb7",
+                   "I2": "8ae89200-ad7d-11e6-80f5-76304dec7eb7",
+                   "I3": "8ae89386-ad7d-11e6-80f5-76304dec7eb7",
+                   "I4": "8ae894fc-ad7d-11e6-80f5-76304dec7eb7" }
+FT_SMART_M1 = ("8ae883b4-ad7d-11e6-80f5-76304dec7eb7", "8ae8860c-ad7d-11e6-80f5-76304dec7eb7")
+
+FT_RECEIVER_CHANNEL = ("2e582b3a-c5c5-11e6-9d9d-cec0c932ce01", "2e582de2-c5c5-11e6-9d9d-cec0c932ce01")
+FT_RECEIVER_M1 = ("2e58327e-c5c5-11e6-9d9d-cec0c932ce01", "2e583378-c5c5-11e6-9d9d-cec0c932ce01")
+FT_RECEIVER_M4 = ("2e58327e-c5c5-11e6-9d9d-cec0c932ce01", "2e5837b0-c5c5-11e6-9d9d-cec0c932ce01")
+
+# Rückmeldungs-Bits (0x82), siehe lwp3_pipeline.py
+IN_PROGRESS = 0x01
+COMPLETED = 0x02
+DISCARDED = 0x04
+IDLE = 0x08
+BUSY = 0x10
+
+# Fehlercodes (0x05)
+BUFFER_OVERFLOW = 0x03
+NOT_RECOGNIZED = 0x05
+INVALID_USE = 0x06
+
+# Datentypen der Modi: 8, 16, 32 Bit, float
+_VALUE_FORMATS = ( 'b', 'h', 'i', 'f' )
+_AMPLITUDE = ( 100, 1000, 100000, 10.0 )
+
+# Eingabemodi je Gerätetyp: (Name, Anzahl Werte, Datentyp)
+_MOTOR_MODES = [ ("POWER", 1, 0), ("SPEED", 1, 0), ("POS", 1, 2), ("APOS", 1, 1) ]
+MODES = {
+    0x14: [ ("VLT L", 1, 1), ("VLT S", 1, 1) ],
+    0x15: [ ("CUR L", 1, 1), ("CUR S", 1, 1) ],
+    0x17: [ ("COL O", 1, 0), ("RGB O", 3, 0) ],
+    0x22: [ ("LPF2-ANGLE", 2, 0), ("LPF2-TILT", 1, 0), ("LPF2-CRASH", 3, 0) ],
+    0x23: [ ("LPF2-DETECT", 1, 0), ("LPF2-COUNT", 1, 2) ],
+    0x25: [ ("COLOR", 1, 0), ("PROX", 1, 0), ("COUNT", 1, 2), ("REFLT", 1, 0),
+            ("AMBI", 1, 0), ("COL O", 1, 0), ("RGB I", 3, 1), ("IR Tx", 1, 1),
+            ("SPEC 1", 4, 0) ],
+    0x26: _MOTOR_MODES, 0x27: _MOTOR_MODES, 0x2e: _MOTOR_MODES, 0x2f: _MOTOR_MODES,
+    0x28: [ ("ANGLE", 2, 0), ("TILT", 1, 0) ],
+    0x36: [ ("IMPCT", 1, 0) ],
+    0x39: [ ("GRV", 3, 1), ("CAL", 1, 0) ],
+    0x3a: [ ("ROT", 3, 1) ],
+    0x3b: [ ("POS", 3, 1), ("IMP", 1, 2), ("CFG", 2, 0) ],
+    0x3c: [ ("TEMP", 1, 1) ],
+    0x42: [ ("TRIGGER", 1, 0) ],
+}
+# kombinierbare Modi je Gerätetyp als Bitmasken (Port-Information 0x02)
+_MOTOR_COMBINATIONS = [ 0x000e ]      # SPEED, POS, APOS
+COMBINATIONS = {
+    0x25: [ 0x004f ],                   # COLOR, PROX, COUNT, REFLT, RGB I
+    0x26: _MOTOR_COMBINATIONS, 0x27: _MOTOR_COMBINATIONS,
+    0x2e: _MOTOR_COMBINATIONS, 0x2f: _MOTOR_COMBINATIONS,
+    0x3b: [ 0x0003 ],                   # POS, IMP
+}
+# Gerätetypen mit Ausgabemodus 0 (Motoren, LEDs)
+OUTPUTS = { 0x01, 0x02, 0x08, 0x17, 0x26, 0x27, 0x2e, 0x2f }
+
+# Drehzahl der simulierten Motoren: Grad je Sekunde und Prozent Leistung
+DEG_PER_SPEED = 10
+
+# Port -> Gerätetyp der vorbelegten Hubs
+BOOST_PORTS = { 0x00: 0x27, 0x01: 0x27, 0x02: 0x25, 0x03: 0x26, 0x32: 0x17,
+                0x3a: 0x28, 0x3b: 0x15, 0x3c: 0x14, 0x46: 0x42 }
+TECHNIC_PORTS = { 0x00: 0x2e, 0x01: 0x2e, 0x02: 0x2f, 0x32: 0x17, 0x3b: 0x15,
+                  0x3c: 0x14, 0x3d: 0x3c, 0x60: 0x3c, 0x61: 0x39, 0x62: 0x3a,
+                  0x63: 0x3b, 0x64: 0x36 }
+WEDO_PORTS = { 1: 0x01, 2: 0x23, 3: 0x15, 4: 0x14, 5: 0x16, 6: 0x17 }
+
+def wave(t, phase=0):
+    # langsam schwankender Messwert zwischen 0 und 1
+    return (1 + math.sin(math.pi * t + phase)) / 2
+
+class SimulatedPeripheral(offline_gatt.Peripheral):
+    # 15 ms Verbindungsintervall wie bei BlueZ üblich
+    connection_interval = 0.015
+
+    def __init__(self, name, services, rate=10):
+        super().__init__(name, services)
+        self.rate = rate
+        self.device = None
+        self.epoch = time.monotonic()
+        self.streams = { }
+        self.counters = { "writes": 0, "commands": 0, "notifications": 0 }
+
+    def connected(self, device):
+        self.device = device
+        self.epoch = time.monotonic()
+
+    def disconnected(self, device):
+        self.device = None
+        self.streams.clear()
+
+    def elapsed(self):
+        return time.monotonic() - self.epoch
+
+    def write(self, device, characteristic, data, response):
+        self.counters["writes" if response else "commands"] += 1
+        self.received(characteristic.uuid, data)
+
+    def received(self, uuid, data):
+        pass
+
+    def send(self, uuid, data):
+        if self.device is None:
+            return
+        characteristic = self.device.characteristic(uuid)
+        if characteristic and characteristic.notifying:
+            self.counters["notifications"] += 1
+            characteristic.notify(data)
+
+    def call_later(self, delay, callback, *args):
+        if self.device is not None:
+            self.device.manager.call_later(delay, callback, *args)
+
+    def stream(self, key, callback):
+        # callback() mit rate Hz aufrufen, bis stop_stream(key) oder
+        # die Verbindung getrennt wird
+        token = object()
+        self.streams[key] = token
+        self.call_later(1 / self.rate, self.tick, key, token, callback)
+
+    def stop_stream(self, key):
+        self.streams.pop(key, None)
+
+    def tick(self, key, token, callback):
+        if self.streams.get(key) is not token:
+            return
+        callback()
+        self.call_later(1 / self.rate, self.tick, key, token, callback)
+
+class _Motor:
+    __slots__ = ( "speed", "position", "since" )
+
+    def __init__(self):
+        self.speed = 0
+        self.position = 0.0
+        self.since = 0.0
+
+    def angle(self, t):
+        return self.position + self.speed * DEG_PER_SPEED * (t - self.since)
+
+    def set_speed(self, t, speed):
+        self.position = self.angle(t)
+        self.since = t
+        self.speed = speed
+
+class _Output:
+    __slots__ = ( "running", "feedback", "buffered" )
+
+    def __init__(self):
+        self.running = None     # Kennung des laufenden Kommandos
+        self.feedback = False
+        self.buffered = None    # (Dauer, Geschwindigkeit, Rückmeldung)
+
+class _InputStream:
+    __slots__ = ( "mode", "delta", "last" )
+
+    def __init__(self, mode, delta):
+        self.mode = mode
+        self.delta = delta
+        self.last = None
+
+class _Combined:
+    # kombinierte Modi eines Ports
+    __slots__ = ( "locked", "deltas", "entries", "last" )
+
+    def __init__(self):
+        self.locked = True
+        self.deltas = { }       # Modus -> Delta aus 0x41
+        self.entries = [ ]      # (Modus, Datensatz) aus 0x42 Unterkommando 0x00
+        self.last = { }         # zuletzt gemeldeter Wert je Eintrag
+
+class LWP3HubSim(SimulatedPeripheral):
+    # ports: Port -> Gerätetyp, virtual: Port -> (Gerätetyp, Port A, Port B)
+    def __init__(self, name="Technic Hub", ports=TECHNIC_PORTS, virtual=None,
+                 rate=10, firmware=0x10000224, battery=80):
+        super().__init__(name, [ (LWP3_SERVICE, [ LWP3_CHARACTERISTIC ]) ], rate)
+        self.ports = dict(ports)
+        self.virtual = dict(virtual or { })
+        self.firmware = firmware
+        self.battery = battery
+        self.motors = { }
+        self.outputs = { }
+        self.inputs = { }
+        self.combined = { }
+        self.commands = {
+            0x01: self.hub_property,
+            0x21: self.port_info,
+            0x22: self.port_mode_info,
+            0x41: self.input_format,
+            0x42: self.input_format_combined,
+            0x81: self.port_output,
+        }
+
+    def connected(self, device):
+        super().connected(device)
+        self.motors = { port: _Motor() for port, dev in self.ports.items()
+                        if MODES.get(dev) is _MOTOR_MODES }
+        self.outputs = { }
+        self.inputs = { }
+        self.combined = { }
+
+    def notifications(self, device, characteristic, enabled):
+        if not enabled:
+            return
+        # der Hub meldet nach dem Einschalten alle angeschlossenen Geräte
+        for port, dev in sorted(self.ports.items()):
+            self.reply(0x04, struct.pack('<BBHII', port, 1, dev, 0x10000000, 0x10000000))
+        for port, (dev, port_a, port_b) in sorted(self.virtual.items()):
+            self.reply(0x04, struct.pack('<BBHBB', port, 2, dev, port_a, port_b))
+
+    def device_type(self, port):
+        if port in self.ports:
+            return self.ports[port]
+        if port in self.virtual:
+            return self.virtual[port][0]
+        return None
+
+    def reply(self, type, payload):
+        self.send(LWP3_CHARACTERISTIC, bytes([ len(payload) + 3, 0, type ]) + payload)
+
+    def error(self, command, code):
+        self.reply(0x05, bytes([ command, code ]))
+
+    def received(self, uuid, data):
+        if len(data) < 3 or data[0] != len(data):
+            return
+        handler = self.commands.get(data[2])
+        if handler is None:
+            self.error(data[2], NOT_RECOGNIZED)
+            return
+        try:
+            handler(data)
+        except (struct.error, IndexError):
+            self.error(data[2], INVALID_USE)
+
+    # --- Hub-Properties ------------------------------------------------------
+
+    def property_value(self, property):
+        if property == 1:
+            return self.name.encode()
+        if property == 2:
+            return b"\0"
+        if property in (3, 4):
+            return struct.pack('<I', self.firmware)
+        if property == 5:
+            return struct.pack('b', -60)
+        if property == 6:
+            return bytes([ self.battery ])
+        return None
+
+    def hub_property(self, data):
+        property, operation = data[3], data[4]
+        if operation in (0x02, 0x05):
+            # Updates einschalten bzw. einmalig anfordern
+            value = self.property_value(property)
+            if value is None:
+                self.error(0x01, INVALID_USE)
+            else:
+                self.reply(0x01, bytes([ property, 0x06 ]) + value)
+
+    # --- Port-Informationen --------------------------------------------------
+
+    def port_info(self, data):
+        port, info = data[3], data[4]
+        dev = self.device_type(port)
+        if dev is None:
+            self.error(0x21, INVALID_USE)
+            return
+        modes = MODES.get(dev, [ ])
+        output = dev in OUTPUTS
+        if info == 0x01:
+            capabilities = (0x02 if modes else 0) | (0x01 if output else 0)
+            self.reply(0x43, struct.pack('<BBBBHH', port, 0x01, capabilities, max(len(modes), 1),
+                                         (1 << len(modes)) - 1, 1 if output else 0))
+        elif info == 0x02:
+            combinations = COMBINATIONS.get(dev, [ ])
+            self.reply(0x43, bytes([ port, info ]) +
+                       struct.pack('<%dH' % len(combinations), *combinations))
+        else:
+            self.error(0x21, INVALID_USE)
+
+    def port_mode_info(self, data):
+        port, mode, info = data[3], data[4], data[5]
+        modes = MODES.get(self.device_type(port), [ ])
+        if mode >= len(modes):
+            self.error(0x22, INVALID_USE)
+            return
+        name, count, datatype = modes[mode]
+        if info == 0x00:
+            value = name.encode()
+        elif info in (0x01, 0x03):
+            value = struct.pack('<ff', 0, _AMPLITUDE[datatype])
+        elif info == 0x02:
+            value = struct.pack('<ff', 0, 100)
+        elif info == 0x04:
+            value = b""
+        elif info == 0x80:
+            value = bytes([ count, datatype, 4, 0 ])
+        else:
+            self.error(0x22, INVALID_USE)
+            return
+        self.reply(0x44, bytes([ port, mode, info ]) + value)
+
+    # --- Port-Values ---------------------------------------------------------
+
+    def input_format(self, data):
+        port, mode, delta, notify = struct.unpack_from('<BBIB', data, 3)
+        if mode >= len(MODES.get(self.device_type(port), [ ])):
+            self.error(0x41, INVALID_USE)
+            return
+        self.reply(0x47, bytes(data[3:10]))
+        combined = self.combined.get(port)
+        if combined is not None and combined.locked:
+            # Modus für die Kombination vormerken
+            combined.deltas[mode] = delta
+            return
+        if notify:
+            self.inputs[port] = _InputStream(mode, delta)
+            self.stream(port, lambda: self.port_value(port))
+        else:
+            self.inputs.pop(port, None)
+            self.stop_stream(port)
+
+    def sample(self, port, dev, mode):
+        t = self.elapsed()
+        name, count, datatype = MODES[dev][mode]
+        motor = self.motors.get(port)
+        if motor is not None and name == "SPEED":
+            return (motor.speed,)
+        if motor is not None and name == "POS":
+            return (int(motor.angle(t)),)
+        if motor is not None and name == "APOS":
+            return ((int(motor.angle(t)) + 180) % 360 - 180,)
+        amplitude = _AMPLITUDE[datatype]
+        return tuple(type(amplitude)(amplitude * wave(t, i)) for i in range(count))
+
+    def port_value(self, port):
+        stream = self.inputs.get(port)
+        dev = self.device_type(port)
+        if stream is None or dev is None:
+            return
+        values = self.sample(port, dev, stream.mode)
+        # nur melden, wenn sich ein Wert um mindestens delta geändert hat
+        if stream.last is not None and all(abs(a - b) < max(stream.delta, 1)
+                                           for a, b in zip(values, stream.last)):
+            return
+        stream.last = values
+        _, count, datatype = MODES[dev][stream.mode]
+        self.reply(0x45, bytes([ port ]) + struct.pack('<%d%s' % (count, _VALUE_FORMATS[datatype]), *values))
+
+    def input_format_combined(self, data):
+        port, subcommand = data[3], data[4]
+        dev = self.device_type(port)
+        if dev is None:
+            self.error(0x42, INVALID_USE)
+            return
+        combined = self.combined.get(port)
+        if subcommand == 0x01:
+            # Port für die Einrichtung sperren, Einzelmodus endet
+            self.combined[port] = _Combined()
+            self.inputs.pop(port, None)
+            self.stop_stream(port)
+        elif subcommand == 0x00 and combined is not None:
+            # data[5] ist der Index der Kombination, danach Modus/Datensatz
+            entries = [ (b >> 4, b & 0x0f) for b in data[6:] ]
+            allowed = COMBINATIONS.get(dev, [ ])
+            mask = 0
+            for mode, dataset in entries:
+                mask |= 1 << mode
+            if not entries or not any(mask & c == mask for c in allowed) or \
+               any(dataset >= MODES[dev][mode][1] for mode, dataset in entries):
+                self.error(0x42, INVALID_USE)
+                return
+            combined.entries = entries
+        elif subcommand in (0x02, 0x03) and combined is not None:
+            combined.locked = False
+            multi_update = subcommand == 0x02
+            self.reply(0x48, struct.pack('<BBH', port, 0x80 if multi_update else 0,
+                                         (1 << len(combined.entries)) - 1))
+            if multi_update and combined.entries:
+                self.stream(port, lambda: self.port_value_combined(port))
+        elif subcommand == 0x05:
+            self.combined.pop(port, None)
+            self.stop_stream(port)
+        else:
+            self.error(0x42, INVALID_USE)
+
+    def port_value_combined(self, port):
+        combined = self.combined.get(port)
+        dev = self.device_type(port)
+        if combined is None or dev is None:
+            return
+        samples = { }
+        pointer = 0
+        values = [ ]
+        formats = "<"
+        for i, (mode, dataset) in enumerate(combined.entries):
+            if mode not in samples:
+                samples[mode] = self.sample(port, dev, mode)
+            value = samples[mode][dataset]
+            # nur geänderte Werte melden
+            last = combined.last.get(i)
+            if last is not None and abs(value - last) < max(combined.deltas.get(mode, 1), 1):
+                continue
+            combined.last[i] = value
+            pointer |= 1 << i
+            values.append(value)
+            formats += _VALUE_FORMATS[MODES[dev][mode][2]]
+        if pointer:
+            self.reply(0x46, struct.pack('<BH', port, pointer) + struct.pack(formats, *values))
+
+    # --- Port-Kommandos ------------------------------------------------------
+
+    def command_effect(self, subcommand, payload):
+        # liefert (Dauer in Sekunden, neue Motorgeschwindigkeit oder None)
+        if subcommand in (0x01, 0x07, 0x08):
+            return 0, struct.unpack_from('b', payload)[0]
+        if subcommand in (0x09, 0x0a):
+            time, speed = struct.unpack_from('<Hb', payload)
+            return time / 1000, speed
+        if subcommand in (0x0b, 0x0c):
+            degrees, speed = struct.unpack_from('<ib', payload)
+            return abs(degrees) / (max(abs(speed), 1) * DEG_PER_SPEED), speed
+        if subcommand in (0x0d, 0x0e):
+            return 0.5, 50
+        return 0, None
+
+    def port_output(self, data):
+        port, flags, subcommand = data[3], data[4], data[5]
+        if self.device_type(port) is None:
+            self.error(0x81, INVALID_USE)
+            return
+        duration, speed = self.command_effect(subcommand, data[6:])
+        feedback = bool(flags & 0x01)
+        output = self.outputs.get(port)
+        if output is None:
+            output = self.outputs[port] = _Output()
+
+        if output.running is not None and not flags & 0x10:
+            # "bei Bedarf puffern": der Hub hält ein weiteres Kommando
+            if output.buffered is not None:
+                self.error(0x81, BUFFER_OVERFLOW)
+                return
+            output.buffered = (duration, speed, feedback)
+            if feedback:
+                self.feedback(port, BUSY)
+            return
+
+        code = DISCARDED if output.running is not None else 0
+        code |= self.start(port, output, duration, speed, feedback)
+        if feedback:
+            self.feedback(port, code)
+
+    def start(self, port, output, duration, speed, feedback):
+        if speed is not None:
+            self.set_speed(port, speed)
+        output.feedback = feedback
+        if duration > 0:
+            output.running = token = object()
+            self.call_later(duration, self.finished, port, token)
+            return IN_PROGRESS
+        output.running = None
+        return COMPLETED | IDLE
+
+    def finished(self, port, token):
+        output = self.outputs.get(port)
+        if output is None or output.running is not token:
+            return
+        output.running = None
+        self.set_speed(port, 0)
+        if output.buffered is not None:
+            duration, speed, feedback = output.buffered
+            output.buffered = None
+            code = self.start(port, output, duration, speed, feedback)
+            if feedback:
+                if code & COMPLETED:
+                    # sofort beendet: erst als gestartet melden
+                    self.feedback(port, IN_PROGRESS)
+                self.feedback(port, code)
+        elif output.feedback:
+            self.feedback(port, COMPLETED | IDLE)
+
+    def set_speed(self, port, speed):
+        t = self.elapsed()
+        ports = self.virtual[port][1:] if port in self.virtual else (port,)
+        for p in ports:
+            if p in self.motors:
+                self.motors[p].set_speed(t, speed)
+
+    def feedback(self, port, code):
+        self.reply(0x82, bytes([ port, code ]))
+
+class WeDoHubSim(SimulatedPeripheral):
+    def __init__(self, name="LPF2 Smart Hub 2 I/O", ports=WEDO_PORTS, rate=10):
+        super().__init__(name, [ (WEDO_SERVICE, [ WEDO_NAME, WEDO_BUTTON, WEDO_PORT_TYPE ]),
+                                 (WEDO_IO_SERVICE, [ WEDO_SENSOR_VALUE, WEDO_INPUT_COMMAND,
+                                                     WEDO_OUTPUT_COMMAND ]) ], rate)
+        self.ports = dict(ports)
+        self.outputs = { }
+
+    def notifications(self, device, characteristic, enabled):
+        if enabled and characteristic.uuid == WEDO_PORT_TYPE:
+            for port, dev in sorted(self.ports.items()):
+                # Port, angeschlossen, Hub-Index (intern 1), Typ, Versionen
+                self.send(WEDO_PORT_TYPE, bytes([ port, 1, 1 if port > 2 else 0, dev ]) + bytes(8))
+
+    def read(self, device, characteristic):
+        if characteristic.uuid == WEDO_NAME:
+            return self.name.encode()
+        return b"\0"
+
+    def received(self, uuid, data):
+        if uuid == WEDO_INPUT_COMMAND and len(data) >= 11 and data[0] == 1 and data[1] == 2:
+            port, dev, mode, delta, unit, notify = struct.unpack_from('<BBBIBB', data, 2)
+            if notify:
+                self.stream(port, lambda: self.sensor_value(port, dev, mode, unit))
+            else:
+                self.stop_stream(port)
+        elif uuid == WEDO_OUTPUT_COMMAND and len(data) >= 2:
+            self.outputs[(data[0], data[1])] = bytes(data[2:])
+
+    def sensor_value(self, port, dev, mode, unit):
+        level = wave(self.elapsed(), port)
+        if unit == 2:
+            # SI-Einheit als float, der Bewegungssensor misst 0 bis 10
+            value = struct.pack('<f', level * (10 if dev == 0x23 else 90))
+        else:
+            value = bytes([ int(level * 100) ])
+        self.send(WEDO_SENSOR_VALUE, bytes([ 1, port ]) + value)
+
+class FtSmartSim(SimulatedPeripheral):
+    # button_period: alle so viele Sekunden wird der Taster an I1 eine
+    # halbe Sekunde lang gedrückt. I2 bis I4 liefern je nach Modus
+    # langsam schwankende Werte
+    def __init__(self, name="BT Smart Controller", rate=10, button_period=10):
+        super().__init__(name, [ (FT_SMART_CHANNEL[0], [ FT_SMART_CHANNEL[1] ]),
+                                 (FT_SMART_I1[0], list(FT_SMART_INPUTS.values()) + list(FT_SMART_MODES.values())),
+                                 (FT_SMART_M1[0], [ FT_SMART_M1[1] ]) ], rate)
+        self.button_period = button_period
+        self.outputs = { }
+        self.names = { uuid: name for name, uuid in FT_SMART_INPUTS.items() }
+        # Modus je Eingang, 0x0b Widerstand, 0x0a Spannung, 0x0c Ultraschall
+        self.modes = { name: 0x0b for name in FT_SMART_INPUTS }
+
+    def resistance(self):
+        # Widerstand an I1 in Ohm: Taster gedrückt < 100
+        pressed = self.button_period and self.elapsed() % self.button_period < 0.5
+        return 50 if pressed else 15000
+
+    def value(self, name):
+        if name == "I1":
+            return self.resistance()
+        level = wave(self.elapsed(), int(name[1]))
+        mode = self.modes[name]
+        if mode == 0x0a:
+            return int(9000 * level)            # mV
+        if mode == 0x0c:
+            return int(3 + 200 * level)         # cm
+        return int(100 + 10000 * level)         # Ohm
+
+    def sample(self, uuid):
+        return struct.pack('<H', self.value(self.names[uuid]))
+
+    def read(self, device, characteristic):
+        return self.sample(characteristic.uuid)
+
+    def notifications(self, device, characteristic, enabled):
+        if enabled:
+            self.stream(characteristic.uuid, lambda: self.send(characteristic.uuid, self.sample(characteristic.uuid)))
+        else:
+            self.stop_stream(characteristic.uuid)
+
+    def received(self, uuid, data):
+        for name, mode in FT_SMART_MODES.items():
+            if uuid == mode:
+                self.modes[name] = data[0]
+                return
+        self.outputs[uuid] = bytes(data)
+
+class FtReceiverSim(SimulatedPeripheral):
+    def __init__(self, name="BT Control Receiver", rate=10):
+        super().__init__(name, [ (FT_RECEIVER_CHANNEL[0], [ FT_RECEIVER_CHANNEL[1] ]),
+                                 (FT_RECEIVER_M1[0], [ FT_RECEIVER_M1[1], FT_RECEIVER_M4[1] ]) ], rate)
+        self.outputs = { }
+
+    def received(self, uuid, data):
+        self.outputs[uuid] = bytes(data)
+
+# Kurzname -> (OID, Klasse, Parameter)
+KINDS = {
+    "boost": ("00:16:53", LWP3HubSim, { "name": "LEGO Move Hub", "ports": BOOST_PORTS,
+                                        "virtual": { 0x10: (0x27, 0x00, 0x01) } }),
+    "technic": ("90:84:2B", LWP3HubSim, { "name": "Technic Hub", "ports": TECHNIC_PORTS }),
+    "wedo": ("A0:E6:F8", WeDoHubSim, { }),
+    "smart": ("10:45:F8", FtSmartSim, { }),
+    "receiver": ("10:45:F8", FtReceiverSim, { }),
+}
+
+def fleet(spec, rate=10, connection_interval=None):
+    # spec z.B. "technic,technic,wedo". Liefert [ (MAC, Peripheral) ]
+    result = [ ]
+    for number, kind in enumerate(spec.split(",")):
+        oid, cls, parameters = KINDS[kind.strip()]
+        peripheral = cls(rate=rate, **parameters)
+        if connection_interval is not None:
+            peripheral.connection_interval = connection_interval
+        result.append(("%s:%02X:00:%02X" % (oid, list(KINDS).index(kind.strip()), number), peripheral))
+    return result
+
+def report(peripherals, file=sys.stderr):
+    for mac, peripheral in peripherals:
+        print("{} {:22s} {}".format(mac, peripheral.name, " ".join(
+            "%s=%d" % item for item in peripheral.counters.items())), file=file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Beispielprogramm gegen simulierte Controller starten")
+    parser.add_argument("--fleet", default="boost,technic,wedo,smart,receiver",
+                        help="Controller, z.B. technic,technic,wedo (%s)" % ", ".join(KINDS))
+    parser.add_argument("--rate", type=float, default=10, help="Sensorwerte je Sekunde und Port")
+    parser.add_argument("--interval", type=float, default=15, help="Verbindungsintervall in ms")
+    parser.add_argument("script", help="Beispielprogramm, z.B. lego_hub_monitor.py")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Parameter des Programms")
+    args = parser.parse_args()
+
+    offline_gatt.install()
+    import gatt_cache
+    # simulierte Controller haben keine Handles
+    gatt_cache.CachedLayout.layout_cache = None
+
+    peripherals = fleet(args.fleet, args.rate, args.interval / 1000)
+    for mac, peripheral in peripherals:
+        offline_gatt.add_peripheral(mac, peripheral)
+    atexit.register(report, peripherals)
+
+    sys.argv = [ args.script ] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name="__main__")
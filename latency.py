@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# Laufzeitmessung der Kommandos an die Lego-Hubs.
+#
+# Für jedes Kommando werden vier Zeitpunkte festgehalten:
+#
+#   Einreihen      BoostDevice.send_cmd bzw. CoalescingQueue.put
+#   Senden         write_value bzw. Write Without Response an BlueZ
+#   Bestätigung    characteristic_write_value_succeeded (nur Write Request)
+#   Rückmeldung    erste 0x82-Meldung des Hubs für den Port
+#
+# Daraus entstehen je Hub und Port Histogramme der Abschnitte
+#
+#   queue      Einreihen -> Senden (Wartezeit in output_queue.py)
+#   ack        Senden -> Bestätigung
+#   feedback   Senden -> Rückmeldung
+#   total      Einreihen -> Rückmeldung
+#
+# Die Histogramme sind logarithmisch-linear aufgebaut wie HdrHistogram: je
+# Zweierpotenz 2**(precision-1) Stufen gleicher Breite. Der relative Fehler
+# ist damit höchstens 2**(1-precision), der Speicherbedarf hängt nur vom
+# Wertebereich ab und das Eintragen kostet eine Handvoll Operationen.
+#
+# registry.install() gibt alle Histogramme bei Programmende und auf SIGUSR1
+# aus:
+#
+#   kill -USR1 <pid>
+
+import sys, json, time, atexit, signal
+from collections import deque
+
+import lwp3
+
+STAGES = ( "queue", "ack", "feedback", "total" )
+
+# Rückmeldungs-Codes, mit denen der Hub ein Kommando angenommen hat
+# (gestartet, sofort beendet oder verworfen), siehe lwp3_pipeline.py
+FEEDBACK_ACCEPTED = 0x01 | 0x02 | 0x04
+
+class Histogram:
+    # Werte sind ganze Zahlen, hier Mikrosekunden
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.sub_count = 1 << precision
+        self.counts = [ ]
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.precision
+        half = self.sub_count >> 1
+        return self.sub_count + (shift - 1) * half + (value >> shift) - half
+
+    def lowest(self, index):
+        # kleinster Wert einer Stufe
+        if index < self.sub_count:
+            return index
+        half = self.sub_count >> 1
+        shift, mantissa = divmod(index - self.sub_count, half)
+        return (mantissa + half) << (shift + 1)
+
+    def record(self, value):
+        value = max(0, int(value))
+        i = self.index(value)
+        counts = self.counts
+        if i >= len(counts):
+            counts.extend([ 0 ] * (i + 1 - len(counts)))
+        counts[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([ 0 ] * (len(other.counts) - len(self.counts)))
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        # Wert, unter dem p Prozent der Einträge liegen (Obergrenze der Stufe)
+        if not self.count:
+            return None
+        wanted = max(1, round(self.count * p / 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= wanted:
+                return min(self.lowest(i + 1) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return { "count": self.count, "min": self.min, "mean": self.mean(),
+                 "p50": self.percentile(50), "p90": self.percentile(90),
+                 "p99": self.percentile(99), "p99.9": self.percentile(99.9),
+                 "max": self.max }
+
+    def buckets(self):
+        # { kleinster Wert der Stufe: Anzahl } der belegten Stufen
+        return { self.lowest(i): n for i, n in enumerate(self.counts) if n }
+
+class HubLatency:
+    # Zeitpunkte eines Hubs, wird von lwp3_transport aufgerufen
+    def __init__(self, name, precision=7):
+        self.name = name
+        self.precision = precision
+        self.histograms = { }
+        self.in_flight = None           # (Port, Einreihen, Senden) des Write Requests
+        self.awaiting = { }             # Port -> deque((Einreihen, Senden))
+
+    def histogram(self, port, stage):
+        histogram = self.histograms.get((port, stage))
+        if histogram is None:
+            histogram = self.histograms[(port, stage)] = Histogram(self.precision)
+        return histogram
+
+    def written(self, data, queued, request):
+        # data ist das gesendete Kommando inkl. Längenfeld, queued der
+        # Zeitpunkt des Einreihens (time.monotonic_ns) oder None
+        now = time.monotonic_ns()
+        if queued is None:
+            queued = now
+        port = data[3] if data[2] in lwp3.PORT_COMMANDS else None
+        self.histogram(port, "queue").record((now - queued) // 1000)
+        if request:
+            self.in_flight = (port, queued, now)
+        # Rückmeldung nur für 0x81 mit gesetztem Bit 0 der Startup-Flags
+        if data[2] == lwp3.PORT_OUTPUT and data[4] & 0x01:
+            waiting = self.awaiting.get(port)
+            if waiting is None:
+                waiting = self.awaiting[port] = deque()
+            waiting.append((queued, now))
+
+    def acknowledged(self):
+        if self.in_flight is not None:
+            port, queued, written = self.in_flight
+            self.in_flight = None
+            self.histogram(port, "ack").record((time.monotonic_ns() - written) // 1000)
+
+    def feedback(self, event):
+        now = time.monotonic_ns()
+        for port, code in event.feedback:
+            waiting = self.awaiting.get(port)
+            if waiting and code & FEEDBACK_ACCEPTED:
+                queued, written = waiting.popleft()
+                self.histogram(port, "feedback").record((now - written) // 1000)
+                self.histogram(port, "total").record((now - queued) // 1000)
+
+    def failed(self):
+        # Write Request fehlgeschlagen, es kommt weder Bestätigung noch
+        # Rückmeldung
+        if self.in_flight is not None:
+            port, queued, written = self.in_flight
+            waiting = self.awaiting.get(port)
+            if waiting and waiting[-1] == (queued, written):
+                waiting.pop()
+        self.in_flight = None
+
+    def reset(self):
+        # der Hub bleibt Antworten schuldig, die Zeitpunkte passen nicht
+        # mehr zu den Kommandos
+        self.in_flight = None
+        self.awaiting.clear()
+
+class LatencyRegistry:
+    def __init__(self):
+        self.hubs = { }
+        self.output = sys.stderr
+        self.format = "text"
+
+    def hub(self, name):
+        hub = self.hubs.get(name)
+        if hub is None:
+            hub = self.hubs[name] = HubLatency(name)
+        return hub
+
+    def report(self):
+        # { Hub: { Port: { Abschnitt: Zusammenfassung } } }, Zeiten in µs
+        result = { }
+        for name, hub in list(self.hubs.items()):
+            ports = result[name] = { }
+            for (port, stage), histogram in sorted(list(hub.histograms.items()),
+                                                   key=lambda item: (item[0][0] is None, item[0][0] or 0,
+                                                                     STAGES.index(item[0][1]))):
+                entry = histogram.summary()
+                entry["buckets"] = histogram.buckets()
+                ports.setdefault("hub" if port is None else "0x%02x" % port, { })[stage] = entry
+        return result
+
+    def dump(self, file=None, format=None):
+        file = file or self.output
+        report = self.report()
+        if (format or self.format) == "json":
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        else:
+            file.write("{:17s} {:5s} {:8s} {:>7s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}\n".format(
+                "Hub", "Port", "Abschnitt", "Anzahl", "p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms"))
+            for name, ports in report.items():
+                for port, stages in ports.items():
+                    for stage, entry in stages.items():
+                        file.write("{:17s} {:5s} {:8s} {:7d} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {:9.1f}\n".format(
+                            name, port, stage, entry["count"],
+                            *(entry[key] / 1000 for key in ("p50", "p90", "p99", "p99.9", "max"))))
+        file.flush()
+
+    def install(self, output=None, format="text", signum=signal.SIGUSR1):
+        # Ausgabe bei Programmende und auf Signal, output ist ein Dateiname
+        # oder None für stderr
+        self.format = format
+        if output:
+            self.output = open(output, "a")
+        atexit.register(self.dump)
+        signal.signal(signum, lambda number, frame: self.dump())
+
+registry = LatencyRegistry()
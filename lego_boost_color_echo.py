@@ -14,24 +14,45 @@ except ModuleNotFoundError as e:
     print("You may install it via 'pip3 install gatt' ...");
     exit(-1);
     
-import sys, struct
+import os, sys, struct
 import threading
 
+import discovery
+import gatt_cache
+import toy_profiles
+import lwp3
+import lwp3_transport
+import toy_timer
+import output_state
+import latency
+
 print("Für dieses Programm muss der Farbsensor am Boost-Controller")
 print("angeschlossen sein. Sobald die Farbe eines Objekts ca. 1cm")
 print("vor dem Sensor erkannt wurde wird diese Farbe auf der LED")
 print("des Controllers angezeigt.\n")
 
+# Anzahl Kommandos, die gleichzeitig zum Hub unterwegs sein dürfen. Bei 0
+# wird jedes Kommando als Write Request gesendet und auf dessen Bestätigung
+# gewartet. Ab 1 wird Write Without Response genutzt und über die
+# Rückmeldungen des Hubs gebremst (erfordert BlueZ 5.50 oder neuer)
+WRITE_WINDOW = 0
+
+# Laufzeiten der Kommandos messen, siehe latency.py. "-" gibt die
+# Histogramme auf stderr aus, sonst wird an die genannte Datei angehängt.
+# Ausgabe bei Programmende und auf SIGUSR1
+LATENCY_STATS = os.environ.get("LWP3_LATENCY")
+
 # GATT Device-Manager, um selektiv nach Lego-Boost-Controllern zu suchen
 class BoostDeviceManager(gatt.DeviceManager):
+    PROFILES = [ toy_profiles.LWP3_HUB ]
+
     def __init__(self, adapter_name='hci0'):
         super().__init__(adapter_name=adapter_name)
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf TI-OID und passenden Gerätenamen
-        if((":".join(device.mac_address.split(':')[0:3]) == "00:16:53") and
-           (device.alias() == "LEGO Move Hub")):
+        # teste auf passende OID und Gerätenamen, siehe toy_profiles.py
+        if toy_profiles.identify(device, self.PROFILES):
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
             if not self.connected_device:
@@ -52,7 +73,17 @@ class BoostDeviceManager(gatt.DeviceManager):
     def quit(self):
         super().stop()
 
-class BoostDevice(gatt.Device):
+# Service und Charakteristik der Hubs
+HUB_CHARACTERISTIC = ("00001623-1212-efde-1623-785feabcd123", "00001624-1212-efde-1623-785feabcd123")
+
+class BoostDevice(gatt_cache.CachedLayout, gatt.Device):
+    # nach dem ersten Verbinden aus dem Cache, siehe gatt_cache.py
+    CHARACTERISTICS = ( HUB_CHARACTERISTIC, )
+    # latency.LatencyRegistry, gemeinsam für alle Hubs des Programms
+    latency = None
+    # toy_timer.Scheduler, überwacht die Antworten des Hubs bei
+    # WRITE_WINDOW > 0, siehe lwp3_transport.py
+    scheduler = None
     
     # Farb-Indizes, wie sie Boost und WeDo 2.0 nutzen
     COLORS = { "schwarz": 0, "rosa": 1, "lila": 2, "blau": 3,
@@ -61,12 +92,14 @@ class BoostDevice(gatt.Device):
                 
     def __init__(self, mac_address, manager):
         super().__init__(mac_address, manager)
-        self.device_on_port = { }
+        self.decoder = lwp3.Decoder()
+        self.device_on_port = self.decoder.device_on_port
         self.ch = None
         self.state = None
-        self.output_in_progress = False
-        self.output_queue = [ ]
-        self.color = None
+        self.transport = None
+        # zuletzt gesendete LED-Farbe, siehe output_state.py. Motoren halten
+        # nach Zeit oder Winkel von selbst an und bleiben deshalb außen vor
+        self.outputs = output_state.OutputShadow()
     
     def connect(self):
         super().connect()
@@ -93,16 +126,16 @@ class BoostDevice(gatt.Device):
     def services_resolved(self):
         super().services_resolved()
 
-        for service in self.services:
-            # Lese alle Charakteristiken aus, die wir benötigen
-            for characteristic in service.characteristics:
-                if (service.uuid == "00001623-1212-efde-1623-785feabcd123" and
-                    characteristic.uuid == "00001624-1212-efde-1623-785feabcd123"):
-                    characteristic.enable_notifications()
-                    self.ch = characteristic
-                    
-                    self.led_set_color("schwarz")    # LED zunächst ausschalten
-                    
+        characteristic = self.layout.get(HUB_CHARACTERISTIC)
+        if characteristic:
+            characteristic.enable_notifications()
+            self.ch = characteristic
+            self.transport = lwp3_transport.make_transport(
+                characteristic, WRITE_WINDOW,
+                self.latency.hub(self.mac_address) if self.latency else None, self.scheduler)
+
+            self.led_set_color("schwarz")    # LED zunächst ausschalten
+
     def characteristic_enable_notification_succeeded(self, characteristic):
         super().characteristic_enable_notification_succeeded(characteristic)
         print("Charakteristik-Notifikation eingeschaltet")
@@ -114,26 +147,20 @@ class BoostDevice(gatt.Device):
     def characteristic_write_value_succeeded(self, characteristic):
         super().characteristic_write_value_succeeded(characteristic)
         # Daten erfolgreich gesendet. Stehen weitere zum Senden an?
-        if len(self.output_queue) == 0:
-            self.output_in_progress = False
-        else:
-            # sende ausstehende Daten
-            data = self.output_queue.pop(0)
-            self.ch.write_value(data)
+        self.transport.write_succeeded()
         
     def characteristic_write_value_failed(self, characteristic, error):
         super().characteristic_write_value_failed(characteristic, error)
         print("Schreiben fehlgeschlagen", error)
+        self.transport.reset()
+        # ob verworfene Kommandos angekommen sind, ist unbekannt
+        self.outputs.invalidate()
 
     def send_cmd(self, cmd, data):
         # sende Kommando + Daten inkl. vorangehendem Längenfeld
         cmd_seq = struct.pack(">bH", len(data)+3, cmd) + data
-        
-        if not self.output_in_progress:
-            self.ch.write_value(cmd_seq)
-            self.output_in_progress = True
-        else:
-            self.output_queue.append(cmd_seq)
+        self.transport.send(cmd_seq, lwp3.coalesce_key(cmd, data),
+                            lwp3.command_port(cmd, data))
         
     def button_set_config(self, code):
         # code 1 und 3 werden von der Tablet-App genutzt, haben aber unbekannte
@@ -141,12 +168,21 @@ class BoostDevice(gatt.Device):
         self.send_cmd(1, bytes( [2, code] ))
 
     def led_set_color(self, color=0):
-        if isinstance(color, int ):
-            self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, color))
-        elif color in self.COLORS:
-            self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, self.COLORS[color]))
-        else:
-            print("Ignoriere unbekannten Farbcode")
+        # liefert False, wenn die LED diese Farbe schon hat
+        if not isinstance(color, int):
+            if color not in self.COLORS:
+                print("Ignoriere unbekannten Farbcode")
+                return False
+            color = self.COLORS[color]
+        if not self.outputs.changes("LED", color):
+            return False
+        self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, color))
+        return True
+
+    def refresh_outputs(self):
+        # zuletzt gewünschte LED-Farbe erneut senden
+        for key, color in self.outputs.refresh():
+            self.led_set_color(color)
 
     def enable_color_reading(self, port):
         self.send_cmd(0x41, struct.pack(">bbbL", port, 8, 1, 1))
@@ -159,53 +195,39 @@ class BoostDevice(gatt.Device):
         return "<unknown>"
     
     def characteristic_value_updated(self, characteristic, value):
-        # teste, ob Längenfeld stimmt, ignoriere die Meldung falls nicht
-        if struct.unpack('b', value[0:1])[0] != len(value):
+        # Meldung dekodieren, ungültige Meldungen werden ignoriert
+        event = self.decoder.decode(value)
+        if event is None:
             return
 
-        # extrahiere den Meldungstyp
-        type = struct.unpack('>H', value[1:3])[0]
-        
-        if type == 4:  # Port-Konfigurations-Ereignis
-            port, event = struct.unpack('bb', value[3:5])
-
-            # Details zum Port-Konfigurations-Ereignis ausgeben
-            if event == 0:
-                # Event 0: Ein Gerät wurde vom Boost getrennt
-                self.device_on_port[port] = None
-            elif event == 1:
-                # Event 1: Ein Gerät wurde vom Boost neu erkannt
-                # Dieser Event wird auch initial für jedes verbundene Gerät
-                # einmal geschickt
-                dev = struct.unpack('b', value[5:6])[0]
-                self.device_on_port[port] = dev
-
-                # wenn ein farbsensor gefunden wurde, dann schalte ihn ein
-                if dev == 0x25:
-                    self.enable_color_reading(port)
-                    
-        elif type == 0x45:
-            port = struct.unpack('b', value[3:4])[0]
-
-            # Bearbeite je nach Sensor, der vorher an diesem Port erkannt wurde
-            if self.device_on_port[port] == 0x25:
-                # mindestens zwei Bytes werden erwartet
-                if len(value[4:]) != 4:
-                    pass
-                else:
-                    color = struct.unpack('BBxx', value[4:])[0]
-
-                    # hat die erkannte Farbe sich geändert?
-                    if color != self.color:
-                        print("Erkannte Farbe:", self.color_name(color, '"'))
-                        self.color = color
-
-                        # 0xff (nichts erkannt) soll die LED ausschalten
-                        if color == 0xff: color = 0
-                        self.led_set_color(color)
+        # Antworten des Hubs geben ggf. Sendeplätze frei
+        self.transport.reply_received(event)
+
+        if isinstance(event, lwp3.AttachedIOEvent):
+            # Event 1: Ein Gerät wurde vom Boost neu erkannt
+            # Dieser Event wird auch initial für jedes verbundene Gerät
+            # einmal geschickt
+            # wenn ein farbsensor gefunden wurde, dann schalte ihn ein
+            if event.event == 1 and event.device == 0x25:
+                self.enable_color_reading(event.port)
+
+        elif isinstance(event, lwp3.PortValueEvent):
+            # Farbsensor im Modus Farb-Index + Distanz
+            if event.kind == "color distance":
+                color = event.values[0]
+
+                # 0xff (nichts erkannt) soll die LED ausschalten. Hat die
+                # LED die Farbe schon, sendet led_set_color() nichts
+                if self.led_set_color(0 if color == 0xff else color):
+                    print("Erkannte Farbe:", self.color_name(color, '"'))
+
+if LATENCY_STATS:
+    latency.registry.install(None if LATENCY_STATS == "-" else LATENCY_STATS)
+    BoostDevice.latency = latency.registry
 
 # Hintergrund-Prozess starten, der den GATT-DBus bedient
 manager = BoostDeviceManager(adapter_name='hci0')
+BoostDevice.scheduler = toy_timer.Scheduler(manager)
 thread = threading.Thread(target = manager.run)
 thread.start()
 
@@ -223,7 +245,8 @@ if len(sys.argv) > 1:
 else:
     print("Suche nach Lego-Boost-Controller ...")
     print("Bitte Taster am Controller drücken.")
-    manager.start_discovery()
+    # nur Controller mit passendem Service melden lassen
+    discovery.start_discovery(manager, toy_profiles.service_uuids(BoostDeviceManager.PROFILES))
 
 print("Beenden mit Ctrl-C")
 
@@ -240,3 +263,4 @@ while True:
 # versuche Geräteverbindung zum Abschluss zu trennen
 if manager.connected_device:
     manager.connected_device.disconnect()
+    print("Ausgaben:", manager.connected_device.outputs.statistics())
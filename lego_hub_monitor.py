@@ -9,9 +9,23 @@
 # die Meldungen aller Sensoren ein und gibt kontinuerlich deren
 # Zustand aus.
 
-import sys, struct
+import os, sys, struct
 import threading
 
+import discovery
+import gatt_cache
+import toy_profiles
+import lwp3
+import lwp3_pipeline
+import lwp3_transport
+import toy_timer
+import output_state
+import port_modes
+import subscriptions
+import latency
+import toy_log
+import sensor_recorder
+
 try:
     import gatt
 except ModuleNotFoundError as e:
@@ -19,23 +33,60 @@ except ModuleNotFoundError as e:
     print("You may install it via 'pip3 install gatt' ...");
     exit(-1);
 
+# Anzahl Kommandos, die gleichzeitig zum Hub unterwegs sein dürfen. Bei 0
+# wird jedes Kommando als Write Request gesendet und auf dessen Bestätigung
+# gewartet. Ab 1 wird Write Without Response genutzt und über die
+# Rückmeldungen des Hubs gebremst (erfordert BlueZ 5.50 oder neuer)
+WRITE_WINDOW = 0
+
+# Verzeichnis, in dem alle Sensorwerte aufgezeichnet werden, siehe
+# sensor_recorder.py. Ohne Angabe wird nichts aufgezeichnet
+RECORD_DIR = os.environ.get("LWP3_RECORD_DIR")
+
+# Laufzeiten der Kommandos messen, siehe latency.py. "-" gibt die
+# Histogramme auf stderr aus, sonst wird an die genannte Datei angehängt.
+# Ausgabe bei Programmende und auf SIGUSR1
+LATENCY_STATS = os.environ.get("LWP3_LATENCY")
+
+# Die Meldungen werden im Hintergrund ausgegeben, siehe toy_log.py. Je
+# Meldungstyp höchstens so viele Zeilen pro Sekunde, z.B. { "port value": 20 }
+LOG_RATE = { }
+# bzw. nur jede n-te Zeile, z.B. { "port value": 10 }
+LOG_SAMPLE = { }
+# Binär in diese Datei statt Text auf stdout, lesbar mit toy_log.py
+LOG_FILE = os.environ.get("LWP3_LOG")
+
+# Meldungen pro Sekunde, die ein Hub an Sensorwerten schicken darf. Darüber
+# werden die Deltas der Sensoren vergröbert, siehe subscriptions.py. Die
+# Funkstrecke schafft bei 15 ms Verbindungsintervall gut 250 Pakete pro
+# Sekunde in beide Richtungen, Kommandos brauchen auch noch Platz.
+# None: Deltas nie anpassen
+NOTIFICATION_BUDGET = 150
+
+# Lage (Modus 0) und Stöße (Modus 1) des Lagesensors im Technic Hub
+# (Gerät 0x3b) in einer kombinierten Meldung (0x46) abonnieren, siehe
+# combined_set_modes(). Unabhängig von den Standard-Operationen unten.
+# Nur auf Wunsch (LWP3_COMBINED_TILT=1): das Dekodieren der kombinierten
+# Meldungen ist langsamer als das der einzelnen, siehe bench_combined.py
+COMBINED_TILT = os.environ.get("LWP3_COMBINED_TILT") == "1"
+
+log = toy_log.log
+
 # GATT Device-Manager, um selektiv nach Lego-Boost-Controllern zu suchen
 class BoostDeviceManager(gatt.DeviceManager):
-    OIDS = [ "00:16:53", "90:84:2b" ] 
-    NAMES = [ "LEGO Move Hub", "HUB NO.4", "Technic Hub", "Smart Hub" ]
+    PROFILES = [ toy_profiles.LWP3_HUB ]
     
     def __init__(self, adapter_name='hci0'):
         super().__init__(adapter_name=adapter_name)
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf TI-OID und passenden Gerätenamen
-        if((":".join(device.mac_address.split(':')[0:3]).lower() in self.OIDS) and
-           (device.alias() in self.NAMES )):
+        # teste auf passende OID und Gerätenamen, siehe toy_profiles.py
+        if toy_profiles.identify(device, self.PROFILES):
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
             if not self.connected_device:
-                print("Controller gefunden, verbinde ...")
+                log.print("connection", "Controller gefunden, verbinde ...")
                 self.connected_device = device
                 self.connected_device.connect()
 
@@ -52,7 +103,19 @@ class BoostDeviceManager(gatt.DeviceManager):
     def quit(self):
         super().stop()
 
-class BoostDevice(gatt.Device):
+# Service und Charakteristik der Hubs
+HUB_CHARACTERISTIC = ("00001623-1212-efde-1623-785feabcd123", "00001624-1212-efde-1623-785feabcd123")
+
+class BoostDevice(gatt_cache.CachedLayout, gatt.Device):
+    # nach dem ersten Verbinden aus dem Cache, siehe gatt_cache.py
+    CHARACTERISTICS = ( HUB_CHARACTERISTIC, )
+    # sensor_recorder.Recorder, gemeinsam für alle Hubs des Programms
+    recorder = None
+    # latency.LatencyRegistry, gemeinsam für alle Hubs des Programms
+    latency = None
+    # toy_timer.Scheduler, überwacht die Antworten des Hubs bei
+    # WRITE_WINDOW > 0, siehe lwp3_transport.py
+    scheduler = None
     
     # Farb-Indizes, wie sie Boost und WeDo 2.0 nutzen
     COLORS = { "black": 0, "off": 0, "pink": 1, "purple": 2, "blue": 3,
@@ -100,22 +163,45 @@ class BoostDevice(gatt.Device):
                 
     def __init__(self, mac_address, manager):
         super().__init__(mac_address, manager)
-        self.device_on_port = { }
+        self.decoder = lwp3.Decoder()
+        self.device_on_port = self.decoder.device_on_port
+        self.event_handlers = {
+            lwp3.HubPropertyEvent: self.on_hub_property,
+            lwp3.AttachedIOEvent: self.on_attached_io,
+            lwp3.ErrorEvent: self.on_error,
+            lwp3.PortInfoEvent: self.on_port_info,
+            lwp3.PortModeInfoEvent: self.on_port_mode_info,
+            lwp3.PortValueEvent: self.on_port_value,
+            lwp3.PortCombinedValueEvent: self.on_port_combined_value,
+            lwp3.PortInputFormatEvent: self.on_port_input_format,
+            lwp3.PortCombinedFormatEvent: self.on_port_combined_format,
+            lwp3.PortFeedbackEvent: self.on_port_feedback,
+            lwp3.UnknownEvent: self.on_unknown,
+        }
         self.ch = None
         self.state = None
-        self.output_in_progress = False
-        self.output_queue = [ ]
+        self.transport = None
+        # zuletzt gesendete LED-Farbe, siehe output_state.py. Motoren halten
+        # nach Zeit oder Winkel von selbst an und bleiben deshalb außen vor
+        self.outputs = output_state.OutputShadow()
+        self.pipeline = lwp3_pipeline.PortPipeline(self.send_cmd)
+        # auf Wertformate wartende combined_set_modes()-Aufrufe
+        self.pending_combinations = { }
+        # Port- und Modus-Informationen möglichst aus dem Zwischenspeicher
+        self.port_modes = port_modes.PortModeQueries(self.send_cmd, self.deliver, port_modes.cache)
+        # Sensor-Abonnements mit Deltas nach Bedarf und Bandbreite
+        self.subscriptions = subscriptions.SubscriptionPolicy(self.input_set_mode, NOTIFICATION_BUDGET)
     
     def connect(self):
         super().connect()
         
     def connect_succeeded(self):
         super().connect_succeeded()
-        print("Verbunden mit", self.mac_address)
+        log.print("connection", "Verbunden mit", self.mac_address)
 
     def connect_failed(self, error):
         super().connect_failed(error)
-        print("Verbindung fehlgeschlagen:", str(error))
+        log.print("connection", "Verbindung fehlgeschlagen:", str(error))
         self.manager.stop()
 
     def disconnect(self):
@@ -125,65 +211,100 @@ class BoostDevice(gatt.Device):
 
     def disconnect_succeeded(self):
         super().disconnect_succeeded()
-        print("getrennt")
+        log.print("connection", "getrennt")
         self.manager.stop()
         
     def services_resolved(self):
         super().services_resolved()
 
-        for service in self.services:
-            # Lese alle Charakteristiken aus, die wir benötigen
-            for characteristic in service.characteristics:
-                if (service.uuid == "00001623-1212-efde-1623-785feabcd123" and
-                    characteristic.uuid == "00001624-1212-efde-1623-785feabcd123"):
-                    characteristic.enable_notifications()
-                    self.ch = characteristic
-                    
-                    self.set_hub_property(2,2)    # button reports
-                    self.led_set_color("orange") # LED auf orange schalten
-                    self.set_hub_property(1,2)    # request name
-                    
+        characteristic = self.layout.get(HUB_CHARACTERISTIC)
+        if characteristic:
+            characteristic.enable_notifications()
+            self.ch = characteristic
+            self.transport = lwp3_transport.make_transport(
+                characteristic, WRITE_WINDOW,
+                self.latency.hub(self.mac_address) if self.latency else None, self.scheduler)
+
+            self.set_hub_property(2,2)    # button reports
+            self.led_set_color("orange") # LED auf orange schalten
+            self.set_hub_property(1,2)    # request name
+            self.set_hub_property(3,5)    # request firmware version
+
     def characteristic_enable_notification_succeeded(self, characteristic):
         super().characteristic_enable_notification_succeeded(characteristic)
-        print("Charakteristik-Notifikation eingeschaltet")
+        log.print("notification", "Charakteristik-Notifikation eingeschaltet")
         
     def characteristic_enable_notification_failed(self, characteristic):
         super().characteristic_enable_notification_failed(characteristic)
-        print("Einschalten Charakteristik-Notifikation fehlgeschlagen")
+        log.print("notification", "Einschalten Charakteristik-Notifikation fehlgeschlagen")
 
     def characteristic_write_value_succeeded(self, characteristic):
         super().characteristic_write_value_succeeded(characteristic)
         # Daten erfolgreich gesendet. Stehen weitere zum Senden an?
-        if len(self.output_queue) == 0:
-            self.output_in_progress = False
-        else:
-            # sende ausstehende Daten
-            data = self.output_queue.pop(0)
-            self.ch.write_value(data)
+        self.transport.write_succeeded()
         
     def characteristic_write_value_failed(self, characteristic, error):
         super().characteristic_write_value_failed(characteristic, error)
-        print("Schreiben fehlgeschlagen", error)
-
-    def send_cmd(self, cmd, data):
-        # sende Kommando + Daten inkl. vorangehendem Längenfeld
+        log.print("write", "Schreiben fehlgeschlagen", error)
+        self.transport.reset()
+        # ob verworfene Kommandos angekommen sind, ist unbekannt
+        self.outputs.invalidate()
+
+    def send_cmd(self, cmd, data, coalesce=True):
+        # sende Kommando + Daten inkl. vorangehendem Längenfeld. Mit
+        # coalesce=False ersetzt es kein wartendes Kommando
         cmd_seq = struct.pack(">bH", len(data)+3, cmd) + data
-        
-        if not self.output_in_progress:
-            self.ch.write_value(cmd_seq)
-            self.output_in_progress = True
-        else:
-            self.output_queue.append(cmd_seq)
+        self.transport.send(cmd_seq, lwp3.coalesce_key(cmd, data) if coalesce else None,
+                            lwp3.command_port(cmd, data))
         
     def set_hub_property(self, property, operation):
         # properties  1=name, 2=button, ....
         # operations 2=enable updates
         self.send_cmd(0x01, bytes( [property, operation] ))
 
-    def generic_set_mode(self, port, mode):
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
-
-    def color_dist_sensor_set_mode(self, port, mode):
+    def input_set_mode(self, port, mode, delta, notify=True):
+        self.send_cmd(0x41, struct.pack("<BBLB", port, mode, delta, 1 if notify else 0))
+
+    # Die *_set_mode()-Funktionen abonnieren die Werte eines Ports. resolution
+    # ist die kleinste Änderung, die gemeldet werden soll, latency die
+    # Zeit in Sekunden, die eine Änderung höchstens unterwegs sein soll.
+    # Das Delta legt subscriptions.py daraus und aus dem Budget fest
+    def generic_set_mode(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
+        self.subscriptions.subscribe(port, mode, resolution, latency)
+
+    def combined_set_modes(self, port, modes, resolution=1, latency=subscriptions.LATENCY):
+        # mehrere Modi eines Ports in einer Notifikation (0x46) melden lassen,
+        # z.B. SPEED, POS und APOS eines Motors oder Lage und Stöße beim
+        # Technic Hub. Fehlende Wertformate werden vorher beim Hub erfragt.
+        # Das gemeinsame Delta der Modi legt subscriptions.py fest
+        modes = tuple(modes)
+        if lwp3.combination_entries(self.decoder.value_formats,
+                                    self.device_on_port.get(port), modes) is None:
+            self.pending_combinations[port] = (modes, resolution, latency)
+            for mode in modes:
+                if (self.device_on_port.get(port), mode) not in self.decoder.value_formats:
+                    self.request_port_mode_information(port, mode, 0x80)
+            return
+        self.pending_combinations.pop(port, None)
+        self.subscriptions.subscribe(port, modes, resolution, latency,
+                                     set_mode=self.combined_input_set_mode)
+
+    def combined_input_set_mode(self, port, modes, delta, notify=True):
+        # set_mode der SubscriptionPolicy für kombinierte Modi. Ein einzelnes
+        # 0x41 würde die Kombination aufheben, daher bei jedem neuen Delta:
+        # Port sperren, Modi einzeln einrichten, Kombination setzen, entsperren
+        entries = lwp3.combination_entries(self.decoder.value_formats,
+                                           self.device_on_port.get(port), modes)
+        self.send_cmd(0x42, bytes([ port, lwp3.COMBINED_LOCK ]))
+        for mode in modes:
+            self.send_cmd(0x41, struct.pack("<BBLB", port, mode, delta, 1 if notify else 0),
+                          coalesce=False)
+        self.send_cmd(0x42, bytes([ port, lwp3.COMBINED_SET_MODES, 0 ]) +
+                      bytes(mode << 4 | dataset for mode, dataset in entries))
+        self.send_cmd(0x42, bytes([ port, lwp3.COMBINED_UNLOCK_MULTI_UPDATE ]))
+        self.decoder.set_combination(port, entries)
+
+    def color_dist_sensor_set_mode(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
         # mode = 0: Vier Bytes-Ergebnis, letztes Byte scheint Hindernis anzuzeigen
         # mode = 1/2: Sensor leuchtet grün
         # mode = 3: Sensor leuchtet rot
@@ -192,63 +313,82 @@ class BoostDevice(gatt.Device):
         # mode = 6: Sensor liefert 3*2 Byte RGB-Werte
         # mode = 7: Sensor leuchtet nicht
         # mode = 8: Sensor liefert Distanz und Farb-Index
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
+        self.subscriptions.subscribe(port, mode, resolution, latency)
 
-    def tilt_sensor_set_mode(self, port, mode):
+    def tilt_sensor_set_mode(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
         # mode = 0: Neigung in zwei Winkeln
         # mode = 1: Unbekanntes 1-Byte-Format
         # mode = 2: grobe Neigung (links, rechts, vorwärts, ...)         
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
+        self.subscriptions.subscribe(port, mode, resolution, latency)
 
-    def wedo_tilt_sensor_set_mode(self, port, mode):
+    def wedo_tilt_sensor_set_mode(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
         # mode = 0: Neigung in zwei Winkeln
         # mode = 1: grobe Neigung (links, rechts, vorwärts, ...)         
         # mode = 2: Ereignis-Zähler
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
+        self.subscriptions.subscribe(port, mode, resolution, latency)
 
-    def wedo_motion_sensor_set_mode(self, port, mode):
+    def wedo_motion_sensor_set_mode(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
         # mode 0: Distanz ungefähr in cm von 0 bis 10
         # mode 1: Ereigniszähler
         # mode 2: Unbekanntes 6-Byte-Resultat
         # >2: nicht erlaubt (Fehlercode 5)
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
+        self.subscriptions.subscribe(port, mode, resolution, latency)
 
-    def current_sensor_set_mode(self, port, mode):
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1000, 1))
+    def current_sensor_set_mode(self, port, mode, resolution=1000, latency=1.0):
+        self.subscriptions.subscribe(port, mode, resolution, latency)
         
-    def voltage_sensor_set_mode(self, port, mode):
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1000, 1))
+    def voltage_sensor_set_mode(self, port, mode, resolution=1000, latency=1.0):
+        self.subscriptions.subscribe(port, mode, resolution, latency)
 
-    def motor_report_rotation(self, port, mode):
+    def motor_report_rotation(self, port, mode, resolution=1, latency=subscriptions.LATENCY):
         # mode = 0: Unbekannte Eregnisse für beide Motoren A+B
         # mode = 1: Winkel seit letztem Report melden
         # mode = 2: aufsummierten Winkel melden
-        self.send_cmd(0x41, struct.pack("<bbLb", port, mode, 1, 1))
+        self.subscriptions.subscribe(port, mode, resolution, latency)
         
     def led_set_color(self, color=0):
-        if isinstance(color, int ):
-            self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, color))
-        elif color in self.COLORS:
-            self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, self.COLORS[color]))
-        else:
-            print("Ignoriere unbekannten Farbcode")
+        # liefert False, wenn die LED diese Farbe schon hat
+        if not isinstance(color, int):
+            if color not in self.COLORS:
+                log.print("command", "Ignoriere unbekannten Farbcode")
+                return False
+            color = self.COLORS[color]
+        if not self.outputs.changes("LED", color):
+            return False
+        self.send_cmd(0x81, struct.pack(">bbbH", 0x32, 0x11, 0x51, color))
+        return True
+
+    def refresh_outputs(self):
+        # zuletzt gewünschte LED-Farbe erneut senden
+        for key, color in self.outputs.refresh():
+            self.led_set_color(color)
 
     def motor_run(self, port, speed):
         self.send_cmd(0x81, struct.pack("<BBBb", port, 0x11, 1, speed))
 
-    def motor_run_time(self, port, speed, time):
-        self.send_cmd(0x81, struct.pack("<BbbHbBBB", port, 0x11, 9, int(time*1000), speed, 100, 0x7f, 0x03))
+    def motor_run_time(self, port, speed, time, queued=False, done=None):
+        self.port_output(struct.pack("<BbbHbBBB", port, 0x11, 9, int(time*1000), speed, 100, 0x7f, 0x03), queued, done)
 
-    def motors_run_time(self, speedA, speedB, time):
+    def motors_run_time(self, speedA, speedB, time, queued=False, done=None):
         # zwei Motoren synchron laufen lassen. Das geht nur für Port 0x39 (den Gruppenport der
         # Motoren A+B).
-        self.send_cmd(0x81, struct.pack("<BbbHbBBBB", 0x39, 0x11, 10, int(time*1000), speedA, speedB, 100, 0x7f, 0x03))
+        self.port_output(struct.pack("<BbbHbBBBB", 0x39, 0x11, 10, int(time*1000), speedA, speedB, 100, 0x7f, 0x03), queued, done)
 
-    def motor_run_angle(self, port, speed, angle):
-        self.send_cmd(0x81, struct.pack("<BbblbBBB", port, 0x11, 11, angle, speed, 100, 0x7f, 0x03))
+    def motor_run_angle(self, port, speed, angle, queued=False, done=None):
+        self.port_output(struct.pack("<BbblbBBB", port, 0x11, 11, angle, speed, 100, 0x7f, 0x03), queued, done)
         
-    def motors_run_angle(self, speedA, speedB, angle):
-        self.send_cmd(0x81, struct.pack("<BbblbBBBB", 0x39, 0x11, 12, angle, speedA, speedB, 100, 0x7f, 0x03))
+    def motors_run_angle(self, speedA, speedB, angle, queued=False, done=None):
+        self.port_output(struct.pack("<BbblbBBBB", 0x39, 0x11, 12, angle, speedA, speedB, 100, 0x7f, 0x03), queued, done)
+
+    def port_output(self, data, queued=False, done=None):
+        # queued=False: das Kommando unterbricht ein laufendes Kommando des Ports
+        # queued=True: das Kommando wird über die Pipeline des Ports direkt im
+        # Anschluss an die vorherigen ausgeführt. done(code) wird aufgerufen,
+        # sobald der Hub es als beendet (0x02) oder verworfen (0x04) meldet
+        if queued:
+            self.pipeline.submit(data, done)
+        else:
+            self.send_cmd(0x81, data)
 
     # -----------------------------------------------------------------------------
     # Routinen, um die diversen Port-/Farb-,...Konstanten im Klartext zu wandeln
@@ -296,350 +436,351 @@ class BoostDevice(gatt.Device):
         return "<unknown device id: "+str(id)+">"
 
     def request_port_information(self,port):
-        self.send_cmd(0x21, struct.pack("<BB", port, 0x01))    # request port mode information
+        self.port_modes.request(0x21, struct.pack("<BB", port, 0x01))    # request port mode information
 
     def request_port_mode_information(self,port,mode,type):
-        self.send_cmd(0x22, struct.pack("<BBB", port, mode,type))
+        self.port_modes.request(0x22, struct.pack("<BBB", port, mode,type))
     
     def characteristic_value_updated(self, characteristic, value):
-        # teste, ob Längenfeld stimmt, ignoriere die Meldung falls nicht
-        if struct.unpack('b', value[0:1])[0] != len(value):
-            return
-
-        # extrahiere den Meldungstyp
-        type = struct.unpack('>H', value[1:3])[0]
-
-        if type == 0x01:  # Hub property event
-            subtype = struct.unpack('b', value[3:4])[0]
-            if subtype == 1:
-                print("Hub property device name:", value[5:].decode("utf-8") )
-            elif subtype == 2:
-                status = struct.unpack('x?', value[4:6])[0]
-                print("Hub property button status:", status)
-            else:
-                print("Hub property unknown:", hex(subtype))
-            
-        elif type == 0x04:  # Hub Attached I/O
-            port, event = struct.unpack('bb', value[3:5])
-
-            # Details zum Port-Konfigurations-Ereignis ausgeben
-            print("Event: Port configuration, port name:", self.port_name(port, '"') + ", ", end="")
-            if event == 0:
-                # Event 0: Ein Gerät wurde vom Boost getrennt
-                print("Device on port", hex(port), "disconnected")
-                self.device_on_port[port] = None
-            elif event == 1:
-                # hub attach event
-                dev = struct.unpack('b', value[5:6])[0]
-                self.device_on_port[port] = dev
-                print("Device connected:", self.device_name(dev, '"'))
-
-                # request port information
-                self.request_port_information(port)
-                
-                # set to true to trigger some default operation for many devices
-                if dev == 0x05: # False: # True: # False:
-                    if dev == 0x01:
-                        self.motor_run(port, 25)
-                      
-                    if dev == 0x08:
-                        self.motor_run(port, 100)   # the LED pair uses the same command as the simple motor
-                    
-                    if dev == 0x14:
-                        self.voltage_sensor_set_mode(port, 0)
-
-                    if dev == 0x15:
-                        self.current_sensor_set_mode(port, 0)
-
-                    if dev == 0x22:
-                        self.wedo_tilt_sensor_set_mode(port, 0)
-                    
-                    if dev == 0x23:
-                        self.wedo_motion_sensor_set_mode(port, 1)  # test in count mode
-                
-                    # wenn ein Farbsensor gefunden wurde, dann schalte ihn ein
-                    if dev == 0x25:
-                        self.color_dist_sensor_set_mode(port, 8)  # z.B. 6 ist RGB, 8 ist Farb-Index+Distanz
-                    
-                    # Wenn ein interaktiver Motor gefunden wurde: Drehe ihn einmal
-                    # langsam 360°
-                    if dev == 0x26 or dev == 0x2e or dev == 0x2f:
-                        self.motor_report_rotation(port, 2)
-                        self.motor_run_angle(port, 25, 360)  
-
-                    if dev == 0x27:
-                        self.motor_report_rotation(port, 1)
-                    
-                    # wenn ein Tiltsensor gefunden wurde, dann schalte ihn ein
-                    if dev == 0x28:
-                        self.tilt_sensor_set_mode(port, 0)
-                    
-                    # technic hub sensor "impact" sensor
-                    if dev == 0x36:
-                        self.generic_set_mode(port, 0)
-
-                    # technic hub 3 axis accelerometer
-                    if dev == 0x39:
-                        self.generic_set_mode(port, 0)
-
-                    # technic hub 3 axis gyroscope
-                    if dev == 0x3a:
-                        self.generic_set_mode(port, 0)
-
-                    # technic hub 3 axis angle
-                    if dev == 0x3b:
-                        self.generic_set_mode(port, 0)
-                
-                    # temperature
-                    if dev == 0x3c:
-                        self.generic_set_mode(port, 0)
-                
-                    # unknown boost sensor
-                    if dev == 0x42:
-                        self.generic_set_mode(port, 0)
-              
-            elif event == 2:
-                # setup of a virtual device complete
-                dev, port1, port2 = struct.unpack('bxbb', value[5:9])
-                print("Devices coupled:",  self.device_name(dev, '"'), "on ports",
-                      self.port_name(port1, '"'), "and", self.port_name(port2, '"'))
-            else:
-                print("Unknown port event", event)
-
-        elif type == 0x05:
-            print("Error event", value[3:])
-            
-        elif type == 0x43:
-            port,itype = struct.unpack('BB', value[3:5])
-            print("Event: Port information: Port name:",  self.port_name(port,'"') + ", ", end="");
-            if itype == 0x01:
-                cap,count,imodes,omodes=struct.unpack('<BBHH', value[5:11])
-                caps = ""
-                if cap&1: caps += "Output,"
-                if cap&2: caps += "Input,"
-                if cap&4: caps += "Logical Combinable,"
-                if cap&8: caps += "Logical Synchronizable,"
-                print("mode info", caps, "#modes:", count, "input:", imodes, "output", omodes)
-
-                # request info for all modes
-                for i in range(count):
-                    self.request_port_mode_information(port,i,0x00)   # 0x00 = name
-                    self.request_port_mode_information(port,i,0x01)   # 0x01 = raw range
-                    self.request_port_mode_information(port,i,0x02)   # 0x02 = pct range
-                    self.request_port_mode_information(port,i,0x03)   # 0x03 = si range
-                    self.request_port_mode_information(port,i,0x04)   # 0x04 = symbol
-            else:
-                print("unsupported info type", hex(itype));
-            
-        elif type == 0x44:
-            port,mode,itype = struct.unpack('BBB', value[3:6])
-            print("Event: Port mode information: Port name:",  self.port_name(port,'"') + ", ", end="");
-            print("mode:", mode, ", ", end="");
-            if itype == 0x00:
-                print("name:", value[6:].decode('ascii'))
-            elif itype == 0x01:
-                min,max = struct.unpack('<ff', value[6:])
-                print("raw min:", min, "max:", max);
-            elif itype == 0x02:
-                min,max = struct.unpack('<ff', value[6:])
-                print("pct min:", min, "max:", max);
-            elif itype == 0x03:
-                min,max = struct.unpack('<ff', value[6:])
-                print("si min:", min, "max:", max);
-            elif itype == 0x04:
-                print("symbol:", value[6:].decode('ascii'))
-            else:
-                print("unknown information type", hex(itype))
-            
-        elif type == 0x45:
-            port = struct.unpack('B', value[3:4])[0]
-            print("Port event: Port:", self.port_name(port,'"') + ", ", end="")
-
-            # Bearbeite je nach Sensor, der vorher an diesem Port erkannt wurde
-
-            if self.device_on_port[port] == 0x14:
-                voltage = struct.unpack('<H', value[4:])[0]
-                print("Spannung:", voltage)
-                
-            elif self.device_on_port[port] == 0x15:
-                current = struct.unpack('<H', value[4:])[0]
-                print("Strom:", current)
-
-                # WeDo-Neigungssensor
-            elif self.device_on_port[port] == 0x22:
-                if len(value[4:]) == 1:
-                    tilt = struct.unpack('B', value[4:])[0]
-                    print("Neigung:",  self.wedo_tilt_name(tilt))
-                elif len(value[4:]) == 2:
-                    # WeDo-Winkel sind in 2°-Schritten
-                    x, y = struct.unpack('bb', value[4:6])
-                    print("WeDo-Neigung X°/Y°:",  2*x, 2*y)
-                elif len(value[4:]) == 3:
-                    c = struct.unpack('bbb', value[4:])
-                    print("Zähler x/y/z:",  c[0], c[1], c[2])
-                else:
-                    print("WeDo-Neigung: unbekanntes Format:", value[4:])
-
-            elif self.device_on_port[port] == 0x23:
-                if len(value[4:]) == 1:
-                    dist = struct.unpack('B', value[4:])[0]
-                    print("WeDo-Distanz:",  dist)
-                elif len(value[4:]) == 4:
-                    events = struct.unpack('<L', value[4:])[0]
-                    print("WeDo-Bewegungsereignisse:",  events)
-                else:
-                    print("WeDo-Distanz: unbekanntes Format:", value[4:])
-                
-                # Farbsensor
-            elif self.device_on_port[port] == 0x25:
-                # vier Bytes werden erwartet
-                if len(value[4:]) == 4:
-                    color, dist = struct.unpack('BBxx', value[4:])
-                    print("Farbe:", self.color_name(color, '"') + ",", "Distanz:", dist)
-                elif len(value[4:]) == 6:
-                    r, g, b = struct.unpack('<HHH', value[4:])
-                    print("Farbe RGB:", r, g, b)
-                else:
-                    print("unerwartete Farbsensorantwort:", value[4:])
-
-            # Motor als Winkelsensor
-            elif (self.device_on_port[port] == 0x26 or self.device_on_port[port] == 0x27 or
-                  self.device_on_port[port] == 0x2e or self.device_on_port[port] == 0x2f):
-                if len(value[4:]) == 1:
-                    angle = struct.unpack('<b', value[4:])[0]
-                    print("Motorwinkel seit letztem Report:", angle)                    
-                elif len(value[4:]) == 4:
-                    angle = struct.unpack('<l', value[4:])[0]
-                    print("Summierter Motorwinkel:", angle)
-                else:
-                    print("Motordrehung: unbekanntes Format:", value[4:])
-                
-            # Neigungssensor
-            elif self.device_on_port[port] == 0x28:
-                if len(value[4:]) == 1:
-                    tilt = struct.unpack('B', value[4:])[0]
-                    print("Neigung:",  self.tilt_name(tilt))
-                elif len(value[4:]) == 2:
-                    x, y = struct.unpack('bb', value[4:6])
-                    print("Neigung X°/Y°:",  x, y)
-                else:
-                    print("Neigung: unbekanntes Format:", value[4:])
-
-            # technic hub "impact" sensor
-            elif self.device_on_port[port] == 0x36:
-                if len(value[4:]) == 1:
-                    i = struct.unpack('<B', value[4:])[0]
-                    print("Impact:", self.impact_name(i))
-                else:
-                    print("Impact: unknown format", value[4:])
-                    
-            # technic hub accelerometer
-            elif self.device_on_port[port] == 0x39:
-                if len(value[4:]) == 6:
-                    x, y, z = struct.unpack('<hhh', value[4:])
-                    print("Acceleration X/Y/Z:",  x, y, z)
-                else:
-                    print("Acceleration: unknown format", value[4:])
-                
-            # technic hub gyroscope
-            elif self.device_on_port[port] == 0x3a:
-                if len(value[4:]) == 6:
-                    x, y, z = struct.unpack('<hhh', value[4:])
-                    print("Gyroscope X/Y/Z:",  x, y, z)
-                else:
-                    print("Gyroscope: unknown format", value[4:])
-                    
-            # technic hub tilt
-            elif self.device_on_port[port] == 0x3b:
-                if len(value[4:]) == 6:
-                    x, y, z = struct.unpack('<hhh', value[4:])
-                    print("Tilt X/Y/Z:",  x, y, z)
-                else:
-                    print("Tilt: unknown format", value[4:])
-                    
-            # technic hub temperature sensors
-            elif self.device_on_port[port] == 0x3c:
-                if len(value[4:]) == 2:
-                    t = struct.unpack('<h', value[4:])[0] * 0.1
-                    print("temperature: {:3.1f}°C".format(t))
-                else:
-                    print("temperature: unknown format", value[4:])
-                    
-            # unknown boost sensor, always returns one single 00 byte
-            elif self.device_on_port[port] == 0x42:
-                if len(value[4:]) == 1:
-                    b = struct.unpack('<B', value[4:])[0]
-                    print("boost: ", b)
-                    if b!= 0:
-                        print("!= 0!!!")
-                        exit(-1)
-                else:
-                    print("boost: unknown format", value[4:])
-                    exit(-1)
-                    
-            else:
-                print("unbekannter Sensor: ", self.device_on_port[port], ":", value[4:])
-            
-        elif type == 0x47:
-            # Diese Antwort erfolgt auf Sensor-Konfigurationen
-            port = struct.unpack('b', value[3:4])[0]
-            print("Sensor-Bestätigung auf Port", self.port_name(port, '"'))
-        
-        elif type == 0x82:
-            # Diese Antwort erfolgt auf alle 0x81-Kommandos
-            port, code = struct.unpack('BB', value[3:5])
-            
-            # Port = Sensor-/Aktorport
-            # Code 1: Kommando wird gestartet
-            # Code 5: Kommando wird bereits ausgeführt
-            # Code 10: Kommando beendet
-
-            print("Ereignis: Bestätigung für Port", self.port_name(port, '"') + ", ", end="")
-            if code == 1:
-                print("Kommando wird gestartet")
-            elif code == 5:
-                print("Kommando wurde bereits ausgeführt")
-            elif code == 10:
-                print("Kommando beendet")
-            else:
-                print("Unbekannter Code:", code)
-            
+        # Meldung dekodieren und je nach Ereignistyp weiterbearbeiten
+        event = self.decoder.decode(value)
+        if event is not None:
+            self.event_handlers[type(event)](event)
+            # Antworten des Hubs geben ggf. Sendeplätze frei
+            self.transport.reply_received(event)
+            if value[2] in port_modes.REPLIES:
+                self.port_modes.received(value)
+
+    def deliver(self, value):
+        # Antwort aus dem Zwischenspeicher, belegt keinen Sendeplatz
+        event = self.decoder.decode(value)
+        self.event_handlers[type(event)](event)
+
+    def on_hub_property(self, event):
+        if event.property == 1:
+            log.print("hub property", "Hub property device name:", event.value)
+        elif event.property == 2:
+            log.print("hub property", "Hub property button status:", event.value)
+        elif event.property == 3:
+            log.print("hub property", "Hub property firmware version:", event.value)
+            if self.layout_cache:
+                self.layout_cache.firmware_reported(self.mac_address, event.value)
         else:
-            print("Unknown event", hex(type), "data:", value[3:])
-        
-# Hintergrund-Prozess starten, der den GATT-DBus bedient
-manager = BoostDeviceManager(adapter_name='hci0')
-thread = threading.Thread(target = manager.run)
-thread.start()
-
-if len(sys.argv) > 1:
-    # teste, ob der Parameter einer MAC-Adresse entspricht
-    if len(sys.argv[1].split(':')) != 6:
-        print("Bitte eine gültige MAC-Adresse angeben.")
-        print("z.B.:", sys.argv[0], "00:16:53:A4:DB:62");
-        exit(1)
-
-    # Parameter auf der Kommandozeile gegeben
-    manager.connected_device = BoostDevice(mac_address=sys.argv[1], manager=manager)
-    manager.connected_device.connect()
-
-else:
-    print("Suche nach Lego-Boost-Controller ...")
-    print("Bitte Taster am Controller drücken.")
-    manager.start_discovery()
-
-print("Beenden mit Ctrl-C")
-
-# führe eigentliches Programm aus, solange im Hintergrund
-# der Manager noch läuft
-while True:
-    # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
-    # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
-    # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
-    thread.join(1)
-    if not thread.isAlive():
-        break
-
-# versuche Geräteverbindung zum Abschluss zu trennen
-if manager.connected_device:
-    manager.connected_device.disconnect()
+            log.print("hub property", "Hub property unknown:", hex(event.property))
+
+    def on_attached_io(self, event):
+        port = event.port
+        self.port_modes.attached(event)
+
+        # Details zum Port-Konfigurations-Ereignis ausgeben
+        log.print("port config", "Event: Port configuration, port name:", self.port_name(port, '"') + ", ", end="")
+        if event.event == 0:
+            # Event 0: Ein Gerät wurde vom Boost getrennt
+            log.print("port config", "Device on port", hex(port), "disconnected")
+            self.pipeline.port_detached(port)
+            self.subscriptions.detached(port)
+        elif event.event == 1:
+            # hub attach event
+            dev = event.device
+            log.print("port config", "Device connected:", self.device_name(dev, '"'))
+            self.subscriptions.detached(port)
+
+            # request port information
+            self.request_port_information(port)
+
+            # set to true to trigger some default operation for many devices
+            if dev == 0x05: # False: # True: # False:
+                if dev == 0x01:
+                    self.motor_run(port, 25)
+
+                if dev == 0x08:
+                    self.motor_run(port, 100)   # the LED pair uses the same command as the simple motor
+
+                if dev == 0x14:
+                    self.voltage_sensor_set_mode(port, 0)
+
+                if dev == 0x15:
+                    self.current_sensor_set_mode(port, 0)
+
+                if dev == 0x22:
+                    self.wedo_tilt_sensor_set_mode(port, 0)
+
+                if dev == 0x23:
+                    self.wedo_motion_sensor_set_mode(port, 1)  # test in count mode
+
+                # wenn ein Farbsensor gefunden wurde, dann schalte ihn ein
+                if dev == 0x25:
+                    self.color_dist_sensor_set_mode(port, 8)  # z.B. 6 ist RGB, 8 ist Farb-Index+Distanz
+
+                # Wenn ein interaktiver Motor gefunden wurde: Drehe ihn einmal
+                # langsam 360°
+                if dev == 0x26 or dev == 0x2e or dev == 0x2f:
+                    self.motor_report_rotation(port, 2)
+                    self.motor_run_angle(port, 25, 360)
+
+                if dev == 0x27:
+                    self.motor_report_rotation(port, 1)
+
+                # wenn ein Tiltsensor gefunden wurde, dann schalte ihn ein
+                if dev == 0x28:
+                    self.tilt_sensor_set_mode(port, 0)
+
+                # technic hub sensor "impact" sensor
+                if dev == 0x36:
+                    self.generic_set_mode(port, 0)
+
+                # technic hub 3 axis accelerometer
+                if dev == 0x39:
+                    self.generic_set_mode(port, 0)
+
+                # technic hub 3 axis gyroscope
+                if dev == 0x3a:
+                    self.generic_set_mode(port, 0)
+
+                # temperature
+                if dev == 0x3c:
+                    self.generic_set_mode(port, 0)
+
+                # unknown boost sensor
+                if dev == 0x42:
+                    self.generic_set_mode(port, 0)
+
+            # technic hub 3 axis angle, zusammen mit den Stößen (IMP)
+            # in einer Meldung
+            if COMBINED_TILT and dev == 0x3b:
+                self.combined_set_modes(port, [ 0, 1 ])
+
+        elif event.event == 2:
+            # setup of a virtual device complete
+            log.print("port config", "Devices coupled:",  self.device_name(event.device, '"'), "on ports",
+                  self.port_name(event.port_a, '"'), "and", self.port_name(event.port_b, '"'))
+        else:
+            log.print("port config", "Unknown port event", event.event)
+
+    def on_error(self, event):
+        log.print("error", "Error event", event.data)
+
+    def on_port_info(self, event):
+        port = event.port
+        log.print("port info", "Event: Port information: Port name:",  self.port_name(port,'"') + ", ", end="");
+        if event.info_type == 0x01:
+            cap = event.capabilities
+            caps = ""
+            if cap&1: caps += "Output,"
+            if cap&2: caps += "Input,"
+            if cap&4: caps += "Logical Combinable,"
+            if cap&8: caps += "Logical Synchronizable,"
+            log.print("port info", "mode info", caps, "#modes:", event.mode_count,
+                  "input:", event.input_modes, "output", event.output_modes)
+
+            # request info for all modes
+            for i in range(event.mode_count):
+                self.request_port_mode_information(port,i,0x00)   # 0x00 = name
+                self.request_port_mode_information(port,i,0x01)   # 0x01 = raw range
+                self.request_port_mode_information(port,i,0x02)   # 0x02 = pct range
+                self.request_port_mode_information(port,i,0x03)   # 0x03 = si range
+                self.request_port_mode_information(port,i,0x04)   # 0x04 = symbol
+        else:
+            log.print("port info", "unsupported info type", hex(event.info_type));
+
+    def on_port_mode_info(self, event):
+        log.print("mode info", "Event: Port mode information: Port name:",  self.port_name(event.port,'"') + ", ", end="");
+        log.print("mode info", "mode:", event.mode, ", ", end="");
+        itype = event.info_type
+        if itype == 0x00:
+            log.print("mode info", "name:", event.value)
+        elif itype == 0x01:
+            log.print("mode info", "raw min:", event.value[0], "max:", event.value[1]);
+            self.subscriptions.raw_range(event.port, event.mode, *event.value)
+        elif itype == 0x02:
+            log.print("mode info", "pct min:", event.value[0], "max:", event.value[1]);
+        elif itype == 0x03:
+            log.print("mode info", "si min:", event.value[0], "max:", event.value[1]);
+        elif itype == 0x04:
+            log.print("mode info", "symbol:", event.value)
+        elif itype == 0x80:
+            log.print("mode info", "values:", event.value[0], "type:", event.value[1])
+            # ggf. wartet combined_set_modes() auf dieses Format
+            if event.port in self.pending_combinations:
+                modes, resolution, latency = self.pending_combinations[event.port]
+                if lwp3.combination_entries(self.decoder.value_formats,
+                                            self.device_on_port.get(event.port), modes):
+                    self.combined_set_modes(event.port, modes, resolution, latency)
+        else:
+            log.print("mode info", "unknown information type", hex(itype))
+
+    def on_port_value(self, event):
+        self.subscriptions.notified(event.port)
+        if self.recorder is not None:
+            self.recorder.record(self.mac_address, event)
+
+        log.print("port value", "Port event: Port:", self.port_name(event.port,'"') + ", ", end="")
+
+        # Ausgabe je nach Sensor, der vorher an diesem Port erkannt wurde
+        printer = self.PORT_VALUE_PRINTERS.get(event.kind)
+        if printer is not None:
+            printer(self, *event.values)
+        elif event.device in self.PORT_VALUE_UNKNOWN:
+            log.print("port value", self.PORT_VALUE_UNKNOWN[event.device], event.values)
+            if event.device == 0x42:
+                exit(-1)
+        else:
+            log.print("port value", "unbekannter Sensor: ", event.device, ":", event.values)
+
+    def print_boost_unknown(self, b):
+        # unknown boost sensor, always returns one single 00 byte
+        log.print("port value", "boost: ", b)
+        if b != 0:
+            log.print("port value", "!= 0!!!")
+            exit(-1)
+
+    # Ausgabe der dekodierten Port-Werte je Messgröße
+    PORT_VALUE_PRINTERS = {
+        "voltage": lambda self, v: log.print("port value", "Spannung:", v),
+        "current": lambda self, c: log.print("port value", "Strom:", c),
+        "wedo tilt": lambda self, t: log.print("port value", "Neigung:", self.wedo_tilt_name(t)),
+        # WeDo-Winkel sind in 2°-Schritten
+        "wedo tilt angle": lambda self, x, y: log.print("port value", "WeDo-Neigung X°/Y°:", 2*x, 2*y),
+        "wedo tilt count": lambda self, x, y, z: log.print("port value", "Zähler x/y/z:", x, y, z),
+        "wedo distance": lambda self, d: log.print("port value", "WeDo-Distanz:", d),
+        "wedo motion count": lambda self, e: log.print("port value", "WeDo-Bewegungsereignisse:", e),
+        "color distance": lambda self, c, d: log.print("port value", "Farbe:", self.color_name(c, '"') + ",", "Distanz:", d),
+        "color rgb": lambda self, r, g, b: log.print("port value", "Farbe RGB:", r, g, b),
+        "motor delta angle": lambda self, a: log.print("port value", "Motorwinkel seit letztem Report:", a),
+        "motor angle": lambda self, a: log.print("port value", "Summierter Motorwinkel:", a),
+        "tilt": lambda self, t: log.print("port value", "Neigung:", self.tilt_name(t)),
+        "tilt angle": lambda self, x, y: log.print("port value", "Neigung X°/Y°:", x, y),
+        "impact": lambda self, i: log.print("port value", "Impact:", self.impact_name(i)),
+        "acceleration": lambda self, x, y, z: log.print("port value", "Acceleration X/Y/Z:", x, y, z),
+        "gyroscope": lambda self, x, y, z: log.print("port value", "Gyroscope X/Y/Z:", x, y, z),
+        "tilt xyz": lambda self, x, y, z: log.print("port value", "Tilt X/Y/Z:", x, y, z),
+        "temperature": lambda self, t: log.print("port value", "temperature: {:3.1f}°C".format(t * 0.1)),
+        "boost unknown": print_boost_unknown,
+    }
+
+    # Meldungstexte für bekannte Sensoren mit unerwartetem Datenformat
+    PORT_VALUE_UNKNOWN = {
+        0x22: "WeDo-Neigung: unbekanntes Format:",
+        0x23: "WeDo-Distanz: unbekanntes Format:",
+        0x25: "unerwartete Farbsensorantwort:",
+        0x26: "Motordrehung: unbekanntes Format:",
+        0x27: "Motordrehung: unbekanntes Format:",
+        0x2e: "Motordrehung: unbekanntes Format:",
+        0x2f: "Motordrehung: unbekanntes Format:",
+        0x28: "Neigung: unbekanntes Format:",
+        0x36: "Impact: unknown format",
+        0x39: "Acceleration: unknown format",
+        0x3a: "Gyroscope: unknown format",
+        0x3b: "Tilt: unknown format",
+        0x3c: "temperature: unknown format",
+        0x42: "boost: unknown format",
+    }
+
+    def on_port_combined_value(self, event):
+        self.subscriptions.notified(event.port)
+        if self.recorder is not None:
+            self.recorder.record_combined(self.mac_address, event, self.decoder.value_formats)
+        # mehrere Modi eines Ports mit gemeinsamem Zeitpunkt
+        # Ausgabe als { Modus: Werte }
+        log.print("port value", "Port event: Port:", self.port_name(event.port,'"') + ", kombiniert:",
+                  event.values)
+
+    def on_port_input_format(self, event):
+        # Diese Antwort erfolgt auf Sensor-Konfigurationen
+        log.print("input format", "Sensor-Bestätigung auf Port", self.port_name(event.port, '"'))
+
+    def on_port_combined_format(self, event):
+        log.print("input format", "Sensor-Bestätigung (kombiniert) auf Port", self.port_name(event.port, '"'),
+                  "Einträge: 0x%04x" % event.modes)
+
+    def on_port_feedback(self, event):
+        # Diese Antwort erfolgt auf alle 0x81-Kommandos
+        self.pipeline.feedback(event)
+
+        # Port = Sensor-/Aktorport
+        # Code 1: Kommando wird gestartet
+        # Code 5: Kommando wird bereits ausgeführt
+        # Code 10: Kommando beendet
+
+        log.print("feedback", "Ereignis: Bestätigung für Port", self.port_name(event.port, '"') + ", ", end="")
+        if event.code == 1:
+            log.print("feedback", "Kommando wird gestartet")
+        elif event.code == 5:
+            log.print("feedback", "Kommando wurde bereits ausgeführt")
+        elif event.code == 10:
+            log.print("feedback", "Kommando beendet")
+        else:
+            log.print("feedback", "Unbekannter Code:", event.code)
+
+    def on_unknown(self, event):
+        log.print("unknown", "Unknown event", hex(event.type), "data:", event.data)
+
+if __name__ == "__main__":
+    log.configure(rate=LOG_RATE, sample=LOG_SAMPLE)
+    if LOG_FILE:
+        log.open(LOG_FILE)
+    if RECORD_DIR:
+        print("Zeichne Sensorwerte auf in", RECORD_DIR)
+        BoostDevice.recorder = sensor_recorder.Recorder(RECORD_DIR)
+    if LATENCY_STATS:
+        latency.registry.install(None if LATENCY_STATS == "-" else LATENCY_STATS)
+        BoostDevice.latency = latency.registry
+
+    # Hintergrund-Prozess starten, der den GATT-DBus bedient
+    manager = BoostDeviceManager(adapter_name='hci0')
+    BoostDevice.scheduler = toy_timer.Scheduler(manager)
+    thread = threading.Thread(target = manager.run)
+    thread.start()
+
+    if len(sys.argv) > 1:
+        # teste, ob der Parameter einer MAC-Adresse entspricht
+        if len(sys.argv[1].split(':')) != 6:
+            print("Bitte eine gültige MAC-Adresse angeben.")
+            print("z.B.:", sys.argv[0], "00:16:53:A4:DB:62");
+            exit(1)
+
+        # Parameter auf der Kommandozeile gegeben
+        manager.connected_device = BoostDevice(mac_address=sys.argv[1], manager=manager)
+        manager.connected_device.connect()
+
+    else:
+        print("Suche nach Lego-Boost-Controller ...")
+        print("Bitte Taster am Controller drücken.")
+        # nur Controller mit passendem Service melden lassen
+        discovery.start_discovery(manager, toy_profiles.service_uuids(BoostDeviceManager.PROFILES))
+
+    print("Beenden mit Ctrl-C")
+
+    # führe eigentliches Programm aus, solange im Hintergrund
+    # der Manager noch läuft
+    try:
+        while True:
+            # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
+            # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
+            # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
+            thread.join(1)
+            if not thread.is_alive():
+                break
+    except KeyboardInterrupt:
+        # Ctrl-C kommt im Hauptthread an, aufgeräumt wird trotzdem unten
+        print("CTRL-C erkannt")
+    finally:
+        # versuche Geräteverbindung zum Abschluss zu trennen
+        if manager.connected_device:
+            manager.connected_device.disconnect()
+        manager.stop()
+
+        # noch ausstehende Meldungen schreiben
+        log.close()
+
+        if manager.connected_device:
+            print("Ausgaben:", manager.connected_device.outputs.statistics())
+
+        # angefangene Segmente der Aufzeichnung schreiben, der
+        # Schreib-Thread läuft als Daemon und würde sonst einfach beendet
+        if BoostDevice.recorder:
+            BoostDevice.recorder.close()
+            print("Aufzeichnung:", BoostDevice.recorder.statistics())
+
+    if log.dropped:
+        print("Verworfene Meldungen:", log.statistics()["dropped"])
@@ -19,20 +19,31 @@ except ModuleNotFoundError as e:
 import sys, struct
 import threading
 
+import discovery
+import gatt_cache
+import toy_profiles
+from output_queue import CoalescingQueue
+from output_state import OutputShadow
+import toy_log
+
+# Meldungen im Hintergrund ausgeben, siehe toy_log.py
+log = toy_log.log
+
 # GATT Device-Manager, um selektiv nach Lego-Controllern zu suchen
 class WeDoDeviceManager(gatt.DeviceManager):
+    PROFILES = [ toy_profiles.WEDO ]
+
     def __init__(self, adapter_name='hci0'):
         super().__init__(adapter_name=adapter_name)
         self.connected_device = None
 
     def device_discovered(self, device):
-        # teste auf TI-OID und passenden Gerätenamen
-        if((":".join(device.mac_address.split(':')[0:3]) == "a0:e6:f8") and
-           (device.alias() == "LPF2 Smart Hub 2 I/O")):
+        # teste auf passende OID und Gerätenamen, siehe toy_profiles.py
+        if toy_profiles.identify(device, self.PROFILES):
             self.stop_discovery()
             # verbinde, wenn noch nicht verbunden
             if not self.connected_device:
-                print("Controller gefunden, verbinde ...")
+                log.print("connection", "Controller gefunden, verbinde ...")
                 self.connected_device = device
                 self.connected_device.connect()
 
@@ -49,7 +60,16 @@ class WeDoDeviceManager(gatt.DeviceManager):
     def quit(self):
         super().stop()
 
-class WeDoDevice(gatt.Device):
+# benötigte Services und Charakteristiken
+PLUG_EVENT = ("00001523-1212-efde-1523-785feabcd123", "00001527-1212-efde-1523-785feabcd123")
+VALUE_EVENT = ("00004f0e-1212-efde-1523-785feabcd123", "00001560-1212-efde-1523-785feabcd123")
+MODE_SET = ("00004f0e-1212-efde-1523-785feabcd123", "00001563-1212-efde-1523-785feabcd123")
+OUTPUT = ("00004f0e-1212-efde-1523-785feabcd123", "00001565-1212-efde-1523-785feabcd123")
+
+class WeDoDevice(gatt_cache.CachedLayout, gatt.Device):
+    # nach dem ersten Verbinden aus dem Cache, siehe gatt_cache.py
+    CHARACTERISTICS = ( PLUG_EVENT, VALUE_EVENT, MODE_SET, OUTPUT )
+
     def __init__(self, mac_address, manager):
         super().__init__(mac_address, manager)
         self.m1 = None
@@ -57,18 +77,21 @@ class WeDoDevice(gatt.Device):
         self.outstanding_m1_value = None
         self.port = [ None, None ]
         self.output_in_progress = False
-        self.output_queue = [ ]
+        self.output_queue = CoalescingQueue()
+        # zuletzt gesendete Ausgabe je Port und Kommando, siehe output_state.py
+        self.outputs = OutputShadow()
+        self.output_in_flight = None
     
     def connect(self):
         super().connect()
         
     def connect_succeeded(self):
         super().connect_succeeded()
-        print("Verbunden mit", self.mac_address)
+        log.print("connection", "Verbunden mit", self.mac_address)
 
     def connect_failed(self, error):
         super().connect_failed(error)
-        print("Verbindung fehlgeschlagen:", str(error))
+        log.print("connection", "Verbindung fehlgeschlagen:", str(error))
         self.manager.stop()
 
     def disconnect(self):
@@ -78,58 +101,57 @@ class WeDoDevice(gatt.Device):
 
     def disconnect_succeeded(self):
         super().disconnect_succeeded()
-        print("getrennt")
+        log.print("connection", "getrennt")
         self.manager.stop()
         
     def services_resolved(self):
         super().services_resolved()
 
-        for service in self.services:
-            # Lese alle Charakteristiken aus, die wir benötigen
-            for characteristic in service.characteristics:
-                if (service.uuid == "00001523-1212-efde-1523-785feabcd123" and
-                    characteristic.uuid == "00001527-1212-efde-1523-785feabcd123"):
-                    characteristic.name = "plug_event"
-                    characteristic.enable_notifications()
-
-                if (service.uuid == "00004f0e-1212-efde-1523-785feabcd123" and
-                    characteristic.uuid == "00001560-1212-efde-1523-785feabcd123"):
-                    characteristic.name = "value_event"
-                    characteristic.enable_notifications()
-
-                if (service.uuid == "00004f0e-1212-efde-1523-785feabcd123" and
-                    characteristic.uuid == "00001563-1212-efde-1523-785feabcd123"):
-                    self.char_mode_set = characteristic
-                    
-                if (service.uuid == "00004f0e-1212-efde-1523-785feabcd123" and
-                    characteristic.uuid == "00001565-1212-efde-1523-785feabcd123"):
-                    self.char_output = characteristic
+        characteristic = self.layout.get(PLUG_EVENT)
+        if characteristic:
+            characteristic.name = "plug_event"
+            characteristic.enable_notifications()
+
+        characteristic = self.layout.get(VALUE_EVENT)
+        if characteristic:
+            characteristic.name = "value_event"
+            characteristic.enable_notifications()
 
-                    # erstmal nehmen wir an, dass das Hindernis weit weg ist
-                    # und die LED ist grün
-                    self.set_color(9)
+        self.char_mode_set = self.layout.get(MODE_SET)
+
+        self.char_output = self.layout.get(OUTPUT)
+        if self.char_output:
+            # erstmal nehmen wir an, dass das Hindernis weit weg ist
+            # und die LED ist grün
+            self.set_color(9)
                     
     def characteristic_enable_notification_succeeded(self, characteristic):
         super().characteristic_enable_notification_succeeded(characteristic)
-        print("Charakteristik-Notifikation eingeschaltet")
+        log.print("notification", "Charakteristik-Notifikation eingeschaltet")
         
     def characteristic_enable_notification_failed(self, characteristic):
         super().characteristic_enable_notification_failed(characteristic)
-        print("Einschalten Charakteristik-Notifikation fehlgeschlagen")
+        log.print("notification", "Einschalten Charakteristik-Notifikation fehlgeschlagen")
 
     def characteristic_write_value_succeeded(self, characteristic):
         super().characteristic_write_value_succeeded(characteristic)
+        if self.char_output is None or characteristic.uuid != self.char_output.uuid:
+            # z.B. Moduswahl eines Sensors
+            return
+        data = self.output_in_flight
+        self.outputs.acknowledged((data[0], data[1]), data)
         # Daten erfolgreich gesendet. Stehen weitere zum Senden an?
-        if len(self.output_queue) == 0:
-            self.output_in_progress = False
-        else:
-            # sende ausstehende Daten
-            data = self.output_queue.pop(0)
-            self.char_output.write_value(data)
+        self.write_next()
         
     def characteristic_write_value_failed(self, characteristic, error):
         super().characteristic_write_value_failed(characteristic, error)
-        print("Schreiben fehlgeschlagen", error)
+        log.print("write", "Schreiben fehlgeschlagen", error)
+        if self.char_output is not None and characteristic.uuid == self.char_output.uuid:
+            # was jetzt am Port anliegt, ist unbekannt
+            data = self.output_in_flight
+            self.outputs.failed((data[0], data[1]))
+            # die übrigen Ausgaben nicht blockieren
+            self.write_next()
     
     def characteristic_value_updated(self, characteristic, value):
         if characteristic.name == "value_event":
@@ -139,7 +161,7 @@ class WeDoDevice(gatt.Device):
                     # die Distant ist ein IEEE float gespeichert
                     # in Byte 2 bis 5 der Antwort. Der Wertebereich ist 0..9
                     motion = struct.unpack('f', value[2:6])[0]
-                    print("Distanz:", motion)
+                    log.print("value", "Distanz:", motion)
 
                     # wenn etwas in der Nähe ist Farbe von grün über gelb und
                     # orange nach rot wechseln und motor ein- und auschalten
@@ -152,6 +174,8 @@ class WeDoDevice(gatt.Device):
 
             # nur Ports 1 und 2 interessieren
             if port <= 2:
+                # ein neu eingesteckter Motor steht
+                self.outputs.invalidate((port, 1))
                 if event == 0:
                     self.port[port-1] = None
                 elif event == 1:
@@ -170,11 +194,36 @@ class WeDoDevice(gatt.Device):
                         self.port[port-1] = "unknown"
                 
     def set_output(self, data):
+        # Byte 0 ist der Port, Byte 1 die Art des Kommandos. Liegt der Wert
+        # dort schon an oder ist unterwegs, wird nichts gesendet
+        key = (data[0], data[1])
+        if not self.outputs.changes(key, data):
+            return False
         if self.output_in_progress:
-            self.output_queue.append(data)
+            # ein noch wartendes Kommando derselben Art für diesen Port
+            # wird ersetzt
+            self.output_queue.put(data, key, data[0])
         else:
-            self.char_output.write_value(data)
+            self.write_output(data)
             self.output_in_progress = True
+        return True
+
+    def write_next(self):
+        if len(self.output_queue) == 0:
+            self.output_in_progress = False
+        else:
+            # sende ausstehende Daten
+            self.write_output(self.output_queue.get())
+
+    def write_output(self, data):
+        self.output_in_flight = data
+        self.char_output.write_value(data)
+
+    def refresh_outputs(self):
+        # alle zuletzt gewünschten Ausgaben erneut senden, z.B. nach einem
+        # fehlgeschlagenen Schreibzugriff
+        for key, data in self.outputs.refresh():
+            self.set_output(data)
             
     def set_motor(self, speed):
         # alle angeschlossenen Motoren ansteuern, speed = -100 bis 100
@@ -187,42 +236,50 @@ class WeDoDevice(gatt.Device):
         # Die Farben dafür reichen von grün über gelb und orange nach rot
         colors = [ 9, 9, 9, 9, 8, 8, 7, 7, 6, 6 ]
         
-        # sende set_color-Kommando
-        self.set_output(bytes([6,4,1,colors[value]]))
+        # sende set_color-Kommando, wenn sich die Farbe ändert
+        return self.set_output(bytes([6,4,1,colors[value]]))
             
-# Hintergrund-Prozess starten, der den GATT-DBus bedient
-manager = WeDoDeviceManager(adapter_name='hci0')
-thread = threading.Thread(target = manager.run)
-thread.start()
-
-if len(sys.argv) > 1:
-    # teste, ob der Parameter einer MAC-Adresse entspricht
-    if len(sys.argv[1].split(':')) != 6:
-        print("Bitte eine gültige MAC-Adresse angeben.")
-        print("z.B.:", sys.argv[0], "a0:e6:f8:1b:e1:b9");
-        exit(1)
-
-    # Parameter auf der Kommandozeile gegeben
-    manager.connected_device = WeDoDevice(mac_address=sys.argv[1], manager=manager)
-    manager.connected_device.connect()
-
-else:
-    print("Suche nach Lego WeDo-2.0-Controller ...")
-    print("Bitte Taster am Controller drücken.")
-    manager.start_discovery()
-
-print("Beenden mit Ctrl-C")
-
-# führe eigentliches Programm aus, solange im Hintergrund
-# der Manager noch läuft
-while True:
-    # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
-    # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
-    # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
-    thread.join(1)
-    if not thread.isAlive():
-        break
-
-# versuche Geräteverbindung zum Abschluss zu trennen
-if manager.connected_device:
-    manager.connected_device.disconnect()
+if __name__ == "__main__":
+    # Hintergrund-Prozess starten, der den GATT-DBus bedient
+    manager = WeDoDeviceManager(adapter_name='hci0')
+    thread = threading.Thread(target = manager.run)
+    thread.start()
+
+    if len(sys.argv) > 1:
+        # teste, ob der Parameter einer MAC-Adresse entspricht
+        if len(sys.argv[1].split(':')) != 6:
+            print("Bitte eine gültige MAC-Adresse angeben.")
+            print("z.B.:", sys.argv[0], "a0:e6:f8:1b:e1:b9");
+            exit(1)
+
+        # Parameter auf der Kommandozeile gegeben
+        manager.connected_device = WeDoDevice(mac_address=sys.argv[1], manager=manager)
+        manager.connected_device.connect()
+
+    else:
+        print("Suche nach Lego WeDo-2.0-Controller ...")
+        print("Bitte Taster am Controller drücken.")
+        # nur Controller mit passendem Service melden lassen
+        discovery.start_discovery(manager, toy_profiles.service_uuids(WeDoDeviceManager.PROFILES))
+
+    print("Beenden mit Ctrl-C")
+
+    # führe eigentliches Programm aus, solange im Hintergrund
+    # der Manager noch läuft
+    while True:
+        # Teste, ob Manager noch läuft oder ob z.B. der Benutzer
+        # ctrl-c gedrückt hat. Gleichzeitig sorgt der Timeout dafür, dass
+        # die Hauptschleife 1 mal pro Sekunde durchlaufen wird
+        thread.join(1)
+        if not thread.is_alive():
+            break
+
+    # versuche Geräteverbindung zum Abschluss zu trennen
+    if manager.connected_device:
+        manager.connected_device.disconnect()
+
+    # noch ausstehende Meldungen schreiben
+    log.close()
+
+    if manager.connected_device:
+        print("Ausgaben:", manager.connected_device.outputs.statistics())
@@ -1,5 +1,8 @@
 #!/bin/bash
 
+. "$(dirname "$0")/gatt_cache.sh"
+. "$(dirname "$0")/hub_daemon.sh"
+
 # Teste ob eine MAC-Adresse als Parameter gegeben wurde
 # Versuche andernfalls den Controller automatisch zu finden
 if [ "$1" != "" ]; then
@@ -56,35 +59,39 @@ else
     }
 fi
 
-# ein Lego-Controller wurde erkannt, starte gatttool
+# ein Lego-Controller wurde erkannt
 if [ "$LWH" == "" ]; then
     echo "Kein passender Controller gefunden!"
     exit 1
 fi
 
-# suche nach Lego-Service
-LEGO_SRV=`gatttool -b $LWH --primary -u 00004f0e-1212-efde-1523-785feabcd123`
-if [ "$LEGO_SRV" != "" ]; then
-    SH=`echo $LEGO_SRV | cut -d' ' -f3`
-    EH=`echo $LEGO_SRV | cut -d' ' -f6`
-    echo "Lego-Service-Handles: $SH bis $EH"
-
-    # erfrage Lego-Output-Charakteristik
-    LEGO_OUT_CHAR=`gatttool -b $LWH --char-desc -s 0x$SH -e 0x$EH | grep 00001565-1212-efde-1523-785feabcd123`
-    
-    LEGO_OUT_HDL=`echo $LEGO_OUT_CHAR | cut -d',' -f1 | cut -d'=' -f2`
-    if [ "LEGO_OUT_HDL" != "" ]; then
-        echo "Lego-Output-Charakteristik-Handle: $LEGO_OUT_HDL"
-
-	# blinken ...
-	while true; do
-	    # setze LED-Farbe auf Orange
-	    gatttool -b $LWH --char-write-req -a $LEGO_OUT_HDL -n 06040108
-	    sleep 1
-	    # setze LED-Farbe auf Blau
-	    gatttool -b $LWH --char-write-req -a $LEGO_OUT_HDL -n 06040103
-	    sleep 1
-	done    
+# Läuft hub_daemon.py, wird dessen bestehende Verbindung genutzt, sonst baut
+# gatttool für jeden Schreibzugriff eine eigene Verbindung auf
+if hubd_open; then
+    echo "Verbinde über hub_daemon.py ..."
+    hubd connect $LWH > /dev/null || exit 1
+    write_value() {
+	hubd write $LWH 00001565-1212-efde-1523-785feabcd123 $1 > /dev/null
+    }
+else
+    # Handle der Lego-Output-Charakteristik, aus dem Cache oder per gatttool, siehe gatt_cache.sh
+    LEGO_OUT_HDL=`gatt_value_handle $LWH 00004f0e-1212-efde-1523-785feabcd123 00001565-1212-efde-1523-785feabcd123`
+    if [ "$LEGO_OUT_HDL" == "" ]; then
+	echo "Keine Lego-Output-Charakteristik gefunden!"
+	exit 1
     fi
+    echo "Lego-Output-Charakteristik-Handle: $LEGO_OUT_HDL"
+    write_value() {
+	gatttool -b $LWH --char-write-req -a $LEGO_OUT_HDL -n $1
+    }
 fi
- 
+
+# blinken ...
+while true; do
+    # setze LED-Farbe auf Orange
+    write_value 06040108
+    sleep 1
+    # setze LED-Farbe auf Blau
+    write_value 06040103
+    sleep 1
+done
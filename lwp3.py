@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+
+# Tabellengesteuerter Decoder für das Lego Wireless Protocol 3 (LWP3),
+# wie es Boost, Hub NO.4, Technic Hub und City Hub sprechen.
+#
+# Statt einer langen if/elif-Kette wird der Meldungstyp über eine Tabelle
+# auf die passende Dekodier-Routine abgebildet. Alle Formate liegen als
+# vorkompilierte struct.Struct-Objekte vor und werden per unpack_from
+# direkt aus dem empfangenen Puffer gelesen, ohne Teilstücke zu kopieren.
+# Das Ergebnis sind schlanke Ereignis-Objekte mit __slots__.
+#
+# Das Modul hat keine Abhängigkeit zu gatt und kann daher auch ohne
+# Bluetooth (z.B. in Benchmarks) verwendet werden.
+
+import struct
+
+# Meldungstypen
+HUB_PROPERTY = 0x01
+HUB_ATTACHED_IO = 0x04
+ERROR = 0x05
+PORT_INFO = 0x43
+PORT_MODE_INFO = 0x44
+PORT_VALUE = 0x45
+PORT_VALUE_COMBINED = 0x46
+PORT_INPUT_FORMAT = 0x47
+PORT_INPUT_FORMAT_COMBINED = 0x48
+PORT_FEEDBACK = 0x82
+
+# Kommandos an den Hub, die sich auf einen Port beziehen
+PORT_INFO_REQUEST = 0x21
+PORT_MODE_INFO_REQUEST = 0x22
+PORT_INPUT_FORMAT_SETUP = 0x41
+PORT_INPUT_FORMAT_SETUP_COMBINED = 0x42
+PORT_OUTPUT = 0x81
+PORT_COMMANDS = { PORT_INFO_REQUEST, PORT_MODE_INFO_REQUEST,
+                  PORT_INPUT_FORMAT_SETUP, PORT_INPUT_FORMAT_SETUP_COMBINED,
+                  PORT_OUTPUT }
+
+# Unterkommandos von PORT_INPUT_FORMAT_SETUP_COMBINED
+COMBINED_SET_MODES = 0x00
+COMBINED_LOCK = 0x01
+COMBINED_UNLOCK_MULTI_UPDATE = 0x02
+COMBINED_UNLOCK = 0x03
+COMBINED_RESET = 0x05
+
+# Unterkommandos von PORT_OUTPUT, die einen Sollwert setzen (Leistung,
+# Geschwindigkeit, direkte Moduswerte wie die LED-Farbe). Ein neuer Sollwert
+# macht einen noch nicht gesendeten alten Sollwert überflüssig
+SETPOINT_SUBCOMMANDS = { 0x01, 0x02, 0x07, 0x08, 0x51 }
+
+# vorkompilierte Formate
+_TYPE = struct.Struct('>H')
+_PORT_EVENT = struct.Struct('BB')
+_VIRTUAL_PORT = struct.Struct('BxBB')
+_PORT_INFO_MODES = struct.Struct('<BBHH')
+_PORT_MODE = struct.Struct('BBB')
+_RANGE = struct.Struct('<ff')
+_VERSION = struct.Struct('<I')
+_VERSIONS = struct.Struct('<II')
+_COMBINED_FORMAT = struct.Struct('<BBH')
+_POINTER = struct.Struct('<H')
+_MODE_VALUE_FORMAT = struct.Struct('BBBB')
+
+# Werteformate je Gerätetyp und Nutzdatenlänge einer Port-Value-Meldung
+# (0x45). Jeder Eintrag liefert das Format und eine Kurzbezeichnung der
+# Messgröße.
+_S_U8 = struct.Struct('<B')
+_S_S8 = struct.Struct('<b')
+_S_U16 = struct.Struct('<H')
+_S_S16 = struct.Struct('<h')
+_S_U32 = struct.Struct('<L')
+_S_S32 = struct.Struct('<l')
+_S_2S8 = struct.Struct('bb')
+_S_3S8 = struct.Struct('bbb')
+_S_3S16 = struct.Struct('<hhh')
+_S_3U16 = struct.Struct('<HHH')
+_S_COLOR_DIST = struct.Struct('BBxx')
+
+PORT_VALUE_FORMATS = {
+    (0x14, 2): (_S_U16, "voltage"),
+    (0x15, 2): (_S_U16, "current"),
+    (0x22, 1): (_S_U8, "wedo tilt"),
+    (0x22, 2): (_S_2S8, "wedo tilt angle"),
+    (0x22, 3): (_S_3S8, "wedo tilt count"),
+    (0x23, 1): (_S_U8, "wedo distance"),
+    (0x23, 4): (_S_U32, "wedo motion count"),
+    (0x25, 4): (_S_COLOR_DIST, "color distance"),
+    (0x25, 6): (_S_3U16, "color rgb"),
+    (0x28, 1): (_S_U8, "tilt"),
+    (0x28, 2): (_S_2S8, "tilt angle"),
+    (0x36, 1): (_S_U8, "impact"),
+    (0x39, 6): (_S_3S16, "acceleration"),
+    (0x3a, 6): (_S_3S16, "gyroscope"),
+    (0x3b, 6): (_S_3S16, "tilt xyz"),
+    (0x3c, 2): (_S_S16, "temperature"),
+    (0x42, 1): (_S_U8, "boost unknown"),
+}
+
+# alle Motoren mit Winkelsensor liefern dieselben Formate
+for _dev in (0x26, 0x27, 0x2e, 0x2f):
+    PORT_VALUE_FORMATS[(_dev, 1)] = (_S_S8, "motor delta angle")
+    PORT_VALUE_FORMATS[(_dev, 4)] = (_S_S32, "motor angle")
+
+# Wertformat je Gerätetyp und Modus: (Anzahl Werte, Datentyp) wie in der
+# Modus-Information 0x80, Datentyp 0 = 8 Bit, 1 = 16 Bit, 2 = 32 Bit,
+# 3 = float. Wird für kombinierte Port-Values (0x46) benötigt, fehlende
+# Einträge lernt der Decoder aus den 0x44-Antworten
+MODE_VALUE_FORMATS = {
+    (0x39, 0): (3, 1),              # Technic Hub Beschleunigung GRV
+    (0x3a, 0): (3, 1),              # Technic Hub Drehrate ROT
+    (0x3b, 0): (3, 1),              # Technic Hub Lage POS
+    (0x3b, 1): (1, 2),              # Technic Hub Stöße IMP
+    (0x3b, 2): (2, 0),              # Technic Hub CFG
+}
+for _dev in (0x26, 0x27, 0x2e, 0x2f):
+    # POWER, SPEED, POS, APOS
+    MODE_VALUE_FORMATS.update({ (_dev, 0): (1, 0), (_dev, 1): (1, 0),
+                                (_dev, 2): (1, 2), (_dev, 3): (1, 1) })
+
+# Messgröße je Gerätetyp und Modus, deren Werte in einer kombinierten
+# Meldung dieselben sind wie in einer einzelnen (0x45). Die Aufzeichnung
+# (sensor_recorder.py) legt sie dann im selben Strom ab
+MODE_KINDS = {
+    (0x39, 0): "acceleration",
+    (0x3a, 0): "gyroscope",
+    (0x3b, 0): "tilt xyz",
+}
+for _dev in (0x26, 0x27, 0x2e, 0x2f):
+    MODE_KINDS[(_dev, 2)] = "motor angle"
+
+_DATATYPE_CHARS = "bhif"
+
+# -----------------------------------------------------------------------------
+# Ereignis-Objekte
+# -----------------------------------------------------------------------------
+
+class Event:
+    __slots__ = ( )
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self.__slots__))
+
+class HubPropertyEvent(Event):
+    __slots__ = ( "property", "value" )
+
+    def __init__(self, property, value):
+        self.property = property
+        self.value = value
+
+class AttachedIOEvent(Event):
+    # event 0 = getrennt, 1 = verbunden, 2 = virtueller Port eingerichtet.
+    # hw_version und sw_version nur bei event 1
+    __slots__ = ( "port", "event", "device", "port_a", "port_b",
+                  "hw_version", "sw_version" )
+
+    def __init__(self, port, event, device=None, port_a=None, port_b=None,
+                 hw_version=None, sw_version=None):
+        self.port = port
+        self.event = event
+        self.device = device
+        self.port_a = port_a
+        self.port_b = port_b
+        self.hw_version = hw_version
+        self.sw_version = sw_version
+
+class ErrorEvent(Event):
+    __slots__ = ( "data", )
+
+    def __init__(self, data):
+        self.data = data
+
+class PortInfoEvent(Event):
+    __slots__ = ( "port", "info_type", "capabilities", "mode_count",
+                  "input_modes", "output_modes" )
+
+    def __init__(self, port, info_type, capabilities=None, mode_count=None,
+                 input_modes=None, output_modes=None):
+        self.port = port
+        self.info_type = info_type
+        self.capabilities = capabilities
+        self.mode_count = mode_count
+        self.input_modes = input_modes
+        self.output_modes = output_modes
+
+class PortModeInfoEvent(Event):
+    # value ist ein String (Name, Symbol) oder ein (min, max)-Tupel
+    __slots__ = ( "port", "mode", "info_type", "value" )
+
+    def __init__(self, port, mode, info_type, value):
+        self.port = port
+        self.mode = mode
+        self.info_type = info_type
+        self.value = value
+
+class PortValueEvent(Event):
+    # kind ist None, wenn Gerät oder Format unbekannt sind. values enthält
+    # dann die rohen Nutzdaten
+    __slots__ = ( "port", "device", "kind", "values" )
+
+    def __init__(self, port, device, kind, values):
+        self.port = port
+        self.device = device
+        self.kind = kind
+        self.values = values
+
+class PortCombinedValueEvent(Event):
+    # values ordnet jedem gemeldeten Modus das Tupel seiner Werte zu. Nicht
+    # geänderte Werte lässt der Hub weg, ihr Modus fehlt dann ggf. ganz
+    __slots__ = ( "port", "device", "values" )
+
+    def __init__(self, port, device, values):
+        self.port = port
+        self.device = device
+        self.values = values
+
+class PortCombinedFormatEvent(Event):
+    # Bestätigung der kombinierten Modi, modes ist die Bitmaske der
+    # Modus/Datensatz-Einträge
+    __slots__ = ( "port", "combination", "multi_update", "modes" )
+
+    def __init__(self, port, combination, multi_update, modes):
+        self.port = port
+        self.combination = combination
+        self.multi_update = multi_update
+        self.modes = modes
+
+class PortInputFormatEvent(Event):
+    __slots__ = ( "port", )
+
+    def __init__(self, port):
+        self.port = port
+
+class PortFeedbackEvent(Event):
+    # feedback enthält alle (port, code)-Paare der Meldung, port und code
+    # sind die des ersten Paars
+    __slots__ = ( "port", "code", "feedback" )
+
+    def __init__(self, feedback):
+        self.port, self.code = feedback[0]
+        self.feedback = feedback
+
+class UnknownEvent(Event):
+    __slots__ = ( "type", "data" )
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+
+# -----------------------------------------------------------------------------
+# Decoder
+# -----------------------------------------------------------------------------
+
+class Decoder:
+    def __init__(self):
+        # Gerätetyp je Port, wird aus den Attach-Meldungen (0x04) gepflegt
+        # und zum Dekodieren der Port-Value-Meldungen (0x45) benötigt
+        self.device_on_port = { }
+        # Wertformate, siehe MODE_VALUE_FORMATS
+        self.value_formats = dict(MODE_VALUE_FORMATS)
+        # kombinierte Modi je Port: Liste der (Modus, Datensatz)-Einträge
+        # und vorkompilierte Formate je Bitmaske der 0x46-Meldung
+        self.combinations = { }
+        self.combined_formats = { }
+        self.handlers = {
+            HUB_PROPERTY: self.decode_hub_property,
+            HUB_ATTACHED_IO: self.decode_attached_io,
+            ERROR: self.decode_error,
+            PORT_INFO: self.decode_port_info,
+            PORT_MODE_INFO: self.decode_port_mode_info,
+            PORT_VALUE: self.decode_port_value,
+            PORT_VALUE_COMBINED: self.decode_port_value_combined,
+            PORT_INPUT_FORMAT: self.decode_port_input_format,
+            PORT_INPUT_FORMAT_COMBINED: self.decode_port_input_format_combined,
+            PORT_FEEDBACK: self.decode_port_feedback,
+        }
+
+    def decode(self, value):
+        # teste, ob Längenfeld stimmt, ignoriere die Meldung falls nicht
+        if len(value) < 3 or value[0] != len(value):
+            return None
+
+        type = _TYPE.unpack_from(value, 1)[0]
+        handler = self.handlers.get(type)
+        if handler is None:
+            return UnknownEvent(type, bytes(value[3:]))
+        try:
+            return handler(value)
+        except (struct.error, IndexError):
+            # zu kurze Meldung, Nutzdaten unverändert weiterreichen
+            return UnknownEvent(type, bytes(value[3:]))
+
+    def decode_hub_property(self, value):
+        property = value[3]
+        if property == 1:
+            return HubPropertyEvent(property, bytes(value[5:]).decode("utf-8"))
+        if property == 2:
+            return HubPropertyEvent(property, value[5] != 0)
+        if property in (3, 4):
+            # Firmware- bzw. Hardware-Version
+            return HubPropertyEvent(property, version_string(_VERSION.unpack_from(value, 5)[0]))
+        return HubPropertyEvent(property, bytes(value[4:]))
+
+    def decode_attached_io(self, value):
+        port, event = _PORT_EVENT.unpack_from(value, 3)
+        self.set_combination(port, None)
+        if event == 0:
+            self.device_on_port[port] = None
+            return AttachedIOEvent(port, event)
+        if event == 1:
+            dev = value[5]
+            self.device_on_port[port] = dev
+            if len(value) >= 15:
+                hw, sw = _VERSIONS.unpack_from(value, 7)
+                return AttachedIOEvent(port, event, dev, hw_version=version_string(hw),
+                                       sw_version=version_string(sw))
+            return AttachedIOEvent(port, event, dev)
+        if event == 2:
+            dev, port_a, port_b = _VIRTUAL_PORT.unpack_from(value, 5)
+            self.device_on_port[port] = dev
+            return AttachedIOEvent(port, event, dev, port_a, port_b)
+        return AttachedIOEvent(port, event)
+
+    def decode_error(self, value):
+        return ErrorEvent(bytes(value[3:]))
+
+    def decode_port_info(self, value):
+        port, itype = _PORT_EVENT.unpack_from(value, 3)
+        if itype == 0x01:
+            return PortInfoEvent(port, itype, *_PORT_INFO_MODES.unpack_from(value, 5))
+        return PortInfoEvent(port, itype)
+
+    def decode_port_mode_info(self, value):
+        port, mode, itype = _PORT_MODE.unpack_from(value, 3)
+        if itype == 0x00 or itype == 0x04:
+            # Name bzw. Einheit, ggf. mit Nullbytes aufgefüllt
+            info = bytes(value[6:]).rstrip(b'\0').decode('ascii')
+        elif 0x01 <= itype <= 0x03:
+            info = _RANGE.unpack_from(value, 6)
+        elif itype == 0x80:
+            # (Anzahl Werte, Datentyp, Stellen, Nachkommastellen)
+            info = _MODE_VALUE_FORMAT.unpack_from(value, 6)
+            self.value_formats[(self.device_on_port.get(port), mode)] = info[0:2]
+        else:
+            info = bytes(value[6:])
+        return PortModeInfoEvent(port, mode, itype, info)
+
+    def decode_port_value(self, value):
+        port = value[3]
+        dev = self.device_on_port.get(port)
+        fmt = PORT_VALUE_FORMATS.get((dev, len(value) - 4))
+        if fmt is None:
+            return PortValueEvent(port, dev, None, bytes(value[4:]))
+        return PortValueEvent(port, dev, fmt[1], fmt[0].unpack_from(value, 4))
+
+    def decode_port_value_combined(self, value):
+        port = value[3]
+        pointer = _POINTER.unpack_from(value, 4)[0]
+        compiled = self.combined_formats.get((port, pointer))
+        if compiled is None:
+            compiled = self.compile_combined(port, pointer)
+            if compiled is None:
+                return UnknownEvent(PORT_VALUE_COMBINED, bytes(value[3:]))
+        fmt, runs = compiled
+        values = fmt.unpack_from(value, 6)
+        return PortCombinedValueEvent(port, self.device_on_port.get(port),
+                                      { mode: values[a:b] for mode, a, b in runs })
+
+    def compile_combined(self, port, pointer):
+        # Format und (Modus, von, bis)-Abschnitte für die Einträge, deren Bit
+        # in pointer gesetzt ist, oder None, solange ein Wertformat fehlt
+        entries = self.combinations.get(port)
+        if entries is None:
+            return None
+        dev = self.device_on_port.get(port)
+        chars = "<"
+        runs = [ ]
+        for i, (mode, dataset) in enumerate(entries):
+            if not pointer & (1 << i):
+                continue
+            value_format = self.value_formats.get((dev, mode))
+            if value_format is None:
+                return None
+            chars += _DATATYPE_CHARS[value_format[1]]
+            if runs and runs[-1][0] == mode:
+                runs[-1][2] += 1
+            else:
+                n = len(chars) - 2
+                runs.append([ mode, n, n + 1 ])
+        compiled = (struct.Struct(chars), tuple(tuple(run) for run in runs))
+        self.combined_formats[(port, pointer)] = compiled
+        return compiled
+
+    def set_combination(self, port, entries):
+        # entries ist die Liste der (Modus, Datensatz)-Einträge in der
+        # Reihenfolge des 0x42-Kommandos oder None
+        if entries is None:
+            if port not in self.combinations:
+                return
+            self.combinations.pop(port, None)
+        else:
+            self.combinations[port] = list(entries)
+        for key in [ key for key in self.combined_formats if key[0] == port ]:
+            del self.combined_formats[key]
+
+    def decode_port_input_format(self, value):
+        return PortInputFormatEvent(value[3])
+
+    def decode_port_input_format_combined(self, value):
+        port, control, modes = _COMBINED_FORMAT.unpack_from(value, 3)
+        return PortCombinedFormatEvent(port, control & 0x07, bool(control & 0x80), modes)
+
+    def decode_port_feedback(self, value):
+        return PortFeedbackEvent(tuple(
+            (value[i], value[i+1]) for i in range(3, len(value) - 1, 2)))
+
+def version_string(version):
+    # Versionsnummern sind BCD-kodiert, z.B. 1.0.00.0023
+    return "%d.%d.%02x.%04x" % (version >> 28 & 7, version >> 24 & 15,
+                                version >> 16 & 255, version & 0xffff)
+
+def combination_entries(value_formats, device, modes):
+    # (Modus, Datensatz)-Einträge aller Werte der Modi oder None, wenn ein
+    # Wertformat fehlt
+    entries = [ ]
+    for mode in modes:
+        value_format = value_formats.get((device, mode))
+        if value_format is None:
+            return None
+        entries.extend((mode, dataset) for dataset in range(value_format[0]))
+    return entries
+
+# -----------------------------------------------------------------------------
+# Hilfsroutinen für die Sendewarteschlange
+# -----------------------------------------------------------------------------
+
+def command_port(cmd, data):
+    # Port, auf den sich ein Kommando bezieht, oder None für Hub-Kommandos
+    if cmd in PORT_COMMANDS:
+        return data[0]
+    return None
+
+def coalesce_key(cmd, data):
+    # Schlüssel, unter dem ein neueres Kommando ein älteres noch nicht
+    # gesendetes ersetzen darf, oder None, falls es nicht ersetzt werden darf
+    if cmd == PORT_INPUT_FORMAT_SETUP:
+        return (cmd, data[0])
+    if cmd == PORT_OUTPUT and data[2] in SETPOINT_SUBCOMMANDS:
+        if data[2] == 0x51:
+            # direkte Moduswerte sind je Modus getrennt
+            return (cmd, data[0], 0x51, data[3])
+        return (cmd, data[0], data[2])
+    return None
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# Kommando-Pipeline je Port für die Lego-Hubs (LWP3).
+#
+# Jeder Port eines Hubs kann ein laufendes und ein gepuffertes Kommando
+# halten. Werden Motor-Kommandos mit "bei Bedarf puffern" (Startup-Flag
+# Bit 4 gelöscht) gesendet, beginnt das gepufferte Kommando, sobald das
+# laufende beendet ist, ohne Pause dazwischen.
+#
+# PortPipeline hält dazu je Port eine Warteschlange. Es werden nur so viele
+# Kommandos zum Hub geschickt, wie dessen Puffer aufnimmt. Die Rückmeldungen
+# (0x82) werden den gesendeten Kommandos zugeordnet und jedes Kommando wird
+# mit seinem Ergebnis abgeschlossen. Sobald das zuletzt gesendete Kommando
+# eines Ports läuft, wird das nächste in den Puffer des Hubs nachgeschoben.
+#
+# Bits der Rückmeldung:
+#   0x01 Puffer leer, Kommando läuft
+#   0x02 Puffer leer, Kommando beendet
+#   0x04 aktuelles Kommando verworfen
+#   0x08 Port frei
+#   0x10 Port belegt, Puffer voll
+
+from collections import deque
+
+import lwp3
+
+IN_PROGRESS = 0x01
+COMPLETED = 0x02
+DISCARDED = 0x04
+IDLE = 0x08
+BUSY = 0x10
+
+# Startup-Flags: bei Bedarf puffern und Rückmeldung anfordern
+STARTUP_BUFFERED = 0x01
+
+class _Command:
+    __slots__ = ( "data", "done", "started" )
+
+    def __init__(self, data, done):
+        self.data = data
+        self.done = done
+        self.started = False
+
+class _Port:
+    __slots__ = ( "waiting", "in_hub" )
+
+    def __init__(self):
+        self.waiting = deque()   # noch nicht gesendet
+        self.in_hub = deque()    # laufend bzw. im Puffer des Hubs
+
+class PortPipeline:
+    # send(cmd, data) ist z.B. BoostDevice.send_cmd, depth die Anzahl
+    # Kommandos, die der Hub je Port hält (laufend + gepuffert)
+    def __init__(self, send, depth=2):
+        self.send = send
+        self.depth = depth
+        self.ports = { }
+
+    def submit(self, data, done=None):
+        # data sind die Nutzdaten eines 0x81-Kommandos: Port, Startup-Flags,
+        # Unterkommando, ... Die Startup-Flags werden hier gesetzt.
+        # done(code) wird mit dem abschließenden Rückmeldungscode aufgerufen
+        port = self.ports.get(data[0])
+        if port is None:
+            port = self.ports[data[0]] = _Port()
+        port.waiting.append(_Command(bytes([ data[0], STARTUP_BUFFERED ]) + data[2:], done))
+        self.refill(data[0], port)
+
+    def pending(self, port):
+        # Anzahl noch nicht abgeschlossener Kommandos eines Ports
+        state = self.ports.get(port)
+        return len(state.waiting) + len(state.in_hub) if state else 0
+
+    def refill(self, number, port):
+        # nachschieben erst, wenn der Hub das zuletzt gesendete Kommando
+        # gestartet hat. Sonst ließe sich eine Rückmeldung nicht eindeutig
+        # einem Kommando zuordnen
+        while (port.waiting and len(port.in_hub) < self.depth and
+               (not port.in_hub or port.in_hub[-1].started)):
+            command = port.waiting.popleft()
+            port.in_hub.append(command)
+            self.send(lwp3.PORT_OUTPUT, command.data)
+
+    def feedback(self, event):
+        for number, code in event.feedback:
+            port = self.ports.get(number)
+            if port is None or not port.in_hub:
+                continue
+
+            in_hub = port.in_hub
+            if code & IN_PROGRESS:
+                # das jüngste Kommando läuft, alle älteren sind fertig
+                finished = len(in_hub) - 1
+                in_hub[-1].started = True
+            elif code & (COMPLETED | IDLE):
+                # alle gestarteten Kommandos sind fertig. Ein gerade erst
+                # gesendetes Kommando hat der Hub evtl. noch nicht erhalten
+                finished = sum(1 for command in in_hub if command.started)
+            elif code & DISCARDED:
+                finished = 1 if in_hub[0].started else 0
+            else:
+                continue
+
+            for i in range(finished):
+                command = in_hub.popleft()
+                # das Verwerfen betrifft das älteste laufende Kommando
+                result = DISCARDED if i == 0 and code & DISCARDED else COMPLETED
+                if command.done:
+                    command.done(result)
+
+            self.refill(number, port)
+
+    def port_detached(self, number):
+        # Gerät wurde abgezogen, alle Kommandos des Ports verwerfen
+        port = self.ports.pop(number, None)
+        if port:
+            for command in list(port.in_hub) + list(port.waiting):
+                if command.done:
+                    command.done(DISCARDED)
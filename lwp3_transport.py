@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# Sendeverfahren für die LWP3-Charakteristik der Lego-Hubs.
+#
+# RequestTransport entspricht dem bisherigen Verfahren: jedes Kommando wird
+# als Write Request gesendet und das nächste erst nach der ATT-Bestätigung
+# (characteristic_write_value_succeeded). Pro Verbindungsintervall-Paar
+# geht so höchstens ein Kommando zum Hub.
+#
+# CommandTransport nutzt stattdessen Write Without Response und lässt bis
+# zu "window" Kommandos gleichzeitig unterwegs sein. Gebremst wird nicht
+# über ATT-Bestätigungen, sondern über die Antworten des Hubs selbst: ein
+# Port-Kommando (0x81) belegt einen Sendeplatz, bis der Hub per 0x82 meldet,
+# dass der Kommandopuffer des Ports leer ist bzw. das Kommando verworfen
+# wurde. Informations- und Modusanfragen belegen einen Platz bis zur
+# jeweiligen Antwort (0x43, 0x44, 0x47).
+#
+# Schlägt ein Write Without Response fehl oder bleibt der Hub eine Antwort
+# länger als REPLY_TIMEOUT Sekunden schuldig, wird der Platz wieder frei,
+# sonst würde der Transport nach "window" verlorenen Kommandos für immer
+# stehen bleiben. Die Zeitüberwachung braucht einen toy_timer.Scheduler.
+#
+# Mit latency (ein latency.HubLatency) werden die Laufzeiten der Kommandos
+# vom Einreihen bis zur Rückmeldung des Hubs gemessen.
+
+import time, functools
+from collections import deque
+
+import lwp3
+from output_queue import CoalescingQueue
+
+# Antworttyp des Hubs je Kommando, das einen Sendeplatz belegt
+REPLY_FOR_COMMAND = { lwp3.PORT_INFO_REQUEST: lwp3.PORT_INFO,
+                      lwp3.PORT_MODE_INFO_REQUEST: lwp3.PORT_MODE_INFO,
+                      lwp3.PORT_INPUT_FORMAT_SETUP: lwp3.PORT_INPUT_FORMAT,
+                      lwp3.PORT_OUTPUT: lwp3.PORT_FEEDBACK }
+
+# Bits der 0x82-Rückmeldung, nach denen der Kommandopuffer des Ports
+# leer ist: Kommando läuft, Kommando beendet, Kommando verworfen, Port frei
+FEEDBACK_BUFFER_FREE = 0x01 | 0x02 | 0x04 | 0x08
+
+# Sekunden, nach denen eine ausbleibende Antwort des Hubs alle
+# Sendeplätze freigibt
+REPLY_TIMEOUT = 2.0
+
+def write_without_response(characteristic, data, error_handler=None):
+    # Charakteristiken, die selbst write_command anbieten (z.B. Attrappen
+    # in Benchmarks), werden direkt verwendet
+    if hasattr(characteristic, "write_command"):
+        characteristic.write_command(data)
+        return
+
+    # python-gatt kennt nur Write Request, daher wird BlueZ direkt
+    # angesprochen. "command" erfordert BlueZ 5.50 oder neuer
+    import dbus
+    characteristic._object.WriteValue(
+        [ dbus.Byte(b) for b in data ],
+        { 'type': dbus.String('command', variant_level=1) },
+        reply_handler=lambda: None,
+        error_handler=error_handler or (lambda error: print("Schreiben fehlgeschlagen", error)),
+        dbus_interface='org.bluez.GattCharacteristic1')
+
+def _clock(latency):
+    return time.monotonic_ns if latency is not None else None
+
+class RequestTransport:
+    def __init__(self, characteristic, latency=None):
+        self.ch = characteristic
+        self.latency = latency
+        self.queue = CoalescingQueue(_clock(latency))
+        self.in_progress = False
+
+    def send(self, cmd_seq, key=None, port=None):
+        if not self.in_progress:
+            self.write(cmd_seq, None)
+            self.in_progress = True
+        else:
+            # ein noch wartender Sollwert für denselben Port wird ersetzt
+            self.queue.put(cmd_seq, key, port)
+
+    def write(self, data, queued):
+        self.ch.write_value(data)
+        if self.latency is not None:
+            self.latency.written(data, queued, True)
+
+    def write_succeeded(self):
+        if self.latency is not None:
+            self.latency.acknowledged()
+        self.next()
+
+    def next(self):
+        # Daten erfolgreich gesendet. Stehen weitere zum Senden an?
+        if len(self.queue) == 0:
+            self.in_progress = False
+        else:
+            self.write(*self.queue.pop())
+
+    def reply_received(self, event):
+        if self.latency is not None and isinstance(event, lwp3.PortFeedbackEvent):
+            self.latency.feedback(event)
+
+    def reset(self):
+        # nach einem Schreibfehler mit dem nächsten Kommando weitermachen
+        if self.latency is not None:
+            self.latency.failed()
+        self.next()
+
+class CommandTransport:
+    def __init__(self, characteristic, window=4, latency=None, scheduler=None,
+                 timeout=REPLY_TIMEOUT):
+        self.ch = characteristic
+        self.latency = latency
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.queue = CoalescingQueue(_clock(latency))
+        self.window = window
+        self.credits = window
+        # belegte Sendeplätze je Port für 0x81-Kommandos und je
+        # (Antworttyp, Port) für Anfragen
+        self.outstanding = { }
+        # je belegtem Platz ein Timer für die Antwort, älteste zuerst
+        self.timers = { }
+
+    def send(self, cmd_seq, key=None, port=None):
+        self.queue.put(cmd_seq, key, port)
+        self.pump()
+
+    def pump(self):
+        while self.credits > 0 and len(self.queue):
+            data, queued = self.queue.pop()
+
+            # Länge (1 Byte) und Hub-ID (1 Byte) stehen vor dem Kommando
+            reply = REPLY_FOR_COMMAND.get(data[2])
+            slot = None
+            # 0x81 nur mit angeforderter Rückmeldung (Bit 0 der Startup-Flags)
+            if reply is not None and (reply != lwp3.PORT_FEEDBACK or data[4] & 0x01):
+                slot = (reply, data[3])
+                self.take(slot)
+
+            write_without_response(self.ch, data, functools.partial(self.write_failed, slot))
+            if self.latency is not None:
+                self.latency.written(data, queued, False)
+
+    def take(self, slot):
+        self.outstanding[slot] = self.outstanding.get(slot, 0) + 1
+        self.credits -= 1
+        if self.scheduler is not None:
+            timer = self.scheduler.call_later(self.timeout, self.timed_out)
+            self.timers.setdefault(slot, deque()).append(timer)
+
+    def write_failed(self, slot, error):
+        # das Kommando ist nicht beim Hub angekommen, es kommt keine Antwort
+        print("Schreiben fehlgeschlagen", error)
+        if slot is not None:
+            self.release(slot)
+        self.pump()
+
+    def timed_out(self):
+        print("Hub antwortet nicht, Sendeplätze werden freigegeben")
+        self.reset()
+
+    def write_succeeded(self):
+        # Write Without Response wird von python-gatt nicht bestätigt
+        pass
+
+    def reply_received(self, event):
+        if isinstance(event, lwp3.PortFeedbackEvent):
+            if self.latency is not None:
+                self.latency.feedback(event)
+            for port, code in event.feedback:
+                if code & FEEDBACK_BUFFER_FREE:
+                    # der Puffer des Ports ist leer, alle dafür belegten
+                    # Plätze werden frei
+                    self.release((lwp3.PORT_FEEDBACK, port), all=True)
+        elif isinstance(event, lwp3.PortInfoEvent):
+            self.release((lwp3.PORT_INFO, event.port))
+        elif isinstance(event, lwp3.PortModeInfoEvent):
+            self.release((lwp3.PORT_MODE_INFO, event.port))
+        elif isinstance(event, lwp3.PortInputFormatEvent):
+            self.release((lwp3.PORT_INPUT_FORMAT, event.port))
+        elif isinstance(event, lwp3.ErrorEvent) and event.data:
+            # abgelehntes Kommando, der Port wird nicht gemeldet. Es wird
+            # ein Platz mit passendem Antworttyp freigegeben
+            reply = REPLY_FOR_COMMAND.get(event.data[0])
+            for slot in self.outstanding:
+                if slot[0] == reply:
+                    self.release(slot)
+                    break
+        else:
+            return
+        self.pump()
+
+    def release(self, slot, all=False):
+        count = self.outstanding.get(slot, 0)
+        if count == 0:
+            return
+        freed = count if all else 1
+        if count == freed:
+            del self.outstanding[slot]
+        else:
+            self.outstanding[slot] = count - freed
+        self.credits += freed
+        timers = self.timers.get(slot)
+        while timers and freed:
+            timers.popleft().cancel()
+            freed -= 1
+        if not timers:
+            self.timers.pop(slot, None)
+
+    def reset(self):
+        # z.B. nach einem Fehler oder wenn der Hub eine Antwort schuldig
+        # bleibt (timed_out): alle Sendeplätze wieder freigeben
+        self.outstanding.clear()
+        for timers in self.timers.values():
+            for timer in timers:
+                timer.cancel()
+        self.timers.clear()
+        self.credits = self.window
+        if self.latency is not None:
+            self.latency.reset()
+        self.pump()
+
+def make_transport(characteristic, window=0, latency=None, scheduler=None):
+    # window 0 wählt das bisherige Verfahren mit Write Requests. scheduler
+    # (toy_timer.Scheduler) überwacht die Antworten des Hubs
+    if window > 0:
+        return CommandTransport(characteristic, window, latency, scheduler)
+    return RequestTransport(characteristic, latency)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# Fahrprofile für die Motorrampen der Beispielprogramme.
+#
+# Bisher wurde die Geschwindigkeit je Schritt um 1 bzw. 5 erhöht und jeder
+# Schritt geschrieben, auch wenn die Funkstrecke nicht nachkam. run() hat
+# die Zwischenwerte dann in outstanding_m1_value stillschweigend
+# überschrieben.
+#
+# Ein Profil ist hier eine Folge von Abschnitten über der Zeit:
+#
+#   ramp(0, 100, duration=10)                   linear (Trapez)
+#   ramp(0, 100, accel=50)                      linear, 50 je Sekunde
+#   ramp(0, 100, accel=50, jerk=100)            S-Kurve mit Ruckbegrenzung
+#   ramp(0, 100, duration=2, shape=S_CURVE)     S-Kurve in 2 Sekunden
+#   hold(100, 30)                               Wert halten
+#
+# trapezoid() setzt Anfahren, Halten und Bremsen zusammen.
+#
+# Player spielt ein Profil über einen toy_timer.Scheduler ab. Der Wert wird
+# zum jeweiligen Zeitpunkt seit dem Start berechnet, nicht je Schritt,
+# die Rampe endet also unabhängig von der Funkstrecke pünktlich. Geschrieben
+# wird nur, wenn sich der ganzzahlige Wert geändert hat und ready() meldet,
+# dass der letzte Schreibzugriff bestätigt ist. So wird genau so oft
+# abgetastet, wie die Funkstrecke des Controllers hergibt, und es wartet
+# nie ein veralteter Wert. Der Endwert wird immer geschrieben.
+
+import bisect
+
+LINEAR = "linear"
+S_CURVE = "s-curve"
+
+# Abstand, in dem Player prüft, ob ein neuer Wert fällig ist
+PERIOD = 0.01
+
+class Segment:
+    # Übergang von start nach end in duration Sekunden. jerk_fraction ist
+    # der Anteil der Zeit mit Ruck (Beschleunigung baut sich auf bzw. ab),
+    # 0 ist linear, 1 eine S-Kurve ohne Abschnitt konstanter Beschleunigung
+    __slots__ = ( "start", "end", "duration", "jerk_fraction" )
+
+    def __init__(self, start, end, duration, jerk_fraction=0.0):
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.jerk_fraction = jerk_fraction
+
+    def value(self, t):
+        if t >= self.duration or self.start == self.end:
+            return self.end
+        if t <= 0:
+            return self.start
+        return self.start + (self.end - self.start) * self.progress(t)
+
+    def progress(self, t):
+        # Anteil 0 ... 1 des Übergangs zum Zeitpunkt t
+        T = self.duration
+        tj = self.jerk_fraction * T / 2
+        if tj <= 0:
+            return t / T
+        # höchste Beschleunigung, so dass der ganze Übergang 1 ergibt
+        a = 1 / (T - tj)
+        if t < tj:
+            return a * t * t / (2 * tj)
+        if t <= T - tj:
+            return a * tj / 2 + a * (t - tj)
+        return 1 - a * (T - t) * (T - t) / (2 * tj)
+
+def ramp(start, end, duration=None, accel=None, jerk=None, shape=None):
+    # accel in Einheiten je Sekunde, jerk je Sekunde². Mit beiden
+    # Angaben gilt die längere Dauer, die Grenzen werden also eingehalten
+    delta = abs(end - start)
+    if shape is None:
+        shape = S_CURVE if jerk else LINEAR
+    limited = 0.0
+    fraction = 1.0 if shape == S_CURVE else 0.0
+    if accel:
+        if shape == S_CURVE and jerk:
+            tj = accel / jerk
+            if delta >= accel * tj:
+                limited = delta / accel + tj
+            else:
+                # Höchstbeschleunigung wird nicht erreicht
+                limited = 2 * (delta / jerk) ** 0.5
+            fraction = min(1.0, 2 * tj / limited) if limited else 1.0
+        elif shape == S_CURVE:
+            # reine S-Kurve, mittlere Beschleunigung ist die Hälfte der höchsten
+            limited = 2 * delta / accel
+        else:
+            limited = delta / accel
+    if duration is None and not accel:
+        raise ValueError("ramp() braucht duration oder accel")
+    return Segment(start, end, max(duration or 0.0, limited), fraction)
+
+def hold(value, duration):
+    return Segment(value, value, duration)
+
+class Profile:
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.starts = [ ]
+        t = 0.0
+        for segment in self.segments:
+            self.starts.append(t)
+            t += segment.duration
+        self.duration = t
+
+    def index(self, t):
+        # Abschnitt zum Zeitpunkt t
+        return max(0, bisect.bisect_right(self.starts, t) - 1)
+
+    def value(self, t):
+        if t >= self.duration:
+            return self.segments[-1].end
+        i = self.index(t)
+        return self.segments[i].value(t - self.starts[i])
+
+    @property
+    def final(self):
+        return self.segments[-1].end
+
+def trapezoid(peak, hold_time, start=0, end=0, ramp_time=None, accel=None, jerk=None, shape=None):
+    # anfahren auf peak, hold_time Sekunden halten, auf end bremsen
+    return Profile([ ramp(start, peak, ramp_time, accel, jerk, shape),
+                     hold(peak, hold_time),
+                     ramp(peak, end, ramp_time, accel, jerk, shape) ])
+
+class Player:
+    # write(value) schreibt einen ganzzahligen Wert, ready() liefert True,
+    # wenn der Controller einen neuen Wert annimmt. segment(index) wird bei
+    # jedem Abschnittswechsel aufgerufen, done() am Ende, sobald ready() nach
+    # dem Endwert True liefert
+    def __init__(self, scheduler, profile, write, ready=None, period=PERIOD,
+                 segment=None, done=None):
+        self.scheduler = scheduler
+        self.profile = profile
+        self.write = write
+        self.ready = ready
+        self.period = period
+        self.segment = segment
+        self.done = done
+        self.started = None
+        self.index = -1
+        self.last = None
+        self.timer = None
+        self.writes = 0
+        self.deferred = 0       # fälliger Wert, Controller noch beschäftigt
+        self.finished = None    # Zeit seit Start bei Bestätigung des Endwerts
+
+    def start(self):
+        self.started = self.scheduler.clock()
+        self.tick()
+        if self.finished is None:
+            self.timer = self.scheduler.every(self.period, self.tick)
+        return self
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def tick(self):
+        t = self.scheduler.clock() - self.started
+        index = self.profile.index(t)
+        while self.index < index:
+            # auch kurze Abschnitte, die zwischen zwei Aufrufen lagen
+            self.index += 1
+            if self.segment is not None:
+                self.segment(self.index)
+
+        value = round(self.profile.value(t))
+        if value != self.last:
+            if self.ready is not None and not self.ready():
+                self.deferred += 1
+                return
+            self.write(value)
+            self.last = value
+            self.writes += 1
+        if t >= self.profile.duration and self.last == round(self.profile.final):
+            # done() erst, wenn der Controller den Endwert bestätigt hat,
+            # sonst trennt z.B. ft_rc_racer.py, während er noch unterwegs ist
+            if self.ready is not None and not self.ready():
+                return
+            self.finished = t
+            if self.done is not None:
+                self.done()
+            return False
@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Verwendet python-gatt
+# https://github.com/getsenic/gatt-python
+
+# Device-Manager, der mehrere Controller gleichzeitig verbindet und bedient.
+#
+# Die Manager der Beispielprogramme kennen genau ein connected_device und
+# beenden die Suche beim ersten passenden Controller. MultiDeviceManager
+# führt stattdessen ein Verzeichnis aller verbundenen Controller (Schlüssel
+# ist die MAC-Adresse), sucht auch bei bestehenden Verbindungen weiter und
+# verbindet jeden weiteren passenden Controller. Alle Controller teilen sich
+# eine D-Bus-Verbindung und eine GLib-Hauptschleife. Jeder Controller ist
+# ein eigenes Objekt seiner Geräteklasse, die Rückrufe landen daher immer
+# beim Zustand des richtigen Controllers.
+#
+# Wird das Modul direkt gestartet, verbindet es alle in toy_profiles.py
+# bekannten Lego- und fischertechnik-Controller und gibt regelmäßig die
+# Rechenzeit je Controller aus.
+
+import time
+import threading
+
+import discovery
+import toy_profiles
+
+try:
+    import gatt
+except ModuleNotFoundError as e:
+    print("Error loading gatt module:", e);
+    print("You may install it via 'pip3 install gatt' ...");
+    exit(-1);
+
+# Obergrenze gleichzeitig verbundener Controller je Prozess. Die Grenze
+# kommt vom Funk, nicht von der Rechenzeit: die internen Bluetooth-Chips
+# der Raspberry Pis (BCM43438 bzw. CYW43455) halten in der Praxis nicht
+# mehr als etwa sieben gleichzeitige BLE-Verbindungen, weitere
+# Verbindungsversuche schlagen fehl. Bei externen Adaptern kann der Wert
+# angepasst werden.
+#
+# Rechenzeit je Controller (cpu_report), gemessen mit sieben simulierten
+# Controllern auf einem x86-Server, z.B. für den Technic Hub mit
+#
+#   LWP3_COMBINED_TILT=1 python3 hub_sim.py --rate 100 \
+#       --fleet technic,technic,technic,technic,technic,technic,technic multi_hub.py
+#
+# und den letzten Zeilen der Ausgabe (beim ersten Controller kommt der
+# Anlauf des Programms hinzu, er ist nicht berücksichtigt):
+#
+#   Technic Hub, Lage + Stöße:   ~97 Rückrufe/s,   9 us je Rückruf, 0,09% CPU
+#   WeDo 2.0 Hub:               ~100 Rückrufe/s,   7 us je Rückruf, 0,07% CPU
+#   BT Smart Controller:        ~100 Rückrufe/s,   3 us je Rückruf, 0,03% CPU
+#
+# Der Boost Move Hub abonniert in lego_hub_monitor.py keine Sensoren und
+# liefert nur ~2 Rückrufe/s. Selbst bei zwanzigfach langsamerer CPU (Pi
+# Zero) kämen sieben Technic Hubs so auf etwa 13% CPU. Dazu kommen D-Bus
+# und Bildschirmausgaben, die cpu_report nicht erfasst
+MAX_DEVICES = 7
+
+class _Registered:
+    # Wird vor die Geräteklasse gesetzt. Meldet das Verbindungsende an den
+    # Manager und misst die Rechenzeit der Rückrufe je Controller
+    cpu_time = 0.0
+    callbacks = 0
+
+    def connect_failed(self, error):
+        super().connect_failed(error)
+        self.manager.device_lost(self)
+
+    def disconnect_succeeded(self):
+        super().disconnect_succeeded()
+        self.manager.device_lost(self)
+
+    def characteristic_value_updated(self, characteristic, value):
+        start = time.thread_time()
+        super().characteristic_value_updated(characteristic, value)
+        self.cpu_time += time.thread_time() - start
+        self.callbacks += 1
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        start = time.thread_time()
+        super().characteristic_write_value_succeeded(characteristic)
+        self.cpu_time += time.thread_time() - start
+        self.callbacks += 1
+
+_registered_classes = { }
+
+def _registered_class(cls):
+    if cls not in _registered_classes:
+        _registered_classes[cls] = type(cls.__name__, (_Registered, cls), { })
+    return _registered_classes[cls]
+
+class MultiDeviceManager(gatt.DeviceManager):
+    # classify(device) liefert die Geräteklasse für einen gefundenen Controller
+    # oder None, wenn er nicht verbunden werden soll
+    def __init__(self, classify, adapter_name='hci0', max_devices=MAX_DEVICES):
+        super().__init__(adapter_name=adapter_name)
+        self.classify = classify
+        self.max_devices = max_devices
+        self.hubs = { }
+        self.started = time.monotonic()
+
+    def device_discovered(self, device):
+        # bekannte Controller sofort übergehen, ohne weitere D-Bus-Abfragen
+        if device.mac_address in self.hubs or len(self.hubs) >= self.max_devices:
+            return
+
+        cls = self.classify(device)
+        if cls is not None:
+            print("Controller gefunden, verbinde", device.mac_address, "...")
+            self.add(cls, device.mac_address)
+
+    def add(self, cls, mac_address, connect=True):
+        # Controller mit bekannter MAC-Adresse ins Verzeichnis aufnehmen und
+        # verbinden. Die Suche läuft dabei weiter
+        hub = _registered_class(cls)(mac_address=mac_address, manager=self)
+        self.hubs[mac_address] = hub
+        if connect:
+            hub.connect()
+        return hub
+
+    def device_lost(self, hub):
+        # Controller getrennt, beim nächsten Auffinden wird neu verbunden
+        if self.hubs.get(hub.mac_address) is hub:
+            del self.hubs[hub.mac_address]
+            print("Controller", hub.mac_address, "entfernt,", len(self.hubs), "verbleibend")
+
+    def stop(self):
+        # Die Geräteklassen rufen stop() auf, wenn ihre Verbindung endet. Das
+        # betrifft hier nur diesen einen Controller, siehe device_lost()
+        pass
+
+    def cpu_report(self):
+        # Rechenzeit der Rückrufe je Controller seit Programmstart
+        elapsed = time.monotonic() - self.started
+        return { mac: (hub.cpu_time, hub.callbacks, 100 * hub.cpu_time / elapsed)
+                 for mac, hub in list(self.hubs.items()) }
+
+    def run(self):
+        try:
+            super().run()
+        except KeyboardInterrupt:
+            print("CTRL-C erkannt")
+            self.quit();
+
+    def quit(self):
+        for hub in list(self.hubs.values()):
+            if hub.is_connected():
+                hub.disconnect()
+        super().stop()
+
+if __name__ == "__main__":
+    # Hintergrund-Prozess starten, der den GATT-DBus bedient
+    manager = MultiDeviceManager(toy_profiles.device_class, adapter_name='hci0')
+    thread = threading.Thread(target = manager.run)
+    thread.start()
+
+    print("Suche nach Spielzeug-Controllern ...")
+    print("Bitte Taster an den Controllern drücken.")
+    # nur Bluetooth-LE-Geräte melden lassen. Die fischertechnik-Controller
+    # werben keine Service-UUID, dann wird nicht nach UUIDs gefiltert
+    discovery.start_discovery(manager, toy_profiles.service_uuids(toy_profiles.PROFILES))
+
+    print("Beenden mit Ctrl-C")
+
+    # alle 10 Sekunden die Rechenzeit je Controller ausgeben, solange der
+    # Manager im Hintergrund läuft
+    while True:
+        thread.join(10)
+        if not thread.is_alive():
+            break
+
+        for mac, (cpu, callbacks, percent) in manager.cpu_report().items():
+            print("{}: {:6.2f} s CPU, {:7d} Rückrufe, {:5.0f} us/Rückruf, {:5.2f}% CPU".format(
+                mac, cpu, callbacks, 1000000 * cpu / max(callbacks, 1), percent))
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Ersatz für python-gatt ohne BlueZ und ohne Bluetooth-Adapter.
+#
+# Die Klassen bilden die Teile von gatt.DeviceManager, gatt.Device,
+# gatt.Service und gatt.Characteristic nach, die die Beispielprogramme
+# nutzen. Die Gegenseite ist ein Peripheral-Objekt je MAC-Adresse, das den
+# GATT-Aufbau vorgibt und Schreibzugriffe entgegennimmt (siehe replay.py).
+#
+# Wird vor dem Import der Beispielprogramme aktiviert, laufen deren
+# Geräteklassen unverändert:
+#
+#   import offline_gatt
+#   offline_gatt.install()
+#   from lego_hub_monitor import BoostDevice
+#
+# Rückrufe (Schreibbestätigungen, Verbindungsaufbau, ...) werden wie bei
+# BlueZ nie innerhalb des auslösenden Aufrufs ausgeführt, sondern in eine
+# Warteschlange des Managers gestellt. run() arbeitet sie in Echtzeit ab,
+# run_pending() führt alle fälligen sofort aus.
+#
+# Mit connection_interval > 0 bildet ein Peripheral die Funkstrecke nach:
+# Pakete gehen nur zu den Verbindungsereignissen, höchstens
+# packets_per_event je Ereignis, ein Write Request wird ein Ereignis nach
+# seiner Zustellung bestätigt (siehe hub_sim.py).
+
+import sys, time, heapq, itertools, threading
+from collections import deque
+
+# MAC-Adresse -> Peripheral, gemeinsam für alle Manager des Prozesses
+PERIPHERALS = { }
+
+def install():
+    # offline_gatt unter dem Namen gatt bereitstellen
+    sys.modules["gatt"] = sys.modules[__name__]
+
+def add_peripheral(mac_address, peripheral):
+    PERIPHERALS[mac_address.upper()] = peripheral
+
+class Peripheral:
+    # Verbindungsintervall in Sekunden, 0 = keine Verzögerung
+    connection_interval = 0.0
+    packets_per_event = 4
+
+    # Gegenseite eines Controllers. services ist eine Liste von
+    # (Service-UUID, [ Charakteristik-UUID, ... ])
+    def __init__(self, name, services):
+        self.name = name
+        self.services = services
+        self.busy_until = 0.0
+
+    def delivery(self):
+        # Zeitpunkt (time.monotonic), zu dem ein jetzt gesendetes Paket die
+        # Gegenseite erreicht. Die Pakete beider Richtungen teilen sich die
+        # Verbindungsereignisse und kommen in Sendereihenfolge an
+        now = time.monotonic()
+        if not self.connection_interval:
+            return now
+        interval = self.connection_interval
+        # nächstes Verbindungsereignis, je Paket ein Anteil davon
+        start = max(now, self.busy_until)
+        self.busy_until = start + interval / self.packets_per_event
+        return start + interval - (start % interval)
+
+    def connected(self, device):
+        pass
+
+    def disconnected(self, device):
+        pass
+
+    def write(self, device, characteristic, data, response):
+        # response ist False bei Write Without Response
+        pass
+
+    def read(self, device, characteristic):
+        return b""
+
+    def notifications(self, device, characteristic, enabled):
+        pass
+
+class DeviceManager:
+    def __init__(self, adapter_name='hci0'):
+        self.adapter_name = adapter_name
+        self.peripherals = PERIPHERALS
+        self._devices = { }
+        self.ready = deque()
+        self.timers = [ ]
+        # call_soon/call_later dürfen auch aus anderen Threads kommen
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.running = False
+        self.discovering = False
+        # nur Geräte mit einem dieser Services melden, None = alle
+        self.discovery_uuids = None
+
+    # --- Gegenseiten ---------------------------------------------------------
+
+    def add_peripheral(self, mac_address, peripheral):
+        add_peripheral(mac_address, peripheral)
+        if self.discovering:
+            self.call_soon(self.report, mac_address.upper())
+
+    # --- Warteschlange der Rückrufe --------------------------------------------
+
+    def call_soon(self, callback, *args):
+        self.ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        if delay <= 0:
+            self.ready.append((callback, args))
+            return
+        self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        # Rückrufe mit gleichem Zeitpunkt kommen in Aufrufreihenfolge
+        with self.lock:
+            heapq.heappush(self.timers, (when, next(self.sequence), callback, args))
+
+    def run_pending(self):
+        # alle fälligen Rückrufe ausführen, auch solche, die dabei neu
+        # entstehen. Liefert die Anzahl ausgeführter Rückrufe
+        count = 0
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                while self.timers and self.timers[0][0] <= now:
+                    _, _, callback, args = heapq.heappop(self.timers)
+                    self.ready.append((callback, args))
+            if not self.ready:
+                return count
+            callback, args = self.ready.popleft()
+            callback(*args)
+            count += 1
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.run_pending()
+            if self.timers:
+                time.sleep(max(0, min(0.01, self.timers[0][0] - time.monotonic())))
+            else:
+                time.sleep(0.001)
+
+    def stop(self):
+        self.running = False
+
+    # --- Suche ---------------------------------------------------------------
+
+    def is_adapter_powered(self):
+        return True
+
+    def start_discovery(self, service_uuids=None):
+        self.discovering = True
+        self.discovery_uuids = service_uuids
+        for mac_address in self.peripherals:
+            self.call_soon(self.report, mac_address)
+
+    def stop_discovery(self):
+        self.discovering = False
+
+    def report(self, mac_address):
+        peripheral = self.peripherals[mac_address]
+        if not self.discovering:
+            return
+        if self.discovery_uuids and not any(uuid in self.discovery_uuids
+                                            for uuid, _ in peripheral.services):
+            return
+        self.device_discovered(self.device(mac_address))
+
+    def device(self, mac_address):
+        mac_address = mac_address.upper()
+        device = self._devices.get(mac_address)
+        if device is None:
+            device = self._devices[mac_address] = self.make_device(mac_address)
+        return device
+
+    def devices(self):
+        return [ self.device(mac_address) for mac_address in self.peripherals ]
+
+    def make_device(self, mac_address):
+        return Device(mac_address=mac_address, manager=self)
+
+    def device_discovered(self, device):
+        pass
+
+class Service:
+    def __init__(self, device, uuid):
+        self.device = device
+        self.uuid = uuid
+        self.characteristics = [ ]
+
+class Characteristic:
+    def __init__(self, service, uuid):
+        self.service = service
+        self.uuid = uuid
+        self.notifying = False
+
+    def _peripheral(self):
+        device = self.service.device
+        return device.manager.peripherals.get(device.mac_address.upper())
+
+    def write_value(self, value, offset=0):
+        device = self.service.device
+        peripheral = self._peripheral()
+        when = peripheral.delivery()
+        device.manager.call_at(when, peripheral.write, device, self, bytes(value), True)
+        # die Bestätigung kommt mit dem folgenden Verbindungsereignis
+        device.manager.call_at(when + peripheral.connection_interval,
+                               device.characteristic_write_value_succeeded, self)
+
+    def write_command(self, value):
+        # Write Without Response, siehe lwp3_transport.write_without_response
+        device = self.service.device
+        peripheral = self._peripheral()
+        device.manager.call_at(peripheral.delivery(), peripheral.write, device, self, bytes(value), False)
+
+    def read_value(self, offset=0):
+        device = self.service.device
+        peripheral = self._peripheral()
+        value = bytes(peripheral.read(device, self))
+        device.manager.call_at(peripheral.delivery() + peripheral.connection_interval,
+                               self.properties_changed, None, { 'Value': value }, None)
+        return value
+
+    def enable_notifications(self, enabled=True):
+        device = self.service.device
+        self.notifying = enabled
+        self._peripheral().notifications(device, self, enabled)
+        device.manager.call_soon(device.characteristic_enable_notification_succeeded, self)
+
+    def properties_changed(self, properties, changed_properties, invalidated_properties):
+        # wie bei python-gatt kommen Notifikationen und Leseergebnisse hier an
+        value = changed_properties.get('Value')
+        if value is not None:
+            self.service.device.characteristic_value_updated(characteristic=self, value=bytes(value))
+
+    def notify(self, value):
+        # von der Gegenseite aufgerufen, um eine Notifikation zu senden. Sie
+        # kommt mit dem nächsten freien Verbindungsereignis an
+        if self.notifying:
+            self.service.device.manager.call_at(self._peripheral().delivery(), self.properties_changed,
+                                                None, { 'Value': bytes(value) }, None)
+
+class Device:
+    def __init__(self, mac_address, manager, managed=True):
+        self.mac_address = mac_address
+        self.manager = manager
+        self.services = [ ]
+        self._connected = False
+
+    def alias(self):
+        peripheral = self.manager.peripherals.get(self.mac_address.upper())
+        return peripheral.name if peripheral else None
+
+    def connect(self):
+        peripheral = self.manager.peripherals.get(self.mac_address.upper())
+        if peripheral is None:
+            self.manager.call_soon(self.connect_failed, "Device does not exist")
+            return
+        self.manager.call_soon(self._connected_to, peripheral)
+
+    def _connected_to(self, peripheral):
+        self._connected = True
+        self.connect_succeeded()
+        self.services = [ ]
+        for service_uuid, characteristic_uuids in peripheral.services:
+            service = Service(self, service_uuid)
+            service.characteristics = [ Characteristic(service, uuid) for uuid in characteristic_uuids ]
+            self.services.append(service)
+        peripheral.connected(self)
+        self.services_resolved()
+
+    def disconnect(self):
+        if self._connected:
+            self._connected = False
+            peripheral = self.manager.peripherals.get(self.mac_address.upper())
+            if peripheral:
+                peripheral.disconnected(self)
+            self.manager.call_soon(self.disconnect_succeeded)
+
+    def is_connected(self):
+        return self._connected
+
+    def is_services_resolved(self):
+        return self._connected and bool(self.services)
+
+    def characteristic(self, uuid):
+        for service in self.services:
+            for characteristic in service.characteristics:
+                if characteristic.uuid == uuid:
+                    return characteristic
+        return None
+
+    # --- Rückrufe, werden von den Geräteklassen überschrieben --------------------
+
+    def connect_succeeded(self):
+        pass
+
+    def connect_failed(self, error):
+        pass
+
+    def disconnect_succeeded(self):
+        self._connected = False
+
+    def services_resolved(self):
+        pass
+
+    def characteristic_value_updated(self, characteristic, value):
+        pass
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        pass
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        pass
+
+    def characteristic_write_value_failed(self, characteristic, error):
+        pass
+
+    def characteristic_enable_notification_succeeded(self, characteristic):
+        pass
+
+    def characteristic_enable_notification_failed(self, characteristic):
+        pass
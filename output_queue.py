@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Sendewarteschlange für Kommandos an die Controller, bei der jeweils der
+# neueste Wert gewinnt.
+#
+# Kommandos mit einem Schlüssel (z.B. Motor-Geschwindigkeit oder LED-Farbe
+# eines bestimmten Ports) ersetzen ein noch nicht gesendetes Kommando mit
+# demselben Schlüssel. Ein Regelkreis, der schneller Werte liefert als die
+# Bluetooth-Verbindung sie abnimmt, läuft dadurch nicht mehr hinterher.
+#
+# Damit die Reihenfolge erhalten bleibt, wird nur ersetzt, wenn nach dem
+# wartenden Kommando kein weiteres Kommando für denselben Port eingereiht
+# wurde. Kommandos ohne Schlüssel werden nie zusammengefasst.
+#
+# Mit clock (z.B. time.monotonic_ns) bekommt jeder Eintrag den Zeitpunkt
+# des Einreihens, pop() liefert ihn mit (siehe latency.py). Beim Ersetzen
+# gilt der Zeitpunkt des neuen Werts.
+
+from collections import deque
+
+class _Entry:
+    __slots__ = ( "data", "key", "port", "queued" )
+
+    def __init__(self, data, key, port, queued):
+        self.data = data
+        self.key = key
+        self.port = port
+        self.queued = queued
+
+class CoalescingQueue:
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.queue = deque()
+        self.pending = { }        # Schlüssel -> wartender Eintrag
+        self.last_on_port = { }   # Port -> zuletzt eingereihter Eintrag
+        self.merged = 0           # Anzahl ersetzter Kommandos
+
+    def __len__(self):
+        return len(self.queue)
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def put(self, data, key=None, port=None):
+        if key is not None:
+            entry = self.pending.get(key)
+            # nur ersetzen, wenn dahinter nichts für diesen Port wartet
+            if entry is not None and self.last_on_port.get(port) is entry:
+                entry.data = data
+                if self.clock is not None:
+                    entry.queued = self.clock()
+                self.merged += 1
+                return
+
+        entry = _Entry(data, key, port, self.clock() if self.clock is not None else None)
+        self.queue.append(entry)
+        if key is not None:
+            self.pending[key] = entry
+        if port is not None:
+            self.last_on_port[port] = entry
+
+    def get(self):
+        return self.pop()[0]
+
+    def pop(self):
+        # (Daten, Zeitpunkt des Einreihens oder None)
+        entry = self.queue.popleft()
+        if entry.key is not None and self.pending.get(entry.key) is entry:
+            del self.pending[entry.key]
+        if entry.port is not None and self.last_on_port.get(entry.port) is entry:
+            del self.last_on_port[entry.port]
+        return entry.data, entry.queued
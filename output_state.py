@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# Schattenzustand der Ausgänge eines Controllers.
+#
+# Viele Beispiele schreiben einen Ausgang bei jeder Notifikation neu, auch
+# wenn sich nichts ändert: lego_wedo_dino.py setzt die LED bei jedem Wert
+# des Bewegungssensors, lego_boost_color_echo.py hat dafür eigens einen
+# Merker self.color. Jeder dieser Schreibzugriffe belegt die Funkstrecke
+# und verzögert die Kommandos, die wirklich etwas ändern.
+#
+# OutputShadow merkt sich je Ausgang (Schlüssel frei wählbar, z.B. Port
+# und Kommando) den zuletzt gesendeten Wert. changes() liefert False, wenn
+# der Wert dort schon anliegt oder unterwegs ist, der Schreibzugriff
+# entfällt dann und wird in suppressed gezählt:
+#
+#   if self.outputs.changes("M1", value):
+#       ... senden ...
+#
+# Bestätigt der Controller einen Schreibzugriff, trägt acknowledged() den
+# Wert in confirmed ein. Schlägt er fehl, ist der Zustand des Ausgangs
+# unbekannt und failed() sorgt dafür, dass der nächste Wert in jedem Fall
+# gesendet wird. invalidate() macht das für alle Ausgänge, refresh()
+# liefert zusätzlich die zuletzt gewünschten Werte, um sie nach einem
+# Fehler oder Neustart des Controllers erneut zu senden.
+#
+# Nur für Ausgänge geeignet, die ausschließlich über diese Kommandos
+# geändert werden. Ein Motor, der nach einer Zeit oder einem Winkel von
+# selbst anhält, hat keinen verlässlichen Schattenwert.
+
+class OutputShadow:
+    def __init__(self):
+        self.wanted = { }       # Ausgang -> zuletzt gewünschter Wert
+        self.known = { }        # Ausgang -> gesendeter Wert (anliegend oder unterwegs)
+        self.confirmed = { }    # Ausgang -> zuletzt bestätigter Wert
+        self.suppressed = { }   # Ausgang -> Anzahl entfallener Schreibzugriffe
+        self.writes = 0
+
+    def changes(self, key, value):
+        # True, wenn value gesendet werden muss
+        self.wanted[key] = value
+        if key in self.known and self.known[key] == value:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.known[key] = value
+        self.writes += 1
+        return True
+
+    def acknowledged(self, key, value):
+        self.confirmed[key] = value
+
+    def failed(self, key):
+        # Zustand unbekannt, nächsten Wert auf jeden Fall senden
+        self.known.pop(key, None)
+        self.confirmed.pop(key, None)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.known.clear()
+            self.confirmed.clear()
+        else:
+            self.failed(key)
+
+    def refresh(self):
+        # alle Ausgänge vergessen, liefert [ (Ausgang, Wert) ] zum erneuten Senden
+        self.invalidate()
+        return list(self.wanted.items())
+
+    def statistics(self):
+        return { "writes": self.writes, "suppressed": sum(self.suppressed.values()),
+                 "outputs": { str(key): count for key, count in self.suppressed.items() } }
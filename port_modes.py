@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Dauerhafter Zwischenspeicher für die Port- und Modus-Informationen der
+# Lego-Hubs.
+#
+# Nach jeder Attach-Meldung fragt lego_hub_monitor.py die Port-Information
+# (0x21) und je Modus Name, Roh-, Prozent- und SI-Bereich sowie die Einheit
+# ab (0x22). Jede Anfrage geht einzeln durch die Sendewarteschlange, ein
+# Technic Hub mit seinen internen Sensoren braucht so hunderte Runden, bevor
+# das erste eigentliche Kommando durchkommt.
+#
+# Die Antworten hängen nur vom Gerätetyp und dessen Firmware ab, die der Hub
+# in der Attach-Meldung mitschickt. Sie werden hier roh in einer Textdatei
+# abgelegt, eine Zeile je Antwort:
+#
+#   GERÄTETYP FIRMWARE MELDUNGSTYP NUTZDATEN
+#
+# z.B. "0x002e 0.0.00.1000 0x44 0000504f574552" für den Namen von Modus 0
+# eines Technic-Motors. Die Nutzdaten beginnen nach dem Port-Byte. Steht die
+# Antwort in der Datei, wird sie sofort lokal zugestellt, sonst wird wie
+# bisher beim Hub angefragt. Laufen gleiche Anfragen für mehrere Ports mit
+# gleichem Gerät (z.B. zwei Motoren), geht nur eine davon zum Hub.
+#
+# Neue Antworten werden an die Datei angehängt, spätere Zeilen ersetzen
+# frühere. Eine neue Firmware ergibt einen neuen Eintrag.
+
+import os
+
+import lwp3
+
+CACHE_FILE = os.environ.get("TOY_LWP3_MODES",
+                            os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                                        os.path.expanduser("~/.cache")),
+                                         "toy-lwp3-modes"))
+UNKNOWN_FIRMWARE = "-"
+
+# Antworttyp je Anfrage
+REPLY_FOR_REQUEST = { lwp3.PORT_INFO_REQUEST: lwp3.PORT_INFO,
+                      lwp3.PORT_MODE_INFO_REQUEST: lwp3.PORT_MODE_INFO }
+REPLIES = frozenset(REPLY_FOR_REQUEST.values())
+
+def reply_key(reply, payload):
+    # (Meldungstyp, Informationsart) bzw. (Meldungstyp, Modus, Informationsart)
+    if reply == lwp3.PORT_INFO:
+        return (reply, payload[0])
+    return (reply, payload[0], payload[1])
+
+def message(reply, port, payload):
+    # Antwort inkl. Längenfeld und Hub-ID, wie sie der Hub schickt
+    return bytes([ len(payload) + 4, 0, reply, port ]) + payload
+
+class PortModeCache:
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+        # (Gerätetyp, Firmware) -> { Schlüssel -> Nutzdaten }
+        self.entries = None
+
+    def load(self):
+        if self.entries is not None:
+            return self.entries
+        self.entries = { }
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) != 4 or line.startswith("#"):
+                        continue
+                    try:
+                        device, reply = int(fields[0], 16), int(fields[2], 16)
+                        payload = bytes.fromhex(fields[3])
+                        key = reply_key(reply, payload)
+                    except (ValueError, IndexError):
+                        continue
+                    self.entries.setdefault((device, fields[1]), { })[key] = payload
+        except FileNotFoundError:
+            pass
+        return self.entries
+
+    def lookup(self, device, key):
+        # device ist (Gerätetyp, Firmware)
+        return self.load().get(device, { }).get(key)
+
+    def store(self, device, key, payload):
+        entries = self.load().setdefault(device, { })
+        if entries.get(key) == payload:
+            return
+        entries[key] = payload
+        # Anhängen statt die Datei neu zu schreiben, eine Zeile ist kürzer
+        # als PIPE_BUF und landet auch bei mehreren Scripts am Stück
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(self.filename, "a") as f:
+            f.write("0x%04x %s 0x%02x %s\n" % (device[0], device[1], key[0], payload.hex()))
+
+cache = PortModeCache()
+
+class PortModeQueries:
+    # Port- und Modus-Anfragen eines Hubs. send_cmd(cmd, data) sendet zum
+    # Hub, deliver(value) stellt eine Antwort aus dem Zwischenspeicher so zu,
+    # als käme sie vom Hub. cache = None fragt immer beim Hub an
+    def __init__(self, send_cmd, deliver, cache=cache):
+        self.send_cmd = send_cmd
+        self.deliver = deliver
+        self.cache = cache
+        self.devices = { }      # Port -> (Gerätetyp, Firmware)
+        self.waiting = { }      # (Gerätetyp, Firmware, Schlüssel) -> [ Ports ]
+        self.hits = 0
+        self.queries = 0
+
+    def attached(self, event):
+        # mit jeder Attach-Meldung (0x04) aufrufen
+        if event.event == 0:
+            self.devices.pop(event.port, None)
+        elif event.event in (1, 2):
+            self.devices[event.port] = (event.device, event.sw_version or UNKNOWN_FIRMWARE)
+
+    def request(self, cmd, data):
+        # data wie bei send_cmd: Port, ggf. Modus, Informationsart
+        port = data[0]
+        key = (REPLY_FOR_REQUEST[cmd],) + tuple(data[1:])
+        device = self.devices.get(port)
+        if self.cache is None or device is None:
+            self.queries += 1
+            self.send_cmd(cmd, data)
+            return
+
+        payload = self.cache.lookup(device, key)
+        if payload is not None:
+            self.hits += 1
+            self.deliver(message(key[0], port, payload))
+            return
+
+        pending = device + (key,)
+        ports = self.waiting.get(pending)
+        if ports is not None:
+            # die gleiche Anfrage für dieses Gerät ist schon unterwegs
+            ports.append(port)
+            return
+        self.waiting[pending] = [ port ]
+        self.queries += 1
+        self.send_cmd(cmd, data)
+
+    def received(self, value):
+        # mit jeder 0x43- bzw. 0x44-Meldung des Hubs aufrufen
+        port = value[3]
+        device = self.devices.get(port)
+        if self.cache is None or device is None:
+            return
+        payload = bytes(value[4:])
+        try:
+            key = reply_key(value[2], payload)
+        except IndexError:
+            return
+        self.cache.store(device, key, payload)
+        for other in self.waiting.pop(device + (key,), ()):
+            if other != port:
+                self.deliver(message(value[2], other, payload))
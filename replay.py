@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Wiedergabe eines Mitschnitts von capture.py ohne Controller.
+#
+# Die Geräteklassen der Beispielprogramme (z.B. lego_hub_monitor.BoostDevice
+# oder lego_wedo_dino.WeDoDevice) werden unverändert über offline_gatt.py
+# "verbunden" und bekommen die aufgezeichneten Notifikationen in ihr
+# characteristic_value_updated() geliefert, entweder im aufgezeichneten
+# Takt (--realtime) oder so schnell wie möglich. Gemessen wird die Zeit je
+# Notifikation bis zur Rückkehr der Geräteklasse, zusammengefasst je
+# Meldungstyp (bei LWP3 das Typ-Byte, sonst die Charakteristik), dazu der
+# Gesamtdurchsatz. Die Schreibzugriffe der Geräteklasse werden mitgezählt
+# und der Anzahl im Mitschnitt gegenübergestellt.
+#
+# Die Bildschirmausgaben der Geräteklassen werden verworfen (--verbose
+# zeigt sie), ihre Formatierung geht aber in die Messung ein.
+#
+# Aufruf z.B.: python3 replay.py boost.cap --repeat 10 --json
+
+import os, sys, time, json, argparse, importlib, contextlib
+
+import offline_gatt
+offline_gatt.install()
+
+import gatt_cache
+import capture
+import toy_log
+import port_modes
+
+# ohne BlueZ gibt es keine Handles, der GATT-Cache bleibt aus
+gatt_cache.CachedLayout.layout_cache = None
+# die Antworten auf Port-Anfragen stehen im Mitschnitt
+port_modes.cache = None
+
+LWP3_CHARACTERISTIC = "00001624-1212-efde-1623-785feabcd123"
+
+class ReplayPeripheral(offline_gatt.Peripheral):
+    # nimmt die Schreibzugriffe der Geräteklasse entgegen
+    def __init__(self, services):
+        super().__init__("replay", services)
+        self.writes = 0
+
+    def write(self, device, characteristic, data, response):
+        self.writes += 1
+
+def message_type(uuid, data):
+    if uuid == LWP3_CHARACTERISTIC and len(data) >= 3:
+        return "lwp3 0x%02x" % data[2]
+    return uuid[4:8]
+
+def layout(events, mac, cls):
+    # GATT-Aufbau aus den Charakteristiken des Mitschnitts und denen, die
+    # die Geräteklasse erwartet
+    services = { }
+    for service, uuid in getattr(cls, "CHARACTERISTICS", ()):
+        services.setdefault(service, [ ]).append(uuid)
+    for _, _, event_mac, service, uuid, _ in events:
+        if event_mac == mac and uuid not in services.setdefault(service, [ ]):
+            services[service].append(uuid)
+    return list(services.items())
+
+def load_class(name):
+    module, cls = name.rsplit(".", 1)
+    return getattr(importlib.import_module(module), cls)
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def replay(filename, device_class=None, realtime=False, repeat=1):
+    classes, events = capture.load(filename)
+    manager = offline_gatt.DeviceManager()
+    peripherals = { }
+    devices = { }
+    for mac, name in classes.items():
+        cls = load_class(device_class or name)
+        peripherals[mac] = ReplayPeripheral(layout(events, mac, cls))
+        manager.add_peripheral(mac, peripherals[mac])
+        devices[mac] = cls(mac_address=mac, manager=manager)
+        devices[mac].connect()
+    manager.run_pending()
+
+    # Charakteristik-Objekte vorab nachschlagen
+    characteristics = { }
+    for _, _, mac, service, uuid, _ in events:
+        if (mac, uuid) not in characteristics:
+            characteristics[(mac, uuid)] = devices[mac].characteristic(uuid)
+    notifications = [ (t, characteristics[(mac, uuid)], message_type(uuid, data), data)
+                      for t, kind, mac, service, uuid, data in events
+                      if kind == capture.NOTIFICATION and characteristics[(mac, uuid)] ]
+    captured_writes = sum(1 for event in events if event[1] != capture.NOTIFICATION)
+
+    timings = { }
+    clock = time.perf_counter_ns
+    started = time.monotonic()
+    for _ in range(repeat):
+        first = notifications[0][0] if notifications else 0
+        start = time.monotonic_ns()
+        for timestamp, characteristic, kind, data in notifications:
+            if realtime:
+                delay = (timestamp - first) - (time.monotonic_ns() - start)
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            t0 = clock()
+            characteristic.properties_changed(None, { 'Value': data }, None)
+            timings.setdefault(kind, [ ]).append(clock() - t0)
+            # Schreibbestätigungen usw. der Geräteklasse
+            manager.run_pending()
+    elapsed = time.monotonic() - started
+
+    report = { "file": filename, "notifications": len(notifications) * repeat,
+               "seconds": round(elapsed, 3),
+               "messages_per_second": round(len(notifications) * repeat / elapsed) if elapsed else None,
+               "writes": sum(p.writes for p in peripherals.values()),
+               "captured_writes": captured_writes * repeat,
+               "types": { } }
+    for kind, values in sorted(timings.items()):
+        values.sort()
+        report["types"][kind] = { "count": len(values),
+                                  "mean_ns": sum(values) // len(values),
+                                  "p50_ns": percentile(values, 0.5),
+                                  "p99_ns": percentile(values, 0.99),
+                                  "max_ns": values[-1] }
+    return report
+
+def print_report(report):
+    print("Notifikationen:  ", report["notifications"])
+    print("Dauer:            {:.3f} s".format(report["seconds"]))
+    print("Durchsatz:       ", report["messages_per_second"], "Meldungen/s")
+    print("Schreibzugriffe: ", report["writes"], "(im Mitschnitt:", str(report["captured_writes"]) + ")")
+    print()
+    print("{:12s} {:>8s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "Typ", "Anzahl", "Mittel µs", "p50 µs", "p99 µs", "max µs"))
+    for kind, entry in report["types"].items():
+        print("{:12s} {:8d} {:10.1f} {:10.1f} {:10.1f} {:10.1f}".format(
+            kind, entry["count"], entry["mean_ns"] / 1000, entry["p50_ns"] / 1000,
+            entry["p99_ns"] / 1000, entry["max_ns"] / 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mitschnitt von capture.py in die Geräteklassen einspeisen")
+    parser.add_argument("capture", help="Datei von capture.py")
+    parser.add_argument("--device", help="Geräteklasse als modul.Klasse statt der im Mitschnitt")
+    parser.add_argument("--realtime", action="store_true", help="im aufgezeichneten Takt wiedergeben")
+    parser.add_argument("--repeat", type=int, default=1, help="Mitschnitt mehrfach wiedergeben")
+    parser.add_argument("--verbose", action="store_true", help="Ausgaben der Geräteklassen zeigen")
+    parser.add_argument("--json", action="store_true", help="Bericht als JSON")
+    args = parser.parse_args()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        report = replay(args.capture, args.device, args.realtime, args.repeat)
+        # Ausgaben der Geräteklassen, die noch im Hintergrund anstehen
+        toy_log.log.flush()
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+# Aufzeichnung der Sensorwerte (Port-Value-Meldungen 0x45 und 0x46) der
+# Lego-Hubs.
+#
+# Je Hub, Port und Messgröße (siehe lwp3.PORT_VALUE_FORMATS) entsteht ein
+# Verzeichnis mit Segmentdateien. Kombinierte Meldungen (0x46) werden je
+# Modus aufgezeichnet, unter der Messgröße aus lwp3.MODE_KINDS oder sonst
+# als "modeN". Ein Segment speichert die Werte spalten-
+# weise als Arrays fester Breite: eine Spalte mit den Zeitstempeln und eine
+# je Wert der Messgröße (z.B. x, y, z der Beschleunigung). Ganzzahlige
+# Spalten, deren Werte sich von Probe zu Probe nur wenig ändern, werden als
+# Differenzen in 8 oder 16 Bit abgelegt. Alle Spalten beginnen auf 8-Byte-
+# Grenzen, ein Segment lässt sich per mmap direkt auswerten.
+#
+# Die Datei "index" eines Stroms enthält je Segment den ersten und letzten
+# Zeitstempel (24 Byte je Segment). Zeitbereiche werden darin per
+# Binärsuche gefunden, gelesen werden nur die passenden Segmente.
+#
+# Recorder.record() wird im GLib-Thread aufgerufen und hängt die Werte nur
+# an den Puffer des Stroms an. Volle Puffer übernimmt ein eigener Thread,
+# der sie kodiert und schreibt. Je Strom wird höchstens ein Segment
+# gepuffert, zum Schreiben stehen höchstens max_pending Segmente an. Ist
+# der Schreib-Thread zu langsam (z.B. SD-Karte), werden ganze Segmente
+# verworfen und gezählt, statt den GLib-Thread anzuhalten.
+#
+# Auswertung:
+#
+#   reader = StreamReader("aufnahme/00-16-53-A4-DB-62/port01_acceleration")
+#   for timestamp, (x, y, z) in reader.read(start, end):
+#       ...
+
+import os, mmap, time, queue, struct, threading, bisect
+from array import array
+from itertools import accumulate
+
+import lwp3
+
+SEGMENT_MAGIC = b"LWS1"
+
+# Kopf eines Segments: Kennung, Anzahl Proben, Anzahl Spalten
+_SEGMENT_HEADER = struct.Struct('<4sII4x')
+# je Spalte: Typ der Werte, Typ der gespeicherten Daten, Kodierung,
+# Startwert, Position in der Datei
+_COLUMN_HEADER = struct.Struct('<ccB5xqQ')
+# Eintrag im Index: erster und letzter Zeitstempel, Segmentnummer, Proben
+_INDEX_ENTRY = struct.Struct('<qqII')
+
+RAW = 0
+DELTA = 1
+
+# struct-Formate der Messwerte -> array-Typen gleicher Breite
+_TYPECODES = { 'B': 'B', 'b': 'b', 'H': 'H', 'h': 'h', 'L': 'I', 'l': 'i' }
+
+# Messgröße -> array-Typen ihrer Werte
+COLUMN_TYPES = { }
+for _st, _kind in lwp3.PORT_VALUE_FORMATS.values():
+    COLUMN_TYPES[_kind] = tuple(_TYPECODES[c] for c in _st.format if c in _TYPECODES)
+
+# Datentyp der Modus-Information 0x80 -> array-Typ
+_DATATYPE_TYPECODES = ( 'b', 'h', 'i', 'f' )
+
+def _delta_encoding(values, typecode):
+    # kleinsten Differenzen-Typ wählen, in den alle Differenzen passen
+    if len(values) < 2:
+        return None
+    deltas = array('q', [ 0 ])
+    deltas.extend(b - a for a, b in zip(values, values[1:]))
+    low, high = min(deltas), max(deltas)
+    for stored, limit in (('b', 0x80), ('h', 0x8000), ('i', 0x80000000)):
+        if -limit <= low and high < limit and array(stored).itemsize < array(typecode).itemsize:
+            return array(stored, deltas)
+    return None
+
+def encode_segment(times, columns):
+    # Zeitstempel in µs (int64), Spalten als array. Liefert die Bytes einer
+    # Segmentdatei
+    count = len(times)
+    headers = [ ]
+    blobs = [ ]
+    offset = _SEGMENT_HEADER.size + _COLUMN_HEADER.size * (len(columns) + 1)
+    for column in [ times ] + list(columns):
+        deltas = _delta_encoding(column, column.typecode) if column.typecode not in 'fd' else None
+        if deltas is not None:
+            headers.append(_COLUMN_HEADER.pack(column.typecode.encode(), deltas.typecode.encode(),
+                                               DELTA, column[0], offset))
+            data = deltas.tobytes()
+        else:
+            headers.append(_COLUMN_HEADER.pack(column.typecode.encode(), column.typecode.encode(),
+                                               RAW, 0, offset))
+            data = column.tobytes()
+        # nächste Spalte auf 8-Byte-Grenze
+        data += bytes(-len(data) % 8)
+        blobs.append(data)
+        offset += len(data)
+    return b"".join([ _SEGMENT_HEADER.pack(SEGMENT_MAGIC, count, len(columns) + 1) ] + headers + blobs)
+
+def decode_segment(buffer):
+    # Liefert (Zeitstempel, [ Spalten ]) als Listen. buffer kann ein mmap sein
+    magic, count, ncolumns = _SEGMENT_HEADER.unpack_from(buffer, 0)
+    if magic != SEGMENT_MAGIC:
+        raise ValueError("kein Segment")
+    view = memoryview(buffer)
+    columns = [ ]
+    for i in range(ncolumns):
+        typecode, stored, encoding, base, offset = _COLUMN_HEADER.unpack_from(
+            buffer, _SEGMENT_HEADER.size + i * _COLUMN_HEADER.size)
+        stored = stored.decode()
+        size = array(stored).itemsize
+        data = view[offset:offset + count * size].cast(stored)
+        if encoding == DELTA:
+            columns.append([ base + value for value in accumulate(data) ])
+        else:
+            columns.append(data.tolist())
+        data.release()
+    view.release()
+    return columns[0], columns[1:]
+
+class _Stream:
+    __slots__ = ( "path", "typecodes", "times", "columns", "segment" )
+
+    def __init__(self, path, typecodes, segment):
+        self.path = path
+        self.typecodes = typecodes
+        self.segment = segment
+        self.reset()
+
+    def reset(self):
+        self.times = array('q')
+        self.columns = [ array(typecode) for typecode in self.typecodes ]
+
+class Recorder:
+    # segment_samples: Proben je Segment, max_pending: Segmente, die auf den
+    # Schreib-Thread warten dürfen
+    def __init__(self, directory, segment_samples=4096, max_pending=16):
+        self.directory = directory
+        self.segment_samples = segment_samples
+        self.streams = { }
+        self.pending = queue.Queue(max_pending)
+        self.samples = 0
+        self.segments = 0
+        self.dropped = 0
+        self.partial = 0
+        self.writer = threading.Thread(target=self.write_segments, daemon=True)
+        self.writer.start()
+
+    def record(self, hub, event, timestamp=None):
+        # hub ist die MAC-Adresse, event ein lwp3.PortValueEvent
+        stream = self.streams.get((hub, event.port, event.kind))
+        if stream is None:
+            if event.kind not in COLUMN_TYPES:
+                return
+            stream = self.open_stream(hub, event.port, event.kind)
+
+        self.append(stream, time.time_ns() // 1000 if timestamp is None else timestamp, event.values)
+
+    def record_combined(self, hub, event, value_formats, timestamp=None):
+        # event ein lwp3.PortCombinedValueEvent, value_formats die Wertformate
+        # des Decoders. Alle Modi bekommen denselben Zeitstempel
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000
+        for mode, values in event.values.items():
+            kind = lwp3.MODE_KINDS.get((event.device, mode)) or "mode%d" % mode
+            stream = self.streams.get((hub, event.port, kind))
+            if stream is None:
+                typecodes = COLUMN_TYPES.get(kind)
+                if typecodes is None:
+                    value_format = value_formats.get((event.device, mode))
+                    if value_format is None:
+                        continue
+                    typecodes = (_DATATYPE_TYPECODES[value_format[1]], ) * value_format[0]
+                stream = self.open_stream(hub, event.port, kind, typecodes)
+            if len(values) != len(stream.columns):
+                # der Hub hat unveränderte Werte des Modus weggelassen,
+                # welche, ist nicht bekannt
+                self.partial += 1
+                continue
+            self.append(stream, timestamp, values)
+
+    def append(self, stream, timestamp, values):
+        stream.times.append(timestamp)
+        for column, value in zip(stream.columns, values):
+            column.append(value)
+        self.samples += 1
+        if len(stream.times) >= self.segment_samples:
+            self.hand_off(stream)
+
+    def open_stream(self, hub, port, kind, typecodes=None):
+        path = os.path.join(self.directory, hub.replace(":", "-"),
+                            "port%02x_%s" % (port, kind.replace(" ", "_")))
+        os.makedirs(path, exist_ok=True)
+        # eine bestehende Aufzeichnung wird fortgesetzt
+        try:
+            segment = os.path.getsize(os.path.join(path, "index")) // _INDEX_ENTRY.size
+        except FileNotFoundError:
+            segment = 0
+        stream = self.streams[(hub, port, kind)] = _Stream(path, typecodes or COLUMN_TYPES[kind], segment)
+        return stream
+
+    def hand_off(self, stream, block=False):
+        try:
+            self.pending.put((stream.path, stream.segment, stream.times, stream.columns), block)
+            stream.segment += 1
+        except queue.Full:
+            self.dropped += len(stream.times)
+        stream.reset()
+
+    def write_segments(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            path, segment, times, columns = item
+            with open(os.path.join(path, "%06d.seg" % segment), "wb") as f:
+                f.write(encode_segment(times, columns))
+            # der Index wird erst nach dem Segment geschrieben, ein Leser
+            # findet so nur vollständige Segmente
+            with open(os.path.join(path, "index"), "ab") as f:
+                f.write(_INDEX_ENTRY.pack(times[0], times[-1], segment, len(times)))
+            self.segments += 1
+
+    def flush(self):
+        # angefangene Segmente schreiben, z.B. vor Programmende
+        for stream in self.streams.values():
+            if stream.times:
+                self.hand_off(stream, block=True)
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+
+    def statistics(self):
+        return { "samples": self.samples, "segments": self.segments,
+                 "dropped": self.dropped, "partial": self.partial, "streams": len(self.streams) }
+
+class StreamReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index"), "rb") as f:
+            data = f.read()
+        self.entries = [ _INDEX_ENTRY.unpack_from(data, i)
+                         for i in range(0, len(data) - _INDEX_ENTRY.size + 1, _INDEX_ENTRY.size) ]
+        self.last_times = [ entry[1] for entry in self.entries ]
+
+    def segments(self, start=None, end=None):
+        # Index-Einträge, deren Zeitbereich [start, end] überlappt
+        first = 0 if start is None else bisect.bisect_left(self.last_times, start)
+        for entry in self.entries[first:]:
+            if end is not None and entry[0] > end:
+                break
+            yield entry
+
+    def read_segment(self, segment):
+        with open(os.path.join(self.path, "%06d.seg" % segment), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return decode_segment(buffer)
+
+    def read(self, start=None, end=None):
+        # liefert (Zeitstempel, Werte) aller Proben im Zeitbereich
+        for t_first, t_last, segment, count in self.segments(start, end):
+            times, columns = self.read_segment(segment)
+            for i, timestamp in enumerate(times):
+                if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                    yield timestamp, tuple(column[i] for column in columns)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Sensor-Abonnements eines Lego-Hubs mit Bandbreitenbudget.
+#
+# Mit 0x41 legt man je Port fest, um wie viel sich ein Wert ändern muss,
+# bevor der Hub eine neue Meldung schickt (Delta). Die Beispiele haben dafür
+# fest 1 eingetragen, jede kleinste Änderung wird so zu einer Notifikation
+# und mit mehreren Sensoren ist die Funkstrecke schnell voll.
+#
+# Hier gibt jeder Abnehmer eines Ports stattdessen an, was er braucht:
+#
+#   resolution   kleinste Änderung (in Rohwerten), die ihn interessiert
+#   latency      Sekunden, die eine Änderung höchstens unterwegs sein soll
+#
+# Das Delta beginnt bei der feinsten verlangten Auflösung. Je Zeitfenster
+# wird gezählt, wie viele Meldungen jeder Port geliefert hat. Überschreitet
+# der Hub insgesamt sein Budget (Meldungen pro Sekunde), bekommt jeder Port
+# einen Anteil davon, umgekehrt proportional zur verlangten Latenz. Ports
+# über ihrem Anteil bekommen ein im gleichen Verhältnis größeres Delta.
+# Liegt der Hub wieder unter dem halben Budget, wird das Delta schrittweise
+# halbiert, bis die verlangte Auflösung wieder erreicht ist.
+#
+# Ist der Rohwertbereich eines Modus bekannt (Modus-Information 0x01),
+# wird das Delta auf dessen Hälfte begrenzt, der Port meldet also weiter
+# große Sprünge, auch wenn die Funkstrecke voll ist.
+#
+# Kombinierte Modi (0x46) eines Ports werden mit dem Tupel ihrer Modi und
+# einem eigenen set_mode abonniert, das die ganze Kombination neu einrichtet.
+# Das Delta gilt dann für jeden der Modi. Meldungen von Ports ohne
+# Abonnement hier zählen gegen das Budget, ihr Delta wird nicht verändert.
+
+import time, math
+
+# Länge eines Zeitfensters in Sekunden
+WINDOW = 1.0
+# Vorgaben für Abnehmer ohne eigene Angaben
+RESOLUTION = 1
+LATENCY = 0.1
+# Delta wächst je Zeitfenster höchstens um diesen Faktor
+MAX_STEP = 8
+MAX_DELTA = 0xffffffff
+
+class Subscription:
+    __slots__ = ( "port", "mode", "set_mode", "consumers", "resolution", "latency", "delta", "count",
+                  "rate", "settling" )
+
+    def __init__(self, port, mode, set_mode):
+        self.port = port
+        self.mode = mode
+        self.set_mode = set_mode
+        self.consumers = { }    # Abnehmer -> (Auflösung, Latenz)
+        self.resolution = RESOLUTION
+        self.latency = LATENCY
+        self.delta = RESOLUTION
+        self.count = 0
+        self.rate = 0.0
+        self.settling = False   # Delta im letzten Zeitfenster geändert
+
+    def update(self):
+        # strengste Anforderung aller Abnehmer
+        self.resolution = max(1, min(r for r, l in self.consumers.values()))
+        self.latency = min(l for r, l in self.consumers.values())
+
+class SubscriptionPolicy:
+    # set_mode(port, mode, delta, notify) sendet das 0x41-Kommando. budget
+    # in Meldungen pro Sekunde, None passt die Deltas nie an
+    def __init__(self, set_mode, budget=None, window=WINDOW, clock=time.monotonic):
+        self.set_mode = set_mode
+        self.budget = budget
+        self.window = window
+        self.clock = clock
+        self.subscriptions = { }    # Port -> Subscription
+        self.ranges = { }           # (Port, Modus) -> Rohwertbereich
+        self.other = 0              # Meldungen ohne Abonnement im Zeitfenster
+        self.other_rate = 0.0
+        self.window_start = None
+        self.retunes = 0
+
+    def subscribe(self, port, mode, resolution=RESOLUTION, latency=LATENCY, consumer=None,
+                  set_mode=None):
+        # mode ist ein Tupel bei kombinierten Modi, set_mode ersetzt dann das
+        # des Hubs für diesen Port
+        set_mode = set_mode or self.set_mode
+        sub = self.subscriptions.get(port)
+        if sub is None or sub.mode != mode or sub.set_mode != set_mode:
+            # ein Port liefert immer nur einen Modus bzw. eine Kombination
+            sub = self.subscriptions[port] = Subscription(port, mode, set_mode)
+        sub.consumers[consumer] = (resolution, latency)
+        sub.update()
+        # neue Anforderung, ggf. wird beim nächsten Zeitfenster wieder vergröbert
+        sub.delta = sub.resolution
+        sub.set_mode(port, mode, sub.delta, True)
+        return sub
+
+    def unsubscribe(self, port, consumer=None):
+        sub = self.subscriptions.get(port)
+        if sub is None or sub.consumers.pop(consumer, None) is None:
+            return
+        if sub.consumers:
+            sub.update()
+            return
+        del self.subscriptions[port]
+        sub.set_mode(port, sub.mode, sub.delta, False)
+
+    def detached(self, port):
+        # Gerät getrennt oder neu angesteckt, der Hub hat die Einstellung vergessen
+        self.subscriptions.pop(port, None)
+        for key in [ key for key in self.ranges if key[0] == port ]:
+            del self.ranges[key]
+
+    def raw_range(self, port, mode, low, high):
+        # aus der Modus-Information 0x01 (raw min, max)
+        self.ranges[(port, mode)] = abs(high - low)
+
+    def notified(self, port):
+        # mit jeder Port-Value-Meldung (0x45, 0x46) aufrufen
+        sub = self.subscriptions.get(port)
+        if sub is not None:
+            sub.count += 1
+        else:
+            self.other += 1
+        now = self.clock()
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= self.window:
+            self.retune(now)
+
+    def retune(self, now):
+        elapsed = now - self.window_start
+        self.window_start = now
+        total = self.other_rate = self.other / elapsed
+        self.other = 0
+        for sub in self.subscriptions.values():
+            sub.rate = sub.count / elapsed
+            sub.count = 0
+            total += sub.rate
+        if not self.budget or not self.subscriptions:
+            return
+
+        if total > self.budget:
+            # was nicht abonniert ist, lässt sich hier nicht bremsen
+            available = max(self.budget - self.other_rate, 1)
+            weights = { port: 1 / max(sub.latency, 0.001) for port, sub in self.subscriptions.items() }
+            weight = sum(weights.values())
+            for port, sub in list(self.subscriptions.items()):
+                share = available * weights[port] / weight
+                if sub.settling:
+                    # im Zeitfenster kamen noch Meldungen mit dem alten Delta
+                    sub.settling = False
+                elif sub.rate > share:
+                    step = min(sub.rate / share, MAX_STEP)
+                    self.change(sub, math.ceil(sub.delta * step))
+        elif total < self.budget / 2:
+            for sub in list(self.subscriptions.values()):
+                if sub.settling:
+                    sub.settling = False
+                elif sub.delta > sub.resolution:
+                    self.change(sub, max(sub.resolution, sub.delta // 2))
+
+    def change(self, sub, delta):
+        limit = self.ranges.get((sub.port, sub.mode))
+        if limit is not None:
+            delta = min(delta, max(int(limit / 2), sub.resolution))
+        delta = min(delta, MAX_DELTA)
+        if delta == sub.delta:
+            return
+        sub.delta = delta
+        sub.settling = True
+        self.retunes += 1
+        sub.set_mode(sub.port, sub.mode, delta, True)
+
+    def statistics(self):
+        # { Port: Modus, Delta, Auflösung, Latenz, Meldungen/s im letzten Fenster }
+        result = { "0x%02x" % port: { "mode": sub.mode, "delta": sub.delta, "resolution": sub.resolution,
+                                     "latency": sub.latency, "rate": round(sub.rate, 1) }
+                   for port, sub in sorted(self.subscriptions.items()) }
+        result["other"] = { "rate": round(self.other_rate, 1) }
+        return result
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+
+# asyncio-Schnittstelle für die Geräteklassen der Beispielprogramme.
+#
+# Statt gatt.DeviceManager.run in einem eigenen Thread laufen zu lassen und
+# im Hauptprogramm per thread.join() zu pollen, läuft die asyncio-Schleife
+# auf der GLib-Hauptschleife, über die python-gatt die D-Bus-Meldungen von
+# BlueZ erhält (gi.events ab PyGObject 3.50, sonst gbulb). Die Schleife
+# wacht nur auf, wenn eine Meldung ansteht oder ein Timer fällig ist. Alle
+# Rückrufe der Geräteklassen laufen im Thread der asyncio-Schleife, Futures
+# können direkt aufgelöst werden und ein Prozess kann beliebig viele
+# Controller bedienen.
+#
+# Gibt es beides nicht, fragt ein Task den GLib-Kontext alle interval
+# Sekunden ab. Das kostet auch ohne Verkehr ständig Aufwachvorgänge und
+# verzögert jede Meldung um bis zu interval.
+#
+# Beispiel:
+#
+#   async def main():
+#       manager = AsyncDeviceManager()
+#       hub = AsyncBoostHub(manager, "00:16:53:A4:DB:62")
+#       await hub.connect()
+#       await hub.motor_run_angle(0, 50, 360)    # wartet bis Drehung beendet
+#       # zwei Drehungen ohne Pause nacheinander
+#       await asyncio.gather(hub.motor_run_angle(0, 50, 90),
+#                            hub.motor_run_angle(0, -50, 90))
+#       event = await hub.wait_event(lambda e: isinstance(e, lwp3.PortValueEvent))
+#       await hub.disconnect()
+#       manager.close()
+#
+#   toy_asyncio.run(main())      # statt asyncio.run(), siehe run()
+#
+# Die Geräteklassen werden unverändert aus den Beispielprogrammen
+# übernommen. Deren Bildschirmausgaben und Reaktionen auf Sensorwerte
+# bleiben daher erhalten.
+
+import asyncio, functools
+
+import gatt
+from gi.repository import GLib
+try:
+    from gi.events import GLibEventLoopPolicy
+except ImportError:
+    try:
+        from gbulb import GLibEventLoopPolicy
+    except ImportError:
+        GLibEventLoopPolicy = None
+
+import discovery
+import lwp3
+import toy_timer
+from lego_hub_monitor import BoostDevice
+from lego_wedo_dino import WeDoDevice
+from ft_karussell import FtBtSmartDevice
+from ft_rc_racer import FtBtCtrlRcvDevice
+
+class HubError(Exception):
+    pass
+
+def run(main):
+    # wie asyncio.run(), aber möglichst auf der GLib-Hauptschleife
+    if GLibEventLoopPolicy is not None:
+        asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+    return asyncio.run(main)
+
+def glib_driven():
+    # True, wenn die asyncio-Schleife selbst den Standard-Kontext der GLib
+    # bedient
+    return GLibEventLoopPolicy is not None and isinstance(
+        asyncio.get_event_loop_policy(), GLibEventLoopPolicy)
+
+class AsyncDeviceManager(gatt.DeviceManager):
+    # interval ist die Zeit in Sekunden, nach der der GLib-Kontext erneut
+    # auf neue D-Bus-Meldungen geprüft wird, falls die asyncio-Schleife
+    # nicht auf der GLib läuft
+    def __init__(self, adapter_name='hci0', interval=0.002):
+        super().__init__(adapter_name=adapter_name)
+        self.interval = interval
+        self.context = GLib.MainContext.default()
+        self.pump_task = None
+        self.discovery = None
+
+    def start(self):
+        # python-gatt meldet sich erst in run() bei BlueZ für InterfacesAdded
+        # und PropertiesChanged an, ohne diese Signale kommt nie ein
+        # device_discovered(). run() blockiert aber in einer eigenen
+        # GLib-Hauptschleife, daher hier dieselben Empfänger anmelden
+        self.connect_signals()
+        # auf der GLib-Hauptschleife gibt es sonst nichts zu tun, ohne sie
+        # den GLib-Kontext aus der asyncio-Schleife heraus abfragen
+        if self.pump_task is None and not glib_driven():
+            self.pump_task = asyncio.ensure_future(self.pump())
+
+    def connect_signals(self):
+        # wie gatt.DeviceManager.run(). offline_gatt.DeviceManager hat keinen
+        # D-Bus und meldet gefundene Geräte selbst
+        if getattr(self, "_bus", None) is None or self._interface_added_signal is not None:
+            return
+        import dbus
+        self._interface_added_signal = self._bus.add_signal_receiver(
+            self._interfaces_added,
+            dbus_interface='org.freedesktop.DBus.ObjectManager',
+            signal_name='InterfacesAdded')
+        self._properties_changed_signal = self._bus.add_signal_receiver(
+            self._properties_changed,
+            dbus_interface=dbus.PROPERTIES_IFACE,
+            signal_name='PropertiesChanged',
+            arg0='org.bluez.Device1',
+            path_keyword='path')
+
+    def close(self):
+        # Gegenstück zu start(), wenn der Manager nicht mehr gebraucht wird
+        if self.pump_task is not None:
+            self.pump_task.cancel()
+            self.pump_task = None
+        if getattr(self, "_interface_added_signal", None) is not None:
+            for device in self._devices.values():
+                device.invalidate()
+            self._properties_changed_signal.remove()
+            self._interface_added_signal.remove()
+            self._interface_added_signal = self._properties_changed_signal = None
+
+    async def pump(self):
+        context = self.context
+        while True:
+            while context.pending():
+                context.iteration(False)
+            await asyncio.sleep(self.interval)
+
+    def run(self):
+        # es gibt keine eigene GLib-Hauptschleife, die Signale meldet start() an
+        raise RuntimeError("AsyncDeviceManager läuft in der asyncio-Schleife, siehe start()")
+
+    def stop(self):
+        # Die Geräteklassen rufen stop() bei Verbindungsende auf. Das betrifft
+        # hier nur das jeweilige Gerät, nicht die anderen Controller
+        pass
+
+    async def discover(self, match, service_uuids=None, timeout=None):
+        # sucht nach einem Controller, für den match(device) wahr ist, und
+        # liefert dessen MAC-Adresse. Mit service_uuids filtert bereits BlueZ
+        self.start()
+        self.discovery = (match, asyncio.get_running_loop().create_future())
+        discovery.start_discovery(self, service_uuids)
+        try:
+            return await asyncio.wait_for(self.discovery[1], timeout)
+        finally:
+            self.stop_discovery()
+            self.discovery = None
+
+    def device_discovered(self, device):
+        if self.discovery and not self.discovery[1].done() and self.discovery[0](device):
+            self.discovery[1].set_result(device.mac_address)
+
+class _Callbacks:
+    # Wird vor die Geräteklasse gesetzt und reicht deren Rückrufe an die
+    # asyncio-Schnittstelle weiter
+    def services_resolved(self):
+        super().services_resolved()
+        self.hub.resolved()
+
+    def connect_failed(self, error):
+        super().connect_failed(error)
+        self.hub.failed(error)
+
+    def disconnect_succeeded(self):
+        super().disconnect_succeeded()
+        self.hub.disconnected()
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        super().characteristic_write_value_succeeded(characteristic)
+        self.hub.written()
+
+    def characteristic_write_value_failed(self, characteristic, error):
+        super().characteristic_write_value_failed(characteristic, error)
+        self.hub.written()
+
+    def characteristic_value_updated(self, characteristic, value):
+        super().characteristic_value_updated(characteristic, value)
+        self.hub.value_updated(characteristic, value)
+
+@functools.lru_cache(maxsize=None)
+def _device_class(cls):
+    return type(cls.__name__, (_Callbacks, cls), { })
+
+class AsyncHub:
+    DEVICE_CLASS = None
+    # Anzahl gepufferter Ereignisse, ältere werden bei Überlauf verworfen
+    EVENT_QUEUE_SIZE = 256
+
+    def __init__(self, manager, mac_address):
+        self.manager = manager
+        self.device = _device_class(self.DEVICE_CLASS)(mac_address=mac_address, manager=manager)
+        self.device.hub = self
+        self.loop = None
+        self.ready = None
+        self.closed = None
+        self.drained = [ ]
+        self.waiters = [ ]
+        self.events = None
+
+    # --- Verbindung ------------------------------------------------------------
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.closed = self.loop.create_future()
+        self.events = asyncio.Queue(self.EVENT_QUEUE_SIZE)
+        self.manager.start()
+        self.device.connect()
+        await self.ready
+
+    async def disconnect(self):
+        if self.device.is_connected():
+            self.device.disconnect()
+            await self.closed
+
+    def resolved(self):
+        if not self.ready.done():
+            self.ready.set_result(True)
+
+    def failed(self, error):
+        if not self.ready.done():
+            self.ready.set_exception(HubError(str(error)))
+
+    def disconnected(self):
+        for future in [ self.ready, self.closed ] + self.drained + [ w[1] for w in self.waiters ]:
+            if not future.done():
+                if future is self.closed:
+                    future.set_result(True)
+                else:
+                    future.set_exception(HubError("Verbindung getrennt"))
+        self.drained = [ ]
+        self.waiters = [ ]
+
+    # --- Schreiben ---------------------------------------------------------------
+
+    def idle(self):
+        # True, wenn keine Daten mehr auf das Senden warten. Die Geräteklassen
+        # mit einem Schreibzugriff zur Zeit führen write_in_progress
+        return not getattr(self.device, "write_in_progress", False)
+
+    async def drain(self):
+        # wartet, bis alle bisher ausgelösten Schreibvorgänge bestätigt sind
+        if self.idle():
+            return
+        future = self.loop.create_future()
+        self.drained.append(future)
+        await future
+
+    def written(self):
+        if self.drained and self.idle():
+            for future in self.drained:
+                if not future.done():
+                    future.set_result(True)
+            self.drained = [ ]
+
+    # --- Ereignisse ------------------------------------------------------------
+
+    def value_updated(self, characteristic, value):
+        # Standard: rohe Werte je Charakteristik weiterreichen
+        self.publish((getattr(characteristic, "name", characteristic.uuid), value))
+
+    def publish(self, event):
+        if self.events.full():
+            self.events.get_nowait()
+        self.events.put_nowait(event)
+
+        waiters = self.waiters
+        if waiters:
+            self.waiters = [ ]
+            for predicate, future in waiters:
+                if future.done():
+                    continue
+                if predicate(event):
+                    future.set_result(event)
+                else:
+                    self.waiters.append((predicate, future))
+
+    async def wait_event(self, predicate=lambda event: True):
+        # wartet auf das nächste Ereignis, für das predicate wahr ist
+        future = self.loop.create_future()
+        self.waiters.append((predicate, future))
+        return await future
+
+    async def next_event(self):
+        # nächstes gepuffertes Ereignis
+        return await self.events.get()
+
+class AsyncBoostHub(AsyncHub):
+    DEVICE_CLASS = BoostDevice
+
+    def __init__(self, manager, mac_address):
+        super().__init__(manager, mac_address)
+        # auf Rückmeldung des Hubs wartende Port-Kommandos
+        self.commands = { }
+        # Zeitüberwachung der Antworten, siehe lwp3_transport.py
+        self.device.scheduler = toy_timer.Scheduler(manager)
+
+        # dekodierte Ereignisse zusätzlich zur Ausgabe weiterreichen
+        handlers = self.device.event_handlers
+        for cls, handler in handlers.items():
+            handlers[cls] = functools.partial(self.dispatch, handler)
+
+    def dispatch(self, handler, event):
+        handler(event)
+        if isinstance(event, lwp3.PortFeedbackEvent):
+            for port, code in event.feedback:
+                self.feedback(port, code)
+        self.publish(event)
+
+    def value_updated(self, characteristic, value):
+        # Ereignisse werden bereits in dispatch() weitergereicht
+        pass
+
+    def disconnected(self):
+        for futures in self.commands.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(HubError("Verbindung getrennt"))
+        self.commands.clear()
+        for port in list(self.device.pipeline.ports):
+            self.device.pipeline.port_detached(port)
+        super().disconnected()
+
+    def idle(self):
+        transport = self.device.transport
+        return transport is None or (len(transport.queue) == 0 and
+                                     not getattr(transport, "in_progress", False))
+
+    def feedback(self, port, code):
+        futures = self.commands.get(port)
+        if not futures:
+            return
+        if code & 0x0a:
+            # Kommando beendet bzw. Port frei: alles bis hier ist erledigt
+            done, futures[:] = futures[:], [ ]
+        elif code & 0x04:
+            # vorheriges Kommando wurde durch ein neueres verdrängt
+            done, futures[:] = futures[:-1], futures[-1:]
+        else:
+            return
+        for future in done:
+            if not future.done():
+                future.set_result(code)
+
+    def command(self, port, send, *args):
+        # Port-Kommando senden, das Future wird mit der 0x82-Rückmeldung
+        # aufgelöst, die das Ende des Kommandos meldet
+        future = self.loop.create_future()
+        futures = self.commands.setdefault(port, [ ])
+        futures.append(future)
+        if send(*args) is False:
+            # nichts gesendet, z.B. weil die LED die Farbe schon hat
+            futures.remove(future)
+            future.set_result(None)
+        return future
+
+    def queued(self, send, *args):
+        # Kommando über die Pipeline des Ports senden. Mehrere Kommandos für
+        # denselben Port laufen so ohne Pause nacheinander ab, das Future
+        # wird mit dem Rückmeldungscode des jeweiligen Kommandos aufgelöst
+        future = self.loop.create_future()
+        def done(code):
+            if not future.done():
+                future.set_result(code)
+        send(*args, queued=True, done=done)
+        return future
+
+    async def motor_run(self, port, speed):
+        return await self.command(port, self.device.motor_run, port, speed)
+
+    async def motor_run_time(self, port, speed, time):
+        return await self.queued(self.device.motor_run_time, port, speed, time)
+
+    async def motors_run_time(self, speedA, speedB, time):
+        return await self.queued(self.device.motors_run_time, speedA, speedB, time)
+
+    async def motor_run_angle(self, port, speed, angle):
+        return await self.queued(self.device.motor_run_angle, port, speed, angle)
+
+    async def motors_run_angle(self, speedA, speedB, angle):
+        return await self.queued(self.device.motors_run_angle, speedA, speedB, angle)
+
+    async def led_set_color(self, color=0):
+        return await self.command(0x32, self.device.led_set_color, color)
+
+    async def port_value(self, port):
+        # nächster Sensorwert eines Ports
+        event = await self.wait_event(
+            lambda e: isinstance(e, lwp3.PortValueEvent) and e.port == port)
+        return event.values
+
+class AsyncWeDoHub(AsyncHub):
+    DEVICE_CLASS = WeDoDevice
+
+    def idle(self):
+        return not self.device.output_in_progress
+
+    async def set_motor(self, speed):
+        self.device.set_motor(speed)
+        await self.drain()
+
+    async def set_color(self, value):
+        self.device.set_color(value)
+        await self.drain()
+
+class AsyncFtBtSmartHub(AsyncHub):
+    DEVICE_CLASS = FtBtSmartDevice
+
+    async def run(self, value):
+        self.device.run(value)
+        await self.drain()
+
+class AsyncFtBtCtrlRcvHub(AsyncHub):
+    DEVICE_CLASS = FtBtCtrlRcvDevice
+
+    async def run(self, value):
+        self.device.run(value)
+        await self.drain()
+
+    async def steer(self, value):
+        self.device.steer(value)
+        await self.drain()
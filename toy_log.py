@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Ausgabe der Meldungen ohne Wartezeit im GLib-Thread.
+#
+# print() schreibt synchron. Ist stdout ein langsames Terminal oder eine
+# SSH-Verbindung, wartet der GLib-Thread auf die Ausgabe und Notifikationen
+# wie Schreibbestätigungen werden verzögert bearbeitet. Log.print() hängt
+# die Argumente dagegen nur an eine begrenzte Warteschlange an, formatiert
+# und geschrieben wird in einem Hintergrund-Thread.
+#
+# Jede Meldung hat einen Typ (z.B. "port value"). Je Typ lässt sich die
+# Zahl der Zeilen pro Sekunde begrenzen (rate) oder nur jede n-te Zeile
+# ausgeben (sample). Verworfene Zeilen werden je Typ und Grund gezählt,
+# ebenso Zeilen, die bei voller Warteschlange nicht mehr hineinpassen.
+#
+# Statt Text kann kompakt binär geschrieben werden: Zeitstempel, Typ-Index
+# und die Argumente per marshal. Lesbar wird die Datei mit
+#
+#   python3 toy_log.py DATEI [--kind TYP]
+
+import sys, time, struct, marshal, argparse, threading, atexit
+from collections import deque
+
+HEADER = b"# toy-log 1\n"
+# Zeit (ns), Typ-Index, Länge der Nutzdaten. Index 0 führt einen neuen
+# Typ ein, die Nutzdaten sind dann sein Name
+_RECORD = struct.Struct("<qHI")
+
+# Grund des Verwerfens
+RATE = "rate"
+SAMPLE = "sample"
+QUEUE = "queue"
+
+class _Limit:
+    # Token-Bucket für rate, Zähler für sample
+    __slots__ = ( "rate", "tokens", "last", "every", "count" )
+
+    def __init__(self, rate, every):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.every = every
+        self.count = 0
+
+class Log:
+    def __init__(self, output=None, binary=False, maxsize=10000):
+        self.output = output        # None: jeweils aktuelles sys.stdout
+        self.binary = binary
+        self.maxsize = maxsize
+        self.limits = { }
+        self.pending = deque()
+        self.dropped = { }          # (Typ, Grund) -> Anzahl
+        self.written = 0
+        self.line = None            # Entscheidung für eine angefangene Zeile
+        self.kinds = { }            # binär: Typ -> Index
+        self.wakeup = threading.Event()
+        self.busy = False
+        self.thread = None
+        self.owned = False          # Datei selbst geöffnet
+
+    def configure(self, rate=None, sample=None):
+        # rate: { Typ: Zeilen pro Sekunde }, sample: { Typ: n }
+        rate = rate or { }
+        sample = sample or { }
+        self.limits = { kind: _Limit(rate.get(kind), sample.get(kind))
+                        for kind in set(rate) | set(sample) }
+
+    def open(self, filename, binary=True):
+        self.flush()
+        self.output = open(filename, "wb" if binary else "w")
+        self.binary = binary
+        self.owned = True
+        self.kinds = { }
+        if binary:
+            self.output.write(HEADER)
+
+    def print(self, kind, *args, sep=" ", end="\n"):
+        # wie print(), die Argumente werden erst im Hintergrund formatiert
+        if self.line is not None:
+            # Fortsetzung einer Zeile mit end="", gleiche Entscheidung
+            accepted = self.line
+        else:
+            accepted = self.admit(kind)
+            if accepted and len(self.pending) >= self.maxsize:
+                self.drop(kind, QUEUE)
+                accepted = False
+        self.line = None if end.endswith("\n") else accepted
+        if not accepted:
+            return
+
+        self.pending.append((time.time_ns(), kind, args, sep, end))
+        if self.thread is None:
+            self.start()
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def admit(self, kind):
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        if limit.every:
+            limit.count += 1
+            if limit.count % limit.every:
+                self.drop(kind, SAMPLE)
+                return False
+        if limit.rate:
+            now = time.monotonic()
+            limit.tokens = min(limit.rate, limit.tokens + (now - limit.last) * limit.rate)
+            limit.last = now
+            if limit.tokens < 1:
+                self.drop(kind, RATE)
+                return False
+            limit.tokens -= 1
+        return True
+
+    def drop(self, kind, reason):
+        self.dropped[(kind, reason)] = self.dropped.get((kind, reason), 0) + 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="toy_log", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            self.busy = True
+            try:
+                self.write_pending()
+            except Exception as e:
+                # ein kaputtes Ausgabeziel darf den Hintergrund-Thread nicht beenden
+                self.pending.clear()
+                print("toy_log: Ausgabe fehlgeschlagen:", e, file=sys.stderr)
+            self.busy = False
+
+    def write_pending(self):
+        output = self.output or sys.stdout
+        pending = self.pending
+        count = 0
+        while pending:
+            t, kind, args, sep, end = pending.popleft()
+            if self.binary:
+                self.write_record(output, t, kind, args, sep, end)
+            else:
+                output.write(sep.join(map(str, args)) + end)
+            count += 1
+        if count:
+            self.written += count
+            output.flush()
+
+    def write_record(self, output, t, kind, args, sep, end):
+        index = self.kinds.get(kind)
+        if index is None:
+            index = self.kinds[kind] = len(self.kinds) + 1
+            name = kind.encode()
+            output.write(_RECORD.pack(t, 0, len(name)) + name)
+        try:
+            payload = marshal.dumps((args, sep, end))
+        except ValueError:
+            # z.B. Objekte der Geräteklassen, dann als Text
+            payload = marshal.dumps((tuple(map(str, args)), sep, end))
+        output.write(_RECORD.pack(t, index, len(payload)) + payload)
+
+    def flush(self, timeout=5):
+        # warten, bis alles Angenommene geschrieben ist
+        if self.thread is None:
+            return
+        end = time.monotonic() + timeout
+        while (self.pending or self.busy) and time.monotonic() < end:
+            self.wakeup.set()
+            time.sleep(0.001)
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.output.close()
+            self.output = None
+            self.owned = False
+
+    def statistics(self):
+        dropped = { }
+        for (kind, reason), count in sorted(self.dropped.items()):
+            dropped.setdefault(kind, { })[reason] = count
+        return { "written": self.written, "queued": len(self.pending), "dropped": dropped }
+
+def read(filename):
+    # liefert (Zeit ns, Typ, Argumente, sep, end) einer binären Ausgabe
+    kinds = [ None ]
+    with open(filename, "rb") as f:
+        if f.readline() != HEADER:
+            raise ValueError(filename + ": keine Ausgabe von toy_log.py")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            t, index, length = _RECORD.unpack(head)
+            payload = f.read(length)
+            if index == 0:
+                kinds.append(payload.decode())
+            else:
+                args, sep, end = marshal.loads(payload)
+                yield t, kinds[index], args, sep, end
+
+# gemeinsame Ausgabe aller Geräteklassen eines Programms
+log = Log()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Binäre Ausgabe von toy_log.py als Text")
+    parser.add_argument("file", help="Datei von Log.open()")
+    parser.add_argument("--kind", action="append", help="nur Meldungen dieses Typs")
+    args = parser.parse_args()
+
+    line = True
+    for t, kind, values, sep, end in read(args.file):
+        if args.kind and kind not in args.kind:
+            continue
+        if line:
+            print(time.strftime("%H:%M:%S", time.localtime(t / 1e9)) +
+                  ".%03d" % (t // 1000000 % 1000), "%-14s" % kind, end=" ")
+        print(*values, sep=sep, end=end)
+        line = end.endswith("\n")
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Verzeichnis aller unterstützten Spielzeug-Controller.
+#
+# Jedes Profil beschreibt einen Controller-Typ: die OIDs (erste drei Bytes
+# der MAC-Adresse), die Gerätenamen im Advertisement, die angebotenen
+# Service-UUIDs und die Geräteklasse, mit der er angesteuert wird. Die
+# Erkennung eines gefundenen Geräts geschieht über Hash-Tabellen: zuerst
+# nach OID, erst bei passender OID wird der Name (blockierende D-Bus-
+# Abfrage) gelesen und nachgeschlagen.
+#
+# Ein neuer Controller-Typ wird per register() aufgenommen, ohne dass die
+# device_discovered()-Routinen geändert werden müssen.
+
+import importlib
+
+import discovery
+
+class ToyProfile:
+    __slots__ = ( "name", "oids", "names", "service_uuids", "device_class", "_class" )
+
+    # device_class ist "modul.Klasse" und wird erst bei Bedarf importiert,
+    # damit das Verzeichnis auch ohne gatt geladen werden kann
+    def __init__(self, name, oids, names, service_uuids, device_class):
+        self.name = name
+        self.oids = tuple(oid.lower() for oid in oids)
+        self.names = tuple(names)
+        self.service_uuids = tuple(uuid.lower() for uuid in service_uuids)
+        self.device_class = device_class
+        self._class = None
+
+    def load_class(self):
+        if self._class is None:
+            module, cls = self.device_class.rsplit(".", 1)
+            self._class = getattr(importlib.import_module(module), cls)
+        return self._class
+
+    def __repr__(self):
+        return "ToyProfile(%r)" % self.name
+
+# OID -> { Gerätename -> Profil }
+_by_oid = { }
+# Service-UUID -> [ Profile ]
+_by_uuid = { }
+PROFILES = [ ]
+
+def register(profile):
+    for oid in profile.oids:
+        names = _by_oid.setdefault(oid, { })
+        for name in profile.names:
+            names[name] = profile
+    for uuid in profile.service_uuids:
+        _by_uuid.setdefault(uuid, [ ]).append(profile)
+    PROFILES.append(profile)
+    return profile
+
+WEDO = register(ToyProfile(
+    "Lego WeDo 2.0 Hub",
+    oids = [ "a0:e6:f8" ],
+    names = [ "LPF2 Smart Hub 2 I/O" ],
+    service_uuids = [ discovery.WEDO_SERVICE_UUID ],
+    device_class = "lego_wedo_dino.WeDoDevice"))
+
+LWP3_HUB = register(ToyProfile(
+    "Lego Boost/Technic/City Hub",
+    oids = [ "00:16:53", "90:84:2b" ],
+    names = [ "LEGO Move Hub", "HUB NO.4", "Technic Hub", "Smart Hub" ],
+    service_uuids = [ discovery.LWP3_SERVICE_UUID ],
+    device_class = "lego_hub_monitor.BoostDevice"))
+
+# Die fischertechnik-Controller geben ihre Services nicht verlässlich im
+# Advertisement an, sie werden nur über OID und Namen erkannt
+FT_BT_SMART = register(ToyProfile(
+    "fischertechnik BT Smart Controller",
+    oids = [ "10:45:f8" ],
+    names = [ "BT Smart Controller" ],
+    service_uuids = [ ],
+    device_class = "ft_karussell.FtBtSmartDevice"))
+
+FT_BT_CONTROL_RECEIVER = register(ToyProfile(
+    "fischertechnik BT Control Receiver",
+    oids = [ "10:45:f8" ],
+    names = [ "BT Control Receiver" ],
+    service_uuids = [ ],
+    device_class = "ft_rc_racer.FtBtCtrlRcvDevice"))
+
+def identify(device, profiles=None):
+    # Profil eines gefundenen gatt.Device oder None. Mit profiles kann die
+    # Suche auf bestimmte Controller-Typen beschränkt werden
+    names = _by_oid.get(discovery.oid(device.mac_address))
+    if names is None:
+        return None
+    profile = names.get(device.alias())
+    if profile is None or (profiles is not None and profile not in profiles):
+        return None
+    return profile
+
+def identify_advertisement(mac_address, name, service_uuids=()):
+    # wie identify(), aber für bereits bekannte Advertisement-Daten. Passt
+    # der Name nicht, entscheidet die Service-UUID, sofern sie eindeutig ist
+    names = _by_oid.get(discovery.oid(mac_address))
+    if names is not None and name in names:
+        return names[name]
+    for uuid in service_uuids:
+        profiles = _by_uuid.get(uuid.lower())
+        if profiles is not None and len(profiles) == 1:
+            return profiles[0]
+    return None
+
+def device_class(device, profiles=None):
+    # Geräteklasse für einen gefundenen Controller, z.B. für MultiDeviceManager
+    profile = identify(device, profiles)
+    return profile.load_class() if profile else None
+
+def service_uuids(profiles):
+    # UUIDs für den Discovery-Filter von BlueZ. Ist ein Profil nicht per UUID
+    # erkennbar, darf nicht nach UUIDs gefiltert werden (Ergebnis None)
+    uuids = [ ]
+    for profile in profiles:
+        if not profile.service_uuids:
+            return None
+        uuids.extend(profile.service_uuids)
+    return uuids
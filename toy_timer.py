@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Zeitgesteuerte Aktionen im Thread der GLib-Hauptschleife.
+#
+# Die fischertechnik-Beispiele haben ihre Motorrampen in der Hauptschleife
+# des Programms mit thread.join(.1) getaktet. Jeder Schritt kam so 100 ms
+# plus Rechenzeit nach dem vorigen, die Fahrt wurde mit jeder Notifikation
+# etwas länger, und Hauptschleife und GLib-Thread haben gleichzeitig an
+# state und counter der Geräteklasse gearbeitet.
+#
+# Scheduler führt die Aktionen stattdessen im Thread aus, der auch die
+# Rückrufe von BlueZ ausführt:
+#
+#   scheduler = toy_timer.Scheduler(manager)
+#   timer = scheduler.every(0.01, step)     # step() liefert False zum Ende
+#   scheduler.call_later(2, stop)
+#   timer.cancel()
+#
+# Die Zeitpunkte sind absolut (time.monotonic). Ein periodischer Timer
+# plant den nächsten Schritt ab dem geplanten, nicht ab dem tatsächlichen
+# Zeitpunkt, Verspätungen summieren sich also nicht. Ist ein Schritt um mehr
+# als eine Periode zu spät, werden die verpassten Schritte übersprungen und
+# in Timer.missed gezählt, statt sie am Stück nachzuholen.
+#
+# Unter BlueZ wird immer nur eine GLib-Timeout-Quelle für den nächsten
+# fälligen Timer gehalten (Millisekunden-Auflösung, höhere Priorität als die
+# D-Bus-Meldungen). Mit offline_gatt.py läuft dasselbe über call_at() des
+# Managers. Die Verspätung jedes Schritts gegenüber seinem Zeitpunkt wird in
+# Scheduler.lateness gesammelt (µs, siehe latency.py).
+
+import time, math, heapq, itertools, threading
+
+import latency
+
+try:
+    from gi.repository import GLib
+except ModuleNotFoundError:
+    # nur offline_gatt.py
+    GLib = None
+
+class Timer:
+    __slots__ = ( "deadline", "period", "callback", "args", "cancelled", "missed", "runs" )
+
+    def __init__(self, deadline, period, callback, args):
+        self.deadline = deadline
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.missed = 0
+        self.runs = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, manager=None, clock=time.monotonic):
+        # manager ist der gatt.DeviceManager. Hat er call_at() (offline_gatt),
+        # wird darüber geplant, sonst über GLib
+        self.clock = clock
+        self.call_at_manager = getattr(manager, "call_at", None)
+        if self.call_at_manager is None and GLib is None:
+            raise RuntimeError("toy_timer braucht GLib oder offline_gatt")
+        self.timers = [ ]
+        self.sequence = itertools.count()
+        # Timer dürfen auch aus anderen Threads geplant werden
+        self.lock = threading.Lock()
+        self.armed = None           # Zeitpunkt der wartenden Timeout-Quelle
+        self.source = None          # deren GLib-ID
+        self.pending = set()        # offline: Zeitpunkte mit call_at() beim Manager
+        self.lateness = latency.Histogram()
+
+    def call_at(self, deadline, callback, *args):
+        return self.add(Timer(deadline, None, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        return self.add(Timer(self.clock() + delay, None, callback, args))
+
+    def every(self, period, callback, *args, start=None):
+        # callback(*args) alle period Sekunden, erstmals zu start bzw. nach
+        # einer Periode, bis er False liefert oder cancel() gerufen wird
+        deadline = self.clock() + period if start is None else start
+        return self.add(Timer(deadline, period, callback, args))
+
+    def add(self, timer):
+        with self.lock:
+            heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+            if self.armed is None or timer.deadline < self.armed:
+                self.arm(timer.deadline)
+        return timer
+
+    def arm(self, deadline):
+        # nur unter self.lock aufrufen
+        self.armed = deadline
+        if self.call_at_manager is not None:
+            # call_at() lässt sich nicht zurücknehmen, ältere Aufrufe laufen
+            # in expire_at() ins Leere
+            if deadline not in self.pending:
+                self.pending.add(deadline)
+                self.call_at_manager(deadline, self.expire_at, deadline)
+            return
+        if self.source is not None:
+            GLib.source_remove(self.source)
+        delay = max(0, math.ceil((deadline - self.clock()) * 1000))
+        self.source = GLib.timeout_add(delay, self.expire_glib, priority=GLib.PRIORITY_HIGH)
+
+    def expire_glib(self):
+        with self.lock:
+            self.source = None
+        self.expire()
+        # Quelle nicht wiederholen, arm() legt bei Bedarf eine neue an
+        return False
+
+    def expire_at(self, deadline):
+        with self.lock:
+            self.pending.discard(deadline)
+            if self.armed != deadline:
+                return
+        self.expire()
+
+    def expire(self):
+        # alle fälligen Timer ausführen
+        while True:
+            now = self.clock()
+            with self.lock:
+                self.armed = None
+                if not self.timers:
+                    return
+                deadline, _, timer = self.timers[0]
+                if deadline > now:
+                    self.arm(deadline)
+                    return
+                heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            self.lateness.record((now - deadline) * 1000000)
+            timer.runs += 1
+            result = timer.callback(*timer.args)
+            if timer.period is None or result is False or timer.cancelled:
+                continue
+            # nächster Schritt ab dem geplanten Zeitpunkt
+            timer.deadline = deadline + timer.period
+            if timer.deadline <= now:
+                missed = int((now - timer.deadline) / timer.period) + 1
+                timer.missed += missed
+                timer.deadline += missed * timer.period
+            with self.lock:
+                heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))